@@ -0,0 +1,1222 @@
+"""
+Benchmark Tools
+
+Holds timing functions for measuring how fast the cleaning and scraping pipeline runs, comparing the current
+implementations against the versions they replaced.
+"""
+
+import time
+import json
+import socket
+import platform
+import os
+import tempfile
+import tracemalloc
+import string
+import random
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy import sparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+from sklearn import svm
+from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.naive_bayes import BernoulliNB, MultinomialNB
+
+import cascade_tools
+import cleaning_tools
+import dataset_tools
+import dedup_tools
+import evaluation_tools
+import feature_tools
+import instrument_tools
+import label_tools
+import legacy_tools
+import online_tools
+import sampling_tools
+import search_tools
+import synthetic_tools
+from model_tools import ModelRegistry
+
+### HELPER FUNCTIONS
+
+### time_function()
+###
+### Runs func over a list of items a number of times and returns the best rate in items per second. The best of several
+### runs is used so that one-off pauses (garbage collection, other processes on the pi) do not skew the comparison.
+
+def time_function(func, items, repeats=3):
+    best = None
+
+    for i in range(repeats):
+        start = time.perf_counter()
+        func(items)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return len(items) / best if best > 0 else float('inf')
+
+### measure()
+###
+### Calls func once and returns its result, the wall time in seconds and the peak memory allocated during the call in
+### megabytes. Memory is tracked with tracemalloc, which sees numpy and pandas allocations as well as python objects.
+
+def measure(func, *args, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    try:
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+    return result, elapsed, peak
+
+### load_tweets()
+###
+### Reads the tweet column of a csv file (clean.csv, filtered2.csv or the train/test files) as a list of strings.
+
+def load_tweets(filename='clean.csv', column='tweet'):
+    return pd.read_csv(filename, usecols=[column])[column].dropna().astype(str).tolist()
+
+### BENCHMARKS
+
+### benchmark_cleaning_function_part_1()
+###
+### Compares tweets/sec of the original chain of re.sub() calls against TweetNormalizer on the tweets of a csv file, and
+### checks that both produce the same output.
+
+def benchmark_cleaning_function_part_1(filename='clean.csv', column='tweet', repeats=3):
+    tweets = load_tweets(filename, column)
+
+    before = time_function(lambda xs: [legacy_tools.cleaning_function_part_1(x) for x in xs], tweets, repeats)
+    after = time_function(cleaning_tools.tweet_normalizer.normalize_many, tweets, repeats)
+
+    identical = cleaning_tools.tweet_normalizer.normalize_many(tweets) == \
+        [legacy_tools.cleaning_function_part_1(x) for x in tweets]
+
+    print('cleaning_function_part_1:', len(tweets), 'tweets')
+    print('    before: %.0f tweets/sec' % before)
+    print('    after:  %.0f tweets/sec (%.1fx)' % (after, after / before))
+    print('    identical output:', identical)
+
+    return {'tweets': len(tweets), 'before': before, 'after': after, 'identical': identical}
+
+### benchmark_player_name_replacement()
+###
+### Compares the original loop of cleaning_total() (two DataFrame.apply(str.replace) calls over the whole column per
+### player name) against a single PlayerNameReplacer pass. names and lastnames default to the pybaseball lists used by
+### cleaning_total(); pass a shorter list to keep the old loop from running for hours on large files.
+
+def benchmark_player_name_replacement(filename='clean.csv', column='tweet', names=None, lastnames=None):
+    if names is None or lastnames is None:
+        names, lastnames = cleaning_tools.get_player_names()
+
+    data = pd.DataFrame({'clean2': cleaning_tools.tweet_normalizer.normalize_many(load_tweets(filename, column))})
+
+    def legacy_loop(data):
+        for i in range(len(names)):
+            data['clean2_no_names'] = data['clean2'].apply(lambda x: x.replace(names[i], ' baseballplayertoken '))
+            data['clean2_no_names'] = data['clean2'].apply(lambda x: x.replace(lastnames[i], ' baseballlastnametoken '))
+
+    start = time.perf_counter()
+    legacy_loop(data)
+    before = time.perf_counter() - start
+
+    start = time.perf_counter()
+    replacer = cleaning_tools.build_player_name_replacer(names, lastnames)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    replacer.replace_many(data['clean2'])
+    after = time.perf_counter() - start
+
+    print('player name replacement:', data.shape[0], 'tweets,', len(names), 'names')
+    print('    before: %.2f sec (%.0f tweets/sec)' % (before, data.shape[0] / before))
+    print('    after:  %.2f sec (%.0f tweets/sec), automaton built in %.2f sec' % (after, data.shape[0] / after, build))
+
+    return {'tweets': data.shape[0], 'names': len(names), 'before': before, 'after': after, 'build': build}
+
+### benchmark_merged_to_filtered()
+###
+### Compares the in-memory aggregation of merged_to_filtered() (aggregate_merged() on every file, then on all of them)
+### against stream_aggregate_merged() on a list of merged / twint csv files. Reports time, rows/sec and peak memory for
+### both, and checks that they produce the same rows.
+
+def benchmark_merged_to_filtered(files, chunksize=250000, partitions=16):
+    input_rows = sum(pd.read_csv(file, usecols=['link']).shape[0] for file in files)
+
+    def in_memory():
+        return cleaning_tools.aggregate_merged([cleaning_tools.aggregate_merged(file, 1) for file in files], 0)
+
+    before, before_time, before_peak = measure(in_memory)
+
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, 'filtered2.csv')
+        rows, after_time, after_peak = measure(cleaning_tools.stream_aggregate_merged, files, output, chunksize,
+                                               partitions)
+        after = pd.read_csv(output, dtype=cleaning_tools.filtered_dtypes)
+
+    key = ['link', 'tweet']
+    identical = before.sort_values(key).reset_index(drop=True).equals(after.sort_values(key).reset_index(drop=True))
+
+    print('merged_to_filtered:', input_rows, 'rows in,', rows, 'rows out')
+    print('    in memory: %.2f sec (%.0f rows/sec), peak %.1f MB' % (before_time, input_rows / before_time, before_peak))
+    print('    streaming: %.2f sec (%.0f rows/sec), peak %.1f MB (chunksize %d, %d partitions)'
+          % (after_time, input_rows / after_time, after_peak, chunksize, partitions))
+    print('    identical output:', identical)
+
+    return {'rows_in': input_rows, 'rows_out': rows, 'before': before_time, 'after': after_time,
+            'before_peak_mb': before_peak, 'after_peak_mb': after_peak, 'identical': identical}
+
+### benchmark_aggregate_merged()
+###
+### Regression check and benchmark for the vectorized flag columns of aggregate_merged(). First the flags of
+### add_flag_columns() are compared with the original apply(lambda) version on awkward values ('[]', '', '[[]]', missing
+### values, retweet as text), then the original aggregate_merged() (every column read, apply(lambda) flags, int64
+### counts) is timed against the current one (merged_columns read with merged_dtypes, vectorized flags, int32 / int8
+### columns) on a list of merged / twint csv files. Reports time, rows/sec and peak memory for both and checks that they
+### produce the same rows.
+
+def benchmark_aggregate_merged(files):
+    awkward = pd.DataFrame({'urls': ['[]', '', '[[]]', None, "['https://t.co/x']", '][', '[]'],
+                            'photos': ['[]', "['https://pbs.twimg.com/a.jpg']", None, '[', ']', '[]', '[]'],
+                            'retweet': [True, False, None, 'False', 0, 1, False]})
+    flag_columns = ['link_present', 'photo_present', 'retweet']
+    expected = legacy_tools.add_flag_columns(awkward.copy())[flag_columns].astype(int)
+    flags_identical = all(cleaning_tools.add_flag_columns(data)[flag_columns].astype(int).equals(expected)
+                          for data in [awkward.copy(), awkward.astype({'urls': 'category', 'photos': 'category'})])
+
+    input_rows = sum(pd.read_csv(file, usecols=['link']).shape[0] for file in files)
+
+    def legacy():
+        return legacy_tools.aggregate_merged([legacy_tools.aggregate_merged(file, 1) for file in files], 0)
+
+    def current():
+        return cleaning_tools.aggregate_merged([cleaning_tools.aggregate_merged(file, 1) for file in files], 0)
+
+    before, before_time, before_peak = measure(legacy)
+    after, after_time, after_peak = measure(current)
+
+    identical = before.equals(after.astype(before.dtypes.to_dict()))
+
+    print('aggregate_merged:', input_rows, 'rows in,', after.shape[0], 'rows out')
+    print('    apply(lambda): %.2f sec (%.0f rows/sec), peak %.1f MB' % (before_time, input_rows / before_time,
+                                                                           before_peak))
+    print('    vectorized:    %.2f sec (%.0f rows/sec), peak %.1f MB' % (after_time, input_rows / after_time,
+                                                                           after_peak))
+    print('    identical flags on awkward values:', flags_identical)
+    print('    identical output:', identical)
+
+    return {'rows_in': input_rows, 'rows_out': after.shape[0], 'before': before_time, 'after': after_time,
+            'before_peak_mb': before_peak, 'after_peak_mb': after_peak, 'flags_identical': flags_identical,
+            'identical': identical}
+
+### benchmark_parallel_cleaning()
+###
+### Times the clean_text() and cleaning_total() steps of filtered_to_clean() with map_in_batches() at each worker count,
+### reporting tweets/sec and speedup over one worker, and checks that every worker count gives the same output as one
+### worker. names and lastnames default to the pybaseball lists.
+
+def benchmark_parallel_cleaning(filename='clean.csv', column='tweet', worker_counts=(1, 2, 4, 8), batch_size=2000,
+                                names=None, lastnames=None):
+    tweets = load_tweets(filename, column)
+    replacer = cleaning_tools.build_player_name_replacer(names, lastnames)
+    results = []
+    serial = None
+
+    print('parallel cleaning:', len(tweets), 'tweets')
+
+    for workers in worker_counts:
+        start = time.perf_counter()
+        clean = cleaning_tools.map_in_batches(cleaning_tools._clean_text_batch, tweets, workers, batch_size)
+        clean2 = cleaning_tools.map_in_batches(cleaning_tools._cleaning_total_batch, tweets, workers, batch_size,
+                                               replacer)
+        elapsed = time.perf_counter() - start
+
+        if serial is None:
+            serial = (elapsed, clean, clean2)
+
+        identical = clean == serial[1] and clean2 == serial[2]
+        results.append({'workers': workers, 'seconds': elapsed, 'tweets_per_sec': len(tweets) / elapsed,
+                        'speedup': serial[0] / elapsed, 'identical': identical})
+        print('    %2d workers: %.2f sec (%.0f tweets/sec, %.1fx), identical output: %s'
+              % (workers, elapsed, len(tweets) / elapsed, serial[0] / elapsed, identical))
+
+    return results
+
+### benchmark_text_cleaner()
+###
+### Compares clean_text() and cleaning_function_part_2() as they were (loading stopwords, a stemmer and the contraction
+### expression for every tweet) against a TextCleaner, and checks that both produce the same output. The TextCleaner
+### is created fresh so that its stem cache starts empty.
+
+def benchmark_text_cleaner(filename='clean.csv', column='tweet', repeats=3):
+    tweets = load_tweets(filename, column)
+    normalized = cleaning_tools.tweet_normalizer.normalize_many(tweets)
+    cleaner = cleaning_tools.TextCleaner()
+    results = {'tweets': len(tweets)}
+
+    print('text cleaner:', len(tweets), 'tweets')
+
+    for name, legacy, current, items in [('clean_text', legacy_tools.clean_text, cleaner.clean_many, tweets),
+                                         ('cleaning_function_part_2', legacy_tools.cleaning_function_part_2,
+                                          cleaner.clean_part_2_many, normalized)]:
+        before = time_function(lambda xs: [legacy(x) for x in xs], items, repeats)
+        after = time_function(current, items, repeats)
+        identical = current(items) == [legacy(x) for x in items]
+
+        results[name] = {'before': before, 'after': after, 'identical': identical}
+        print('    %s: %.0f -> %.0f tweets/sec (%.1fx), identical output: %s'
+              % (name, before, after, after / before, identical))
+
+    results['stem_cache_size'] = len(cleaner.stems)
+    print('    stem cache:', len(cleaner.stems), 'tokens')
+
+    return results
+
+### FakeSearchBackend
+###
+### Local stand-in for twint_account_search(). Each search sleeps for `latency` seconds, raises ValueError for accounts
+### in `broken`, and fails with a ConnectionError `failure_rate` of the time so that retries are exercised. Every call is
+### recorded in self.calls; nothing is written to disk.
+
+class FakeSearchBackend:
+
+    def __init__(self, latency=0.05, failure_rate=0.0, broken=(), seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.broken = set(broken)
+        self.random = random.Random(seed)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, username, since, output):
+        with self.lock:
+            self.calls.append(username)
+            fail = self.random.random() < self.failure_rate
+
+        time.sleep(self.latency)
+
+        if username in self.broken:
+            raise ValueError('Cannot find twitter account')
+        if fail:
+            raise ConnectionError('simulated network failure')
+
+### benchmark_account_scheduler()
+###
+### Compares the accounts/hour of the old sequential loop (a search followed by a fixed sleep) against the asyncio
+### scheduler on a FakeSearchBackend. Latency and sleep are scaled down so the benchmark runs in seconds; the rates are
+### scaled back up to real time by `scale` (e.g. latency=0.05 with scale=100 stands for 5 second searches). rate is the
+### token bucket rate in the same scaled time, and defaults to one search per `sleep` - the same spacing between
+### searches as the old loop, so the gain comes only from overlapping the searches themselves.
+
+def benchmark_account_scheduler(accounts=200, latency=0.05, sleep=0.15, scale=100, concurrency=4, rate=None,
+                                failure_rate=0.0):
+    import scraping_tools
+    userids = ['account%d' % i for i in range(accounts)]
+    rate = 1 / sleep if rate is None else rate
+
+    backend = FakeSearchBackend(latency)
+    start = time.perf_counter()
+    for userid in userids:
+        backend(userid, '', '')
+        time.sleep(sleep)
+    before = accounts / (time.perf_counter() - start) * 3600 / scale
+
+    backend = FakeSearchBackend(latency, failure_rate)
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint = os.path.join(directory, 'checkpoint.json')
+        start = time.perf_counter()
+        state = asyncio.run(scraping_tools.run_account_scrape(userids, backend, 'benchmark', checkpoint, concurrency,
+                                                              rate, retries=3, backoff=latency))
+        after = accounts / (time.perf_counter() - start) * 3600 / scale
+
+    print('account scheduler:', accounts, 'accounts, %.2fs searches' % (latency * scale))
+    print('    sequential: %.0f accounts/hour' % before)
+    print('    scheduler:  %.0f accounts/hour (%d concurrent, %.2f searches/sec allowed)'
+          % (after, concurrency, rate / scale))
+    print('    scraped %d, broken %d, failed %d, %d search calls'
+          % (len(state['done']), len(state['broken']), len(state['failed']), len(backend.calls)))
+
+    return {'accounts': accounts, 'before': before, 'after': after, 'done': len(state['done']),
+            'failed': len(state['failed']), 'calls': len(backend.calls)}
+
+### FakeDriveServer
+###
+### Local stand-in for the docs.google.com/uc download endpoint, serving a dictionary of {file id: bytes}. Like Drive it
+### answers files larger than confirm_above with a warning page and a download_warning cookie, and only sends the file
+### once the request carries the cookie's token as 'confirm'. Range requests are answered with 206 and the rest of the
+### file. Every request waits `latency` seconds and bodies are sent at up to `bandwidth` bytes/sec; with drop_after,
+### the first response for each file is cut off after that many bytes so resuming can be exercised.
+
+class FakeDriveServer:
+
+    def __init__(self, files, latency=0.05, bandwidth=None, confirm_above=1048576, drop_after=None):
+        self.files = files
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.confirm_above = confirm_above
+        self.drop_after = drop_after
+        self.dropped = set()
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self.url = 'http://127.0.0.1:%d/uc?export=download' % self.server.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _make_handler(self):
+        fake = self
+
+        class DriveHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                file_id = query.get('id', [''])[0]
+                time.sleep(fake.latency)
+
+                with fake.lock:
+                    fake.requests.append((file_id, self.headers.get('Range')))
+
+                if file_id not in fake.files:
+                    self.send_error(404)
+                    return
+
+                content = fake.files[file_id]
+                if len(content) > fake.confirm_above and query.get('confirm', [''])[0] != 'token' + file_id:
+                    page = b'<html>Google Drive can\'t scan this file for viruses.</html>'
+                    self.send_response(200)
+                    self.send_header('Set-Cookie', 'download_warning_%s=token%s' % (file_id, file_id))
+                    self.send_header('Content-Length', str(len(page)))
+                    self.end_headers()
+                    self.wfile.write(page)
+                    return
+
+                offset = 0
+                if self.headers.get('Range'):
+                    offset = int(self.headers['Range'].split('=')[1].split('-')[0])
+                    if offset >= len(content):
+                        self.send_response(416)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes %d-%d/%d' % (offset, len(content) - 1, len(content)))
+                else:
+                    self.send_response(200)
+
+                body = content[offset:]
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+
+                with fake.lock:
+                    drop = fake.drop_after is not None and file_id not in fake.dropped
+                    if drop:
+                        fake.dropped.add(file_id)
+                if drop:
+                    body = body[:fake.drop_after]
+
+                for i in range(0, len(body), 65536):
+                    self.wfile.write(body[i:i + 65536])
+                    if fake.bandwidth:
+                        time.sleep(min(65536, len(body) - i) / fake.bandwidth)
+
+                if drop:
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        return DriveHandler
+
+### benchmark_drive_transfers()
+###
+### Downloads a set of random files from a FakeDriveServer with one worker (the old file-at-a-time behaviour) and with
+### a pool of workers, then runs the download again to show unchanged files being skipped, and finally downloads with
+### every first response cut off half way to check that the files are resumed rather than started over. Each copy is
+### checked against the served bytes.
+
+def benchmark_drive_transfers(files=8, size=2097152, latency=0.05, bandwidth=8388608, workers=4):
+    import scraping_tools
+    content = {'file%d' % i: random.Random(i).randbytes(size) for i in range(files)}
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        def run(label, folder, manager):
+            jobs = [(file_id, os.path.join(directory, folder, file_id)) for file_id in content]
+            os.makedirs(os.path.join(directory, folder), exist_ok=True)
+            start = time.perf_counter()
+            reports = manager.run(manager.download, jobs)
+            elapsed = time.perf_counter() - start
+            for file_id, destination in jobs:
+                with open(destination, 'rb') as file:
+                    assert file.read() == content[file_id], destination
+            results[label] = {'seconds': elapsed, 'bytes_per_sec': sum(r['bytes'] for r in reports) / elapsed,
+                              'statuses': [r['status'] for r in reports]}
+
+        manifest = scraping_tools.TransferManifest(os.path.join(directory, 'manifest.json'))
+
+        with FakeDriveServer(content, latency, bandwidth) as server:
+            run('sequential', 'sequential', scraping_tools.TransferManager(1, manifest, server.url, refresh=True))
+            run('pool', 'pool', scraping_tools.TransferManager(workers, manifest, server.url, refresh=True))
+            run('skipped', 'pool', scraping_tools.TransferManager(workers, manifest, server.url))
+
+        with FakeDriveServer(content, latency, bandwidth, drop_after=size // 2) as server:
+            resume_manifest = scraping_tools.TransferManifest(os.path.join(directory, 'resume.json'))
+            run('resumed', 'resumed', scraping_tools.TransferManager(workers, resume_manifest, server.url, backoff=0))
+            ranged = sum(1 for file_id, byte_range in server.requests if byte_range)
+
+    print('drive transfers:', files, 'files of', size, 'bytes')
+    for label in ['sequential', 'pool', 'skipped', 'resumed']:
+        print('    %-10s %6.2fs %10.0f KB/s  %s' % (label, results[label]['seconds'],
+                                                  results[label]['bytes_per_sec'] / 1024,
+                                                  ', '.join(sorted(set(results[label]['statuses'])))))
+    print('    %d range requests after dropped connections' % ranged)
+
+    return results
+
+### _measure_read()
+###
+### Reads a dataset from a storage backend and returns the wall time, the peak memory in megabytes and the number of
+### rows. Run in a fresh process by benchmark_storage() so that every read starts from the same state. pyarrow allocates
+### outside of tracemalloc's view, so the peak of its memory pool is added on.
+
+def _measure_read(storage_format, directory, name, columns):
+    if storage_format == 'csv':
+        storage = dataset_tools.CsvStorage(directory)
+    else:
+        storage = dataset_tools.ParquetStorage(directory)
+
+    data, seconds, peak = measure(storage.read, name, columns)
+    if dataset_tools.pa is not None:
+        peak = peak + (dataset_tools.pa.default_memory_pool().max_memory() or 0) / 2 ** 20
+
+    return seconds, peak, data.shape[0]
+
+### benchmark_storage()
+###
+### Converts the filtered2 and clean csv files in a directory to Parquet and compares the two backends: file size, and the
+### load time and peak memory of reading every column and of reading only the given columns. Each read runs in its own
+### process. Needs pyarrow.
+
+def benchmark_storage(directory='', names=('filtered2', 'clean'), columns=('injury_report', 'tweet')):
+    csv = dataset_tools.CsvStorage(directory)
+    names = [name for name in names if csv.exists(name)]
+    context = multiprocessing.get_context('spawn')
+    results = {}
+
+    with tempfile.TemporaryDirectory() as parquet_directory:
+        parquet = dataset_tools.ParquetStorage(parquet_directory)
+        dataset_tools.convert_datasets(csv, parquet, names, merged=False)
+
+        for name in names:
+            results[name] = {}
+            for storage in [csv, parquet]:
+                location = directory if storage is csv else parquet_directory
+                entry = {'size_mb': os.path.getsize(storage.path(name)) / 2 ** 20}
+
+                for label, selected in [('all', None), ('columns', list(columns))]:
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                        seconds, peak, rows = pool.submit(_measure_read, storage.format, location, name,
+                                                          selected).result()
+                    entry[label] = {'seconds': seconds, 'peak_mb': peak, 'rows': rows}
+
+                results[name][storage.format] = entry
+
+    for name in names:
+        print(name + ':', results[name]['csv']['all']['rows'], 'rows')
+        for storage_format in ['csv', 'parquet']:
+            entry = results[name][storage_format]
+            print('    %-8s %8.1f MB   all columns %6.2fs peak %7.1f MB   %s %6.2fs peak %7.1f MB'
+                  % (storage_format, entry['size_mb'], entry['all']['seconds'], entry['all']['peak_mb'],
+                     '/'.join(columns), entry['columns']['seconds'], entry['columns']['peak_mb']))
+
+    return results
+
+### benchmark_feature_store()
+###
+### Compares transforming the cleaned text of a csv file with a fitted vectorizer every time against a FeatureStore:
+### the first build, a memory-mapped load once saved, and an update after new_fraction of new tweets are added to the
+### dataset (only the new ones are transformed). Each matrix from the store is checked against a plain transform.
+### vectorizers maps feature types to fitted vectorizers; by default a tfidf and a count vectorizer are fitted on the
+### text.
+
+def benchmark_feature_store(filename='clean.csv', column='clean', vectorizers=None, new_fraction=0.05):
+    from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+
+    texts = load_tweets(filename, column)
+    split = int(len(texts) * (1 - new_fraction))
+    old_texts = texts[:split]
+
+    if vectorizers is None:
+        vectorizers = {'tfidf': TfidfVectorizer().fit(texts), 'count': CountVectorizer().fit(texts)}
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        store = feature_tools.FeatureStore(directory)
+
+        def timed(func, *args):
+            start = time.perf_counter()
+            result = func(*args)
+            return result, time.perf_counter() - start
+
+        for feature_type, vectorizer in vectorizers.items():
+            expected, transform_time = timed(vectorizer.transform, texts)
+            _, build_time = timed(store.matrix, 'benchmark', feature_type, old_texts, vectorizer)
+            updated, update_time = timed(store.matrix, 'benchmark', feature_type, texts, vectorizer)
+            loaded, load_time = timed(store.matrix, 'benchmark', feature_type, texts, vectorizer)
+
+            identical = (updated != expected).nnz == 0 and (loaded != expected).nnz == 0
+            results[feature_type] = {'transform': transform_time, 'build': build_time, 'update': update_time,
+                                     'load': load_time, 'identical': identical}
+
+        print('feature store:', len(texts), 'rows,', len(texts) - split, 'new')
+        for feature_type, entry in results.items():
+            print('    %-6s transform %.3fs   first build %.3fs   update %.3fs   mapped load %.3fs   identical: %s'
+                  % (feature_type, entry['transform'], entry['build'], entry['update'], entry['load'],
+                     entry['identical']))
+        store.report()
+
+    return results
+
+### benchmark_sampler()
+###
+### Compares the peak memory and time of picking samples to label the old way (all of filtered2 read, the unlabeled
+### tweets deduplicated, 1,000 sampled and 100,000 screened) against sampling_tools.sample_pool() streaming the same file
+### chunksize rows at a time, for a pool made of the file repeated `copies` times. The model is replaced by a fixed
+### pseudo-random score, so only the sampling itself is timed.
+
+def benchmark_sampler(filename='filtered2.csv', copies=(1, 4), chunksize=250000, screen_size=100000):
+    def fake_score(tweets):
+        return sampling_tools.tweet_priorities(tweets, 0) / 2.0 ** 64
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for count in copies:
+            pool = os.path.join(directory, 'pool.csv')
+            data = pd.read_csv(filename, usecols=['injury_report', 'tweet'])
+            for copy in range(count):
+                data.to_csv(pool, mode='w' if copy == 0 else 'a', header=copy == 0, index=False)
+            del data
+
+            def full_load():
+                data = pd.read_csv(pool)
+                data = data[data['injury_report'] == 'x'].drop_duplicates().dropna()
+                sampled = data.sample(min(1000, len(data)))
+                screened = data.sample(min(screen_size, len(data)))
+                return sampled, screened[fake_score(screened['tweet'].tolist()) > 0.5]
+
+            def streaming():
+                return sampling_tools.sample_pool(pd.read_csv(pool, usecols=['injury_report', 'tweet'],
+                                                              chunksize=chunksize),
+                                                  1000, 1000, 'positive', fake_score, screen_size)
+
+            _, before_time, before_peak = measure(full_load)
+            _, after_time, after_peak = measure(streaming)
+            results[count] = {'before': before_time, 'after': after_time, 'before_peak_mb': before_peak,
+                              'after_peak_mb': after_peak}
+
+    print('sampling to label from', filename)
+    for count, entry in results.items():
+        print('    pool x%d: full load %.2fs peak %.1f MB, streaming %.2fs peak %.1f MB'
+              % (count, entry['before'], entry['before_peak_mb'], entry['after'], entry['after_peak_mb']))
+
+    return results
+
+### benchmark_label_propagation()
+###
+### Times label_new_data() and label_filtered_duplicates() on filtered2 the old way (one merge per label file, and
+### filtered2's own labels written to copy.csv and merged back) against label_tools.propagate_labels(), and checks that
+### both give the same labels. The label files are made up from `samples` random tweets of filtered2, labeled at random.
+### Exact text matching is used for the check, since the old merge did not normalize the text.
+
+def benchmark_label_propagation(filename='filtered2.csv', samples=2000, seed=0):
+    data = pd.read_csv(filename)
+    tweets = data['tweet'].dropna().drop_duplicates()
+    state = random.Random(seed)
+
+    def label_file(count):
+        chosen = tweets.sample(min(count, len(tweets)), random_state=state.randrange(2 ** 32))
+        return pd.DataFrame({'injury_report': [state.choice(['0', '1']) for _ in range(len(chosen))],
+                             'tweet': chosen.values})
+
+    sources = [('positive_samples.csv', label_file(samples)), ('sampled.csv', label_file(samples))]
+
+    def legacy():
+        filtered = data.copy()
+        filtered = legacy_tools.append_labels(filtered, sources[1][1])
+        labeled = legacy_tools.append_labels(filtered, sources[0][1])
+        copies = labeled[labeled['injury_report'] != 'x'][['tweet', 'injury_report']].drop_duplicates()
+        return labeled, legacy_tools.append_labels(labeled.copy(), copies)
+
+    def current():
+        labeled, changed = label_tools.propagate_labels(data.copy(), sources, normalize=None)
+        filtered, duplicates = label_tools.propagate_labels(labeled.copy(), [('duplicates',
+                                                                               labeled[['injury_report', 'tweet']])],
+                                                            fill_only=True, normalize=None)
+        return labeled, filtered, dict(changed, **duplicates)
+
+    (before_labeled, before), before_time, before_peak = measure(legacy)
+    (after_labeled, after, changed), after_time, after_peak = measure(current)
+
+    # Copies of a tweet holding different labels made the old copy.csv merge add a row per label, so only the label
+    # files are compared, and the extra rows are counted.
+    identical = before_labeled['injury_report'].map(dataset_tools._label).equals(after_labeled['injury_report'])
+    extra_rows = before.shape[0] - after.shape[0]
+
+    print('label propagation:', data.shape[0], 'rows,', samples, 'tweets per label file')
+    print('    merges:     %.2f sec, peak %.1f MB' % (before_time, before_peak))
+    print('    hash join:  %.2f sec, peak %.1f MB' % (after_time, after_peak))
+    for name, count in changed.items():
+        print('    %s: %d rows relabeled' % (name, count))
+    print('    identical labels:', identical)
+    print('    rows added by the old duplicate labeling:', extra_rows)
+
+    return {'rows': data.shape[0], 'before': before_time, 'after': after_time, 'before_peak_mb': before_peak,
+            'after_peak_mb': after_peak, 'changed': changed, 'identical': identical, 'extra_rows': extra_rows}
+
+### benchmark_near_duplicates()
+###
+### Checks the NearDuplicateIndex on the tweets of a csv file with near-duplicates made up for `originals` of them (a
+### retweet prefix, a different hyperlink or an emoji added):
+###
+###     1. How many of the made up copies land in the cluster of their original, and the time to build the index.
+###     2. On a sample of `compared` tweets, the pairs at or above threshold found by comparing every pair's shingles
+###         exactly against the pairs the index puts in one cluster, and the time of each.
+###     3. That adding the tweets in two halves, with the index saved and loaded in between, gives the same clusters as
+###         adding them all at once.
+
+def benchmark_near_duplicates(filename='clean.csv', column='tweet', originals=2000, compared=3000, threshold=0.8,
+                              seed=0):
+    tweets = list(dict.fromkeys(load_tweets(filename, column)))
+    state = random.Random(seed)
+    edits = [lambda x: 'RT @' + state.choice(['MLB', 'Yankees', 'Cubs', 'espn']) + ': ' + x,
+             lambda x: x + ' https://t.co/' + ''.join(state.choice(string.ascii_letters) for _ in range(10)),
+             lambda x: x + ' \U0001F602']
+    chosen = state.sample(range(len(tweets)), min(originals, len(tweets)))
+    copies = [state.choice(edits)(tweets[i]) for i in chosen]
+    everything = tweets + copies
+
+    index = dedup_tools.NearDuplicateIndex(directory=None, threshold=threshold)
+    start = time.perf_counter()
+    clusters = index.add(everything)
+    build_time = time.perf_counter() - start
+    found = clusters[len(tweets):] == clusters[chosen]
+
+    # Copies of short tweets can fall below threshold, so the copies which are still near-duplicates are counted apart.
+    similar = np.array([len(set(dedup_tools.tweet_shingles(tweets[i])) & set(dedup_tools.tweet_shingles(copy))) /
+                        len(set(dedup_tools.tweet_shingles(tweets[i])) | set(dedup_tools.tweet_shingles(copy)))
+                        >= threshold for i, copy in zip(chosen, copies)])
+
+    # Every pair of the sample compared exactly, through a tweets x shingles matrix.
+    sample = state.sample(everything, min(compared, len(everything)))
+    start = time.perf_counter()
+    shingles = [dedup_tools.tweet_shingles(tweet, index.shingle_size) for tweet in sample]
+    vocabulary = {}
+    columns = [[vocabulary.setdefault(shingle, len(vocabulary)) for shingle in entry] for entry in shingles]
+    matrix = sparse.csr_matrix((np.ones(sum(len(entry) for entry in columns)),
+                                np.concatenate([np.array(entry, dtype=np.int64) for entry in columns]),
+                                np.concatenate([[0], np.cumsum([len(entry) for entry in columns])])),
+                               shape=(len(sample), len(vocabulary)))
+    overlap = (matrix @ matrix.T).toarray()
+    sizes = np.array([len(entry) for entry in shingles])
+    jaccard = overlap / (sizes[:, None] + sizes[None, :] - overlap)
+    exact_pairs = set(zip(*np.nonzero(np.triu(jaccard >= threshold, 1))))
+    exact_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sample_clusters = dedup_tools.NearDuplicateIndex(directory=None, threshold=threshold).add(sample)
+    index_time = time.perf_counter() - start
+    index_pairs = set(zip(*np.nonzero(np.triu(sample_clusters[:, None] == sample_clusters[None, :], 1))))
+
+    # Exact copies of the same tokens are always clustered, so they are left out of the pair counts.
+    same_tokens = set(zip(*np.nonzero(np.triu(jaccard == 1, 1))))
+    exact_pairs, index_pairs = exact_pairs - same_tokens, index_pairs - same_tokens
+    recall = len(exact_pairs & index_pairs) / max(len(exact_pairs), 1)
+    precision = len(exact_pairs & index_pairs) / max(len(index_pairs), 1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        half = len(everything) // 2
+        incremental = dedup_tools.NearDuplicateIndex(directory, threshold=threshold)
+        incremental.add(everything[:half])
+        incremental.save()
+        incremental = dedup_tools.NearDuplicateIndex(directory, threshold=threshold)
+        start = time.perf_counter()
+        incremental.add(everything[half:])
+        increment_time = time.perf_counter() - start
+        identical = bool((incremental.add(everything) == clusters).all())
+
+    print('near duplicates:', len(tweets), 'tweets and', len(copies), 'made up copies,', len(index), 'rows indexed,',
+          index.bands, 'bands of', index.rows)
+    print('    index build: %.2f sec (%.0f tweets/sec)' % (build_time, len(everything) / build_time))
+    print('    copies found with their original: %.1f%% of all, %.1f%% of the %d at or above threshold'
+          % (100 * found.mean(), 100 * found[similar].mean(), similar.sum()))
+    print('    %d tweets compared: every pair %.2f sec, index %.2f sec' % (len(sample), exact_time, index_time))
+    print('    pairs at or above %.2f: %d exact, %d clustered, recall %.3f, precision %.3f'
+          % (threshold, len(exact_pairs), len(index_pairs), recall, precision))
+    print('    adding the second half to a saved index: %.2f sec, same clusters: %s' % (increment_time, identical))
+
+    return {'build': build_time, 'found': found.mean(), 'found_similar': found[similar].mean(), 'exact': exact_time,
+            'index': index_time, 'recall': recall,
+            'precision': precision, 'increment': increment_time, 'identical': identical}
+
+### benchmark_evaluation()
+###
+### Times evaluate_model_outputs() on the 'Model Outputs' folder against predicting and counting once per model and
+### threshold, and checks that both give the same metrics at every threshold. The '_fp_tweets' / '_fn_tweets' files are
+### written to a copy of the folder and compared with the ones already there.
+
+def benchmark_evaluation(directory='../Model Outputs', test='../../Data/test 25-08.csv', thresholds=4001):
+    names, runs, logits = evaluation_tools.load_model_outputs(directory)
+    labels, _ = evaluation_tools.load_test_labels(test)
+    margins = evaluation_tools.logit_margins(logits)
+
+    sweep, sweep_time, _ = measure(evaluation_tools.threshold_sweep, margins, labels, thresholds)
+    start = time.perf_counter()
+    legacy = [[legacy_tools.threshold_metrics(row, labels, threshold) for threshold in sweep['thresholds']]
+              for row in margins]
+    legacy_time = time.perf_counter() - start
+    same_metrics = all(np.allclose([[entry[name] for entry in row] for row in legacy], sweep[name])
+                       for name in evaluation_tools.metric_names)
+
+    with tempfile.TemporaryDirectory() as copy:
+        for name in set(names):
+            os.makedirs(os.path.join(copy, name))
+        for name, run in zip(names, runs):
+            logits_file = os.path.join(name, run + '_model_outputs.csv')
+            with open(os.path.join(directory, logits_file), 'rb') as source:
+                with open(os.path.join(copy, logits_file), 'wb') as target:
+                    target.write(source.read())
+
+        result, total_time, peak = measure(evaluation_tools.evaluate_model_outputs, copy, test, thresholds)
+
+        same_files = True
+        for name, run in zip(names, runs):
+            for kind in ['fp', 'fn']:
+                written = os.path.join(name, run + '_' + kind + '_tweets.csv')
+                if os.path.exists(os.path.join(directory, written)):
+                    with open(os.path.join(directory, written), 'rb') as old:
+                        with open(os.path.join(copy, written), 'rb') as new:
+                            same_files = same_files and old.read() == new.read()
+
+    print('evaluation:', len(names), 'models,', len(result['metrics']) - len(names), 'ensembles,', len(labels),
+          'tweets,', len(sweep['thresholds']), 'thresholds')
+    print('    sweep one threshold at a time: %.2f sec' % legacy_time)
+    print('    sweep from sorted counts: %.4f sec (%.0fx faster), same metrics: %s'
+          % (sweep_time, legacy_time / sweep_time, same_metrics))
+    print('    evaluate_model_outputs: %.3f sec, peak %.1f MB, same fp / fn files: %s' % (total_time, peak, same_files))
+
+    return {'legacy': legacy_time, 'sweep': sweep_time, 'total': total_time, 'peak': peak,
+            'same_metrics': same_metrics, 'same_files': same_files}
+
+### _full_retrain()
+###
+### Fits the bool, count and tfidf vectorizers and the four models trained online from scratch, the way the notebook
+### does with its best settings, and returns {model name: (model, vectorizer)}.
+
+def _full_retrain(texts, labels):
+    vectorizers = {'tfidf': TfidfVectorizer().fit(texts), 'bool': CountVectorizer(binary=True).fit(texts),
+                   'count': CountVectorizer().fit(texts)}
+    models = {'logistic_regression': LogisticRegression(class_weight='balanced', solver='liblinear'),
+              'svm': svm.SVC(kernel='linear'), 'bernoulliNB': BernoulliNB(alpha=0.01),
+              'multinomialNB': MultinomialNB(alpha=0.01)}
+
+    matrices = {feature_type: vectorizer.transform(texts) for feature_type, vectorizer in vectorizers.items()}
+    fitted = {}
+    for name, model in models.items():
+        feature_type = online_tools._feature_type(name)
+        fitted[name] = (model.fit(matrices[feature_type], labels), vectorizers[feature_type])
+    return fitted
+
+### benchmark_online_training()
+###
+### Splits the labeled rows of a csv file with a 'clean' column into a test set, a first training set (`initial` of
+### the rest) and `batches` batches of new labels, as label_new_data() would add them. After the first training set and
+### after every batch, the models are retrained from scratch on everything labeled so far and updated online with the
+### new batch only (saved as a version, as update_online_models() does). Reports the seconds each takes and the
+### accuracy and F1 score of every model on the test set.
+
+def benchmark_online_training(filename='clean.csv', column='clean', initial=0.5, batches=5, test_fraction=0.2,
+                              n_features=2 ** 18, passes=5, seed=0):
+    data = pd.read_csv(filename, usecols=['injury_report', 'tweet', column]).dropna()
+    data = data[data['injury_report'].astype(str) != 'x']
+    data = data.assign(injury_report=data['injury_report'].astype(float).astype(int))
+    data = data.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+    test = data[:int(len(data) * test_fraction)]
+    train = data[len(test):]
+    first = int(len(train) * initial)
+    bounds = [0, first] + [int(bound) for bound in np.linspace(first, len(train), batches + 1)[1:]]
+    test_labels = test['injury_report'].values
+
+    def scores(predictions):
+        metrics = evaluation_tools.confusion_metrics(*evaluation_tools.confusion_counts(predictions, test_labels))
+        return float(metrics['accuracy']), float(metrics['f1'])
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        trainer = online_tools.OnlineTrainer(directory, n_features=n_features, seed=seed)
+
+        for step in range(len(bounds) - 1):
+            seen = train[:bounds[step + 1]]
+            new = train[bounds[step]:bounds[step + 1]]
+
+            start = time.perf_counter()
+            retrained = _full_retrain(seen[column].values, seen['injury_report'].values)
+            retrain_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            trainer.update(new[column].values, new['injury_report'].values,
+                           online_tools.row_keys(new['tweet'], new['injury_report']), passes if step == 0 else 1,
+                           seed=seed + step)
+            trainer.save()
+            online_time = time.perf_counter() - start
+
+            for name, (model, vectorizer) in retrained.items():
+                online_vectorizer = trainer.vectorizers[online_tools._feature_type(name)]
+                retrain_accuracy, retrain_f1 = scores(model.predict(vectorizer.transform(test[column].values)))
+                online_accuracy, online_f1 = scores(
+                    trainer.models[name].predict(online_vectorizer.transform(test[column].values)))
+                results.append({'step': step, 'rows': len(seen), 'new': len(new), 'model': name,
+                                'retrain_sec': retrain_time, 'online_sec': online_time,
+                                'retrain_accuracy': retrain_accuracy, 'online_accuracy': online_accuracy,
+                                'retrain_f1': retrain_f1, 'online_f1': online_f1})
+
+    results = pd.DataFrame(results)
+    print('online training:', len(train), 'training rows,', len(test), 'test rows, first', first, 'then', batches,
+          'batches')
+    print(results.round(4).to_string(index=False))
+    updates = results[results['step'] > 0].drop_duplicates('step')
+    print('    per batch of new labels: retrain %.2f sec, online update %.2f sec (%.0fx faster)'
+          % (updates['retrain_sec'].mean(), updates['online_sec'].mean(),
+             updates['retrain_sec'].mean() / updates['online_sec'].mean()))
+
+    return results
+
+### benchmark_model_search()
+###
+### Runs search_models() on a csv file with a 'clean' column at each worker count and reports the wall time, speedup and
+### efficiency over one worker, and checks that every worker count gives the same scores. The jobs are also run on the
+### largest worker count in the opposite order (shortest first), to show what the longest first order saves. grids
+### defaults to a small grid per model so the benchmark runs in minutes rather than the hours of the full search.
+
+def benchmark_model_search(filename='clean.csv', column='clean', worker_counts=(1, 2, 4, 8), folds=4, grids=None,
+                           seed=0):
+    if grids is None:
+        grids = {'kNN_tfidf': {'weights': ['distance'], 'n_neighbors': [5, 9]},
+                 'bernoulliNB': {'alpha': [0.01, 0.05]}, 'multinomialNB': {'alpha': [0.01, 0.05]},
+                 'logistic_regression': {'penalty': ['l1', 'l2'], 'C': [1, 8], 'class_weight': ['balanced'],
+                                         'solver': ['liblinear']},
+                 'random_forest_bool': {'max_depth': [20, 40], 'n_estimators': [100], 'class_weight': ['balanced']},
+                 'svm': {'C': [1], 'kernel': ['linear']}}
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in worker_counts:
+            table, _, _, wall_time = search_tools.search_models(filename, column, list(grids), grids, folds, workers,
+                                                                directory=directory, results=None, seed=seed)
+            results[workers] = {'wall': wall_time, 'fitting': table['seconds'].sum(),
+                                'scores': table[evaluation_tools.metric_names].values}
+
+        # The same jobs, shortest first, with the costs measured by the last run.
+        jobs = [(name, json.loads(params), fold, seed) for name, params, fold in
+                zip(table['model'], table['params'], table['fold'])]
+        _, shortest_first = search_tools.run_jobs(jobs, list(-table['seconds'].values), directory, worker_counts[-1])
+
+    base = results[worker_counts[0]]
+    print('model search:', len(table), 'jobs,', folds, 'folds,', os.cpu_count(), 'cpus')
+    for workers, entry in results.items():
+        speedup = base['wall'] / entry['wall']
+        print('    %2d workers: %7.2f sec wall, %7.2f sec fitting, speedup %.2fx, efficiency %.0f%%, same scores: %s'
+              % (workers, entry['wall'], entry['fitting'], speedup, 100 * speedup / workers * worker_counts[0],
+                 np.allclose(entry['scores'], base['scores'])))
+    print('    %2d workers, shortest first: %.2f sec wall (longest first %.2f sec)'
+          % (worker_counts[-1], shortest_first, results[worker_counts[-1]]['wall']))
+
+    return {workers: {'wall': entry['wall'], 'fitting': entry['fitting']} for workers, entry in results.items()}
+
+### benchmark_transformer_inference()
+###
+### Scores the test file with every checkpoint found in checkpoints (folders named as in transformer_tools
+### .checkpoint_runs) and compares the logits with the stored '_model_outputs.csv' files. Each checkpoint is timed in
+### full precision batched in file order and padded to max_length (as simpletransformers scored it), in full precision
+### batched by length, int8 quantized batched by length, and int8 sharded over each worker count above 1. Reports
+### tweets/sec, the largest and mean difference from the stored logits, the share of tweets given the same label and
+### the F1 score of each, and the largest difference and share of labels the int8 logits keep from the full precision
+### ones. samples scores only the first that many tweets.
+
+def benchmark_transformer_inference(checkpoints='Checkpoints', outputs='../Model Outputs',
+                                    test='../../Data/test 25-08.csv', samples=None, worker_counts=(1, 2, 4),
+                                    batch_size=32, max_length=128):
+    import transformer_tools
+    labels, tweets = evaluation_tools.load_test_labels(test)
+    names, runs, stored = evaluation_tools.load_model_outputs(outputs)
+    tweets, labels, stored = tweets[:samples], labels[:samples], stored[:, :samples]
+    tweets = [str(tweet) for tweet in tweets]
+
+    results = {}
+    for name, run, expected in zip(names, runs, stored):
+        checkpoint = os.path.join(checkpoints, run)
+        if not os.path.isdir(checkpoint):
+            print('no checkpoint for', name, 'at', checkpoint)
+            continue
+
+        runs_timed = {}
+        for label, quantize, bucket in [('fp32 max_length', False, False), ('fp32 by length', False, True),
+                                        ('int8 by length', True, True)]:
+            scorer = transformer_tools.TransformerScorer(checkpoint, quantize, max_length, batch_size)
+            scorer.cache.encode(tweets)
+            start = time.perf_counter()
+            logits = scorer.logits(tweets, bucket)
+            runs_timed[label] = (logits, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        transformer_tools.TokenCache(scorer.tokenizer, max_length).encode(tweets)
+        tokenize_time = time.perf_counter() - start
+
+        for workers in worker_counts:
+            if workers > 1:
+                start = time.perf_counter()
+                logits = transformer_tools.score_sharded(checkpoint, tweets, workers, max_length=max_length,
+                                                         batch_size=batch_size)
+                runs_timed['int8 %d workers' % workers] = (logits, time.perf_counter() - start)
+
+        print('%s: %d tweets, tokenizing %.2f sec (cached afterwards)' % (name, len(tweets), tokenize_time))
+        results[name] = {}
+        for label, (logits, seconds) in runs_timed.items():
+            predictions = logits[:, 1] > logits[:, 0]
+            difference = np.abs(logits - expected)
+            f1 = evaluation_tools.confusion_metrics(*evaluation_tools.confusion_counts(predictions, labels))['f1']
+            results[name][label] = {'tweets_per_sec': len(tweets) / seconds, 'max_difference': difference.max(),
+                                    'mean_difference': difference.mean(),
+                                    'same_label': (predictions == (expected[:, 1] > expected[:, 0])).mean(),
+                                    'f1': float(f1)}
+            print('    %-18s %8.1f tweets/sec   logits max diff %.4f, mean %.4f   same label %.2f%%   F1 %.4f'
+                  % (label, len(tweets) / seconds, difference.max(), difference.mean(),
+                     100 * results[name][label]['same_label'], f1))
+
+        full, quantized = runs_timed['fp32 by length'][0], runs_timed['int8 by length'][0]
+        results[name]['int8 vs fp32'] = {'max_difference': np.abs(quantized - full).max(),
+                                         'same_label': ((quantized[:, 1] > quantized[:, 0]) ==
+                                                        (full[:, 1] > full[:, 0])).mean()}
+        print('    int8 vs fp32:      logits max diff %.4f   same label %.2f%%'
+              % (results[name]['int8 vs fp32']['max_difference'], 100 * results[name]['int8 vs fp32']['same_label']))
+
+    return results
+
+### benchmark_cascade()
+###
+### Scores the test file through the cascade at each band width, with the stored '_model_outputs.csv' logits of `model`
+### standing in for the deep model, and reports the share of tweets sent to it, the metrics of each width against the
+### test labels, and the throughput. The screen is timed on the test tweets (cleaning included). The deep model's
+### tweets/sec is timed with a checkpoint through transformer_tools if one is given, otherwise deep_rate is used, e.g.
+### from benchmark_transformer_inference(). A Cascade is also run at every width with the stored logits looked up as its
+### deep model, to check that its merged predictions match the sweep.
+
+def benchmark_cascade(test='../../Data/test 25-08.csv', outputs='../Model Outputs', model='XLNet',
+                      widths=(0, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5), models='Classical Models', checkpoint=None,
+                      deep_rate=None, cache=None):
+    import transformer_tools
+    labels, tweets = evaluation_tools.load_test_labels(test)
+    tweets = [str(tweet) for tweet in tweets]
+    names, _, stored = evaluation_tools.load_model_outputs(outputs)
+    logits = stored[names.index(model)]
+    stored_logits = dict(zip(tweets, logits))
+
+    cascade = cascade_tools.Cascade(lambda batch: np.array([stored_logits[tweet] for tweet in batch]),
+                                    models=models, cache=cache)
+    probabilities, screen_time, _ = measure(cascade.screen_probabilities, tweets)
+    screen_rate = len(tweets) / screen_time
+
+    if checkpoint is not None:
+        scorer = transformer_tools.TransformerScorer(checkpoint)
+        _, deep_time, _ = measure(scorer.logits, tweets)
+        deep_rate = len(tweets) / deep_time
+
+    sweep = cascade_tools.band_sweep(probabilities, evaluation_tools.logit_margins(logits), labels, widths,
+                                     screen_rate, deep_rate)
+
+    same = True
+    for width, deep_fraction in zip(sweep['width'], sweep['deep_fraction']):
+        cascade.band = width
+        merged = cascade.score(tweets)
+        expected = np.where(cascade_tools.in_band(probabilities, width), logits[:, 1] > logits[:, 0],
+                            probabilities > 0.5)
+        same = same and (merged['prediction'].values == expected).all() and \
+            np.isclose((merged['tier'] == 'deep').mean(), deep_fraction)
+
+    screen_only = evaluation_tools.confusion_metrics(*evaluation_tools.confusion_counts(probabilities > 0.5, labels))
+    deep_only = evaluation_tools.confusion_metrics(*evaluation_tools.confusion_counts(logits[:, 1] > logits[:, 0],
+                                                                                      labels))
+    print('cascade: %d test tweets, screen %.1f tweets/sec, deep %s' % (len(tweets), screen_rate, 'not timed'
+                                                                          if deep_rate is None else
+                                                                          '%.1f tweets/sec' % deep_rate))
+    print('    screen only: accuracy %.4f, F1 %.4f    %s only: accuracy %.4f, F1 %.4f'
+          % (screen_only['accuracy'], screen_only['f1'], model, deep_only['accuracy'], deep_only['f1']))
+    print(sweep.round(4).to_string(index=False))
+    print('    merged Cascade predictions match the sweep:', same)
+
+    return sweep
+
+### BENCHMARK SUITE
+###
+### run_benchmark_suite() times the public cleaning_tools functions on synthetic_tools data of each size, so that a change
+### can be checked against the numbers from before it on the same machine.
+
+### suite_functions
+###
+### The functions the suite times, in the order they are run.
+
+suite_functions = ['clean_text', 'cleaning_function_part_1', 'cleaning_function_part_2', 'cleaning_total',
+                   'aggregate_merged', 'append_labels', 'gather_fns_and_fps']
+
+### _suite_time()
+###
+### Runs func `repeats` times as a stage of the active run report and keeps the fastest run: its wall and CPU seconds,
+### rows/sec, and its peak resident memory along with how far memory rose above where it started.
+
+def _suite_time(name, rows, func, repeats=1):
+    best, result = None, None
+
+    for repeat in range(repeats):
+        with instrument_tools.stage(name, rows_in=rows) as record:
+            result = func()
+        if best is None or record.wall < best.wall:
+            best = record
+
+    return result, {'seconds': round(best.wall, 4), 'cpu_s': round(best.cpu + best.children, 4),
+                    'rows_per_sec': round(rows / best.wall, 1) if best.wall > 0 else None,
+                    'peak_rss_mb': round(best.peak_rss, 1), 'peak_increase_mb': round(best.peak_rss - best.rss_start, 1)}
+
+### _suite_size()
+###
+### Times every function in functions on size rows generated from seed, with the files it needs written to directory.
+
+def _suite_size(size, directory, functions, seed, models, repeats):
+    results = {}
+    tweets, labels = synthetic_tools.synthetic_tweets(size, seed)
+    storage = dataset_tools.CsvStorage(directory)
+
+    def timed(name, rows, func):
+        if name not in functions:
+            return None
+        result, results[name] = _suite_time(name, rows, func, repeats)
+        return result
+
+    timed('clean_text', size, lambda: [cleaning_tools.clean_text(x) for x in tweets])
+    part_1 = timed('cleaning_function_part_1', size, lambda: [cleaning_tools.cleaning_function_part_1(x)
+                                                              for x in tweets])
+    if part_1 is not None:
+        timed('cleaning_function_part_2', size, lambda: [cleaning_tools.cleaning_function_part_2(x) for x in part_1])
+
+    if 'cleaning_total' in functions:
+        names = synthetic_tools.player_names
+        replacer = cleaning_tools.build_player_name_replacer(names, [name.split(' ')[1] for name in names])
+        storage.write('clean', pd.DataFrame({'injury_report': labels, 'tweet': tweets}))
+        timed('cleaning_total', size, lambda: cleaning_tools.cleaning_total(storage=storage, replacer=replacer))
+
+    if 'aggregate_merged' in functions or 'append_labels' in functions:
+        files = synthetic_tools.write_synthetic_scrapes(os.path.join(directory, 'merged'), size, seed=seed)
+        filtered = cleaning_tools.aggregate_merged([cleaning_tools.aggregate_merged(file, 1) for file in files], 0)
+        timed('aggregate_merged', size,
+              lambda: cleaning_tools.aggregate_merged([cleaning_tools.aggregate_merged(file, 1) for file in files], 0))
+
+        state = random.Random(seed)
+        labeled = filtered['tweet'].sample(max(1, len(filtered) // 10), random_state=seed)
+        labeled = pd.DataFrame({'injury_report': [state.choice(['0', '1']) for _ in range(len(labeled))],
+                                'tweet': labeled.values})
+        timed('append_labels', len(filtered), lambda: cleaning_tools.append_labels(filtered.copy(), labeled))
+
+    if 'gather_fns_and_fps' in functions and models is not None and os.path.isdir(models):
+        test = os.path.join(os.path.abspath(directory), 'synthetic.csv')
+        pd.DataFrame({'injury_report': labels, 'tweet': tweets,
+                      'clean': cleaning_tools.clean_column(tweets)}).to_csv(test, index=False)
+        registry = ModelRegistry(os.path.abspath(models))
+
+        # gather_fns_and_fps() writes to 'fns and fps' in the working directory, so it is run from directory.
+        working_directory = os.getcwd()
+        os.makedirs(os.path.join(directory, 'fns and fps'), exist_ok=True)
+        os.chdir(directory)
+        try:
+            timed('gather_fns_and_fps', size, lambda: cleaning_tools.gather_fns_and_fps(test, registry=registry))
+        finally:
+            os.chdir(working_directory)
+
+    return results
+
+### run_benchmark_suite()
+###
+### Runs the suite at each size (10,000 to 10,000,000 rows) and compares rows/sec with the baseline stored for this
+### machine in the baseline file. A function counts as slower or faster when its rate moved by more than tolerance.
+### With update_baseline=True the results are stored as the new baseline for this machine. Baselines are kept per
+### host, so the pi and the laptop each compare against themselves.
+###
+### The data is generated from seed, so every run times the same tweets. directory keeps the generated files; by default
+### they go to a temporary directory. gather_fns_and_fps() is only timed if the models folder exists. The run is also
+### recorded with instrument_tools, which writes its own JSON report with the stages inside each function.
+###
+### Returns {'results': {size: {function: measurements}}, 'comparison': {size: {function: status}}}.
+
+def run_benchmark_suite(sizes=(10000,), baseline='benchmark_baseline.json', update_baseline=False, tolerance=0.2,
+                        functions=suite_functions, seed=0, directory=None, models='Classical Models', repeats=1,
+                        reports='Run Reports'):
+    host = socket.gethostname()
+    stored = {}
+    if os.path.exists(baseline):
+        with open(baseline) as file:
+            stored = json.load(file)
+    previous = stored.get(host, {}).get('results', {})
+
+    results = {}
+    with instrument_tools.recorded_run('benchmark_suite', reports, show=False):
+        for size in sizes:
+            if directory is None:
+                with tempfile.TemporaryDirectory() as temporary:
+                    results[str(size)] = _suite_size(size, temporary, functions, seed, models, repeats)
+            else:
+                size_directory = os.path.join(directory, str(size))
+                os.makedirs(size_directory, exist_ok=True)
+                results[str(size)] = _suite_size(size, size_directory, functions, seed, models, repeats)
+
+    comparison = {}
+    print('benchmark suite on', host, '(' + platform.machine() + ', python ' + platform.python_version() + ')')
+    print('%-26s %10s %9s %12s %12s %9s %7s %s' % ('function', 'rows', 'seconds', 'rows/sec', 'baseline', 'peak MB',
+                                                   'ratio', 'status'))
+    for size, entries in results.items():
+        comparison[size] = {}
+        for name, entry in entries.items():
+            base = previous.get(size, {}).get(name)
+            ratio = entry['rows_per_sec'] / base['rows_per_sec'] if base and base['rows_per_sec'] and \
+                entry['rows_per_sec'] else None
+            status = 'new' if ratio is None else 'slower' if ratio < 1 - tolerance else \
+                'faster' if ratio > 1 + tolerance else 'same'
+            comparison[size][name] = status
+            print('%-26s %10s %9.2f %12.0f %12s %9.1f %7s %s'
+                  % (name, size, entry['seconds'], entry['rows_per_sec'] or 0,
+                     '-' if base is None else '%.0f' % base['rows_per_sec'], entry['peak_rss_mb'],
+                     '-' if ratio is None else '%.2f' % ratio, status))
+
+    if update_baseline:
+        stored[host] = {'machine': platform.machine(), 'python': platform.python_version(), 'seed': seed,
+                        'results': dict(previous, **results)}
+        with open(baseline + '.tmp', 'w') as file:
+            json.dump(stored, file, indent=2)
+        os.replace(baseline + '.tmp', baseline)
+
+    return {'results': results, 'comparison': comparison}
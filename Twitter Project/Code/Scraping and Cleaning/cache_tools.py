@@ -0,0 +1,138 @@
+"""
+Cache Tools
+
+Holds the CleanedTextCache, an on-disk cache of the clean, clean2 and clean2_no_names text for every tweet already
+cleaned, so that filtered_to_clean(), cleaning_total(), get_data_to_label() and gather_fns_and_fps() only clean tweets
+they have not seen before.
+"""
+
+import hashlib
+import sqlite3
+import time
+
+### cached_columns
+###
+### The cleaned columns which can be cached.
+
+cached_columns = ['clean', 'clean2', 'clean2_no_names']
+
+### CleanedTextCache
+###
+### SQLite table keyed by a hash of the raw tweet and a version string. The version should be changed whenever the
+### cleaning rules change (cleaning_tools.cleaner_version), so old entries simply stop being found and age out. The
+### lookups also take a variant, added to the version, for values which depend on more than the cleaning rules (the
+### clean2_no_names of a custom player name list).
+###
+### Every entry stores whichever of the cached columns have been computed for it. Entries are stamped with the time
+### they were last used, and once there are more than max_entries the least recently used ones are deleted.
+###
+### self.hits and self.misses count lookups per column since the cache was opened, and report() prints them.
+
+class CleanedTextCache:
+
+    def __init__(self, database='clean_cache.db', version='', max_entries=5000000):
+        self.database = database
+        self.version = version
+        self.max_entries = max_entries
+        self.hits = {column: 0 for column in cached_columns}
+        self.misses = {column: 0 for column in cached_columns}
+
+        self.connection = sqlite3.connect(database)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+
+        with self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS cleaned (
+                                           key BLOB PRIMARY KEY,
+                                           clean TEXT,
+                                           clean2 TEXT,
+                                           clean2_no_names TEXT,
+                                           last_used REAL)''')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS cleaned_last_used ON cleaned (last_used)')
+
+    def close(self):
+        self.connection.close()
+
+    def key(self, tweet, variant=''):
+        return hashlib.blake2b((self.version + variant + '\0' + tweet).encode('utf-8'), digest_size=16).digest()
+
+    ### get_many()
+    ###
+    ### Looks up the given columns for a list of tweets. Returns a list with a tuple of the column values for every tweet
+    ### found with all of the columns filled, and None for every miss.
+
+    def get_many(self, tweets, columns, batch_size=500, variant=''):
+        keys = [self.key(tweet, variant) for tweet in tweets]
+        unique = list(dict.fromkeys(keys))
+        found = {}
+
+        for i in range(0, len(unique), batch_size):
+            batch = unique[i:i + batch_size]
+            rows = self.connection.execute('SELECT key, ' + ', '.join(columns) + ' FROM cleaned WHERE key IN (' +
+                                           ', '.join('?' * len(batch)) + ')', batch).fetchall()
+            found.update({row[0]: row[1:] for row in rows if None not in row[1:]})
+
+        with self.connection:
+            self.connection.executemany('UPDATE cleaned SET last_used = ? WHERE key = ?',
+                                        ((time.time(), key) for key in found))
+
+        values = [found.get(key) for key in keys]
+        hits = sum(value is not None for value in values)
+        for column in columns:
+            self.hits[column] = self.hits[column] + hits
+            self.misses[column] = self.misses[column] + len(values) - hits
+
+        return values
+
+    ### put_many()
+    ###
+    ### Stores the values of the given columns for a list of tweets, where values holds a tuple per tweet. Columns not
+    ### given keep what was already stored for the tweet.
+
+    def put_many(self, tweets, columns, values, variant=''):
+        now = time.time()
+        assignments = ', '.join(column + ' = excluded.' + column for column in columns)
+
+        with self.connection:
+            self.connection.executemany('INSERT INTO cleaned (key, ' + ', '.join(columns) + ', last_used) VALUES (' +
+                                        ', '.join('?' * (len(columns) + 2)) + ') ON CONFLICT (key) DO UPDATE SET ' +
+                                        assignments + ', last_used = excluded.last_used',
+                                        ((self.key(tweet, variant),) + tuple(value) + (now,)
+                                         for tweet, value in zip(tweets, values)))
+        self.evict()
+
+    ### evict()
+    ###
+    ### Deletes the least recently used entries until at most max_entries remain.
+
+    def evict(self):
+        excess = self.connection.execute('SELECT COUNT(*) FROM cleaned').fetchone()[0] - self.max_entries
+        if excess > 0:
+            with self.connection:
+                self.connection.execute('DELETE FROM cleaned WHERE key IN '
+                                        '(SELECT key FROM cleaned ORDER BY last_used LIMIT ?)', (excess,))
+
+    ### cached_map()
+    ###
+    ### Returns the values of columns for every tweet, looking each one up in the cache and calling compute only on the
+    ### distinct tweets which missed. compute takes a list of tweets and returns a list with a tuple of column values
+    ### per tweet, in the same order.
+
+    def cached_map(self, compute, tweets, columns, variant=''):
+        tweets = list(tweets)
+        values = self.get_many(tweets, columns, variant=variant)
+
+        missing = list(dict.fromkeys(tweet for tweet, value in zip(tweets, values) if value is None))
+        if missing:
+            computed = dict(zip(missing, compute(missing)))
+            self.put_many(missing, columns, [computed[tweet] for tweet in missing], variant)
+            values = [computed[tweet] if value is None else value for tweet, value in zip(tweets, values)]
+
+        return [tuple(value) for value in values]
+
+    def report(self):
+        for column in cached_columns:
+            lookups = self.hits[column] + self.misses[column]
+            if lookups:
+                print('%s: %d hits, %d misses (%.1f%% of cleaning avoided)'
+                      % (column, self.hits[column], self.misses[column], 100 * self.hits[column] / lookups))
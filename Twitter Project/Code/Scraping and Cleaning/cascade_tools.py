@@ -0,0 +1,154 @@
+"""
+Cascade Tools
+
+Scores tweets in two tiers. Every tweet is first scored by the saved logistic_regression and tfidf models (the ones
+get_data_to_label() uses), and only the tweets whose probability falls in an uncertainty band around 0.5 are passed to
+a deep model such as XLNet (transformer_tools). The tweets logistic regression is sure about keep its label, so the deep
+model only sees a small share of the pool. Both tiers end up in one prediction file.
+"""
+
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from cleaning_tools import clean_column
+from dataset_tools import get_storage
+from evaluation_tools import confusion_counts, confusion_metrics
+from instrument_tools import instrumented, stage, current_stage
+from model_tools import ModelRegistry
+
+### prediction_columns
+###
+### The columns of a cascade's prediction file: the screen's probability, which tier gave the label ('screen' or
+### 'deep'), the deep model's logits (empty for tweets it did not score) and the final label.
+
+prediction_columns = ['tweet', 'screen_probability', 'tier', 'P0', 'P1', 'prediction']
+
+### in_band()
+###
+### Which probabilities fall in the uncertainty band. band is a (low, high) pair, or a width around 0.5: a width of
+### 0.3 sends every tweet with a probability between 0.2 and 0.8 to the deep model.
+
+def in_band(probabilities, band):
+    low, high = (0.5 - band, 0.5 + band) if np.isscalar(band) else band
+    probabilities = np.asarray(probabilities, dtype=float)
+    return (probabilities >= low) & (probabilities <= high)
+
+### Cascade
+###
+### Holds the screen (logistic_regression from a ModelRegistry) and the deep model, a function giving the P0 / P1
+### logits of a list of tweets, e.g. transformer_tools.TransformerScorer(checkpoint).logits. score() scores a list of
+### tweets through both tiers and returns a DataFrame of prediction_columns.
+###
+### self.counts holds the tweets given a label by each tier and self.seconds the time spent in each, and report()
+### prints them with the throughput.
+
+class Cascade:
+
+    def __init__(self, deep, band=0.3, registry=None, models='Classical Models', cache=None,
+                 screen='logistic_regression'):
+        self.deep = deep
+        self.band = band
+        self.screen = screen
+        self.registry = ModelRegistry(models, [screen]) if registry is None else registry
+        self.cache = cache
+        self.counts = {'screen': 0, 'deep': 0}
+        self.seconds = {'screen': 0.0, 'deep': 0.0}
+
+    def screen_probabilities(self, tweets):
+        return self.registry.predict_proba(clean_column(tweets, self.cache), self.screen)
+
+    def score(self, tweets):
+        tweets = [str(tweet) for tweet in tweets]
+
+        start = time.perf_counter()
+        probabilities = self.screen_probabilities(tweets)
+        self.seconds['screen'] += time.perf_counter() - start
+
+        uncertain = np.flatnonzero(in_band(probabilities, self.band))
+        logits = np.full((len(tweets), 2), np.nan)
+        if len(uncertain):
+            start = time.perf_counter()
+            logits[uncertain] = self.deep([tweets[i] for i in uncertain])
+            self.seconds['deep'] += time.perf_counter() - start
+
+        tier = np.where(np.isnan(logits[:, 0]), 'screen', 'deep')
+        prediction = np.where(tier == 'deep', logits[:, 1] > logits[:, 0], probabilities > 0.5).astype(int)
+        self.counts['deep'] += len(uncertain)
+        self.counts['screen'] += len(tweets) - len(uncertain)
+
+        return pd.DataFrame({'tweet': tweets, 'screen_probability': probabilities, 'tier': tier, 'P0': logits[:, 0],
+                             'P1': logits[:, 1], 'prediction': prediction}, columns=prediction_columns)
+
+    def report(self):
+        total = sum(self.counts.values())
+        seconds = sum(self.seconds.values())
+        for tier in ['screen', 'deep']:
+            print('%-6s %9d tweets labeled (%5.1f%%), %8.2fs' % (tier, self.counts[tier],
+                                                                  100 * self.counts[tier] / max(total, 1),
+                                                                  self.seconds[tier]))
+        print('%d tweets in %.2fs, %.1f tweets/sec' % (total, seconds, total / seconds if seconds else 0))
+
+### band_sweep()
+###
+### Scores a cascade at every band width at once, from the screen probabilities and the deep margins (P1 - P0) of a
+### labeled set, e.g. the test file with the stored '_model_outputs.csv' logits. The deep model's label of a tweet does
+### not depend on the band, so it only has to be scored once, for the widest band. Returns a DataFrame with the share
+### of tweets sent to the deep model and the metrics of each width.
+###
+### With the tweets/sec of both tiers the throughput of each width is estimated too, as every tweet pays for the
+### screen and the share in the band also pays for the deep model.
+
+def band_sweep(probabilities, deep_margins, labels, widths=(0, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5), screen_rate=None,
+               deep_rate=None):
+    probabilities = np.asarray(probabilities, dtype=float)
+    deep_margins = np.asarray(deep_margins, dtype=float)
+    widths = np.asarray(widths, dtype=float)
+
+    # in_band() for every width, so a tweet on the edge of a band is counted as Cascade.score() sends it.
+    uncertain = np.array([in_band(probabilities, width) for width in widths], dtype=bool).reshape(len(widths), -1)
+    predictions = np.where(uncertain, deep_margins[None, :] > 0, probabilities[None, :] > 0.5)
+
+    sweep = pd.DataFrame({'width': widths, 'deep_fraction': uncertain.mean(axis=1)})
+    for name, values in confusion_metrics(*confusion_counts(predictions, labels)).items():
+        sweep[name] = values
+    if screen_rate is not None and deep_rate is not None:
+        sweep['tweets_per_sec'] = 1 / (1 / screen_rate + sweep['deep_fraction'] / deep_rate)
+    return sweep
+
+### PIPELINE FUNCTIONS
+
+### cascade_filtered()
+###
+### Scores the unlabeled tweets of filtered2 through a Cascade, chunksize rows at a time, and writes every prediction to
+### one file (output) with the row of the tweet in filtered2 as the index. Prints the share of tweets each tier labeled
+### and the throughput, and returns the Cascade.
+
+@instrumented()
+def cascade_filtered(deep, band=0.3, output='cascade_predictions.csv', storage=None, registry=None,
+                     models='Classical Models', cache=None, chunksize=100000):
+    storage = get_storage(storage)
+    cascade = Cascade(deep, band, registry, models, cache)
+
+    written = 0
+    with open(output + '.tmp', 'w', newline='') as file:
+        file.write(',' + ','.join(prediction_columns) + '\n')
+        start = 0
+        for chunk in storage.read_chunks(storage.path('filtered2'), ['injury_report', 'tweet'], chunksize):
+            rows = np.arange(start, start + chunk.shape[0])
+            start = start + chunk.shape[0]
+            keep = ((chunk['injury_report'].astype(str) == 'x') & chunk['tweet'].notna()).values
+            if not keep.any():
+                continue
+
+            with stage('score chunk', rows_in=int(keep.sum())):
+                predictions = cascade.score(chunk['tweet'].values[keep])
+            predictions.index = rows[keep]
+            predictions.to_csv(file, header=False)
+            written = written + predictions.shape[0]
+
+    os.replace(output + '.tmp', output)
+    current_stage().rows(rows_in=start, rows_out=written)
+    cascade.report()
+    return cascade
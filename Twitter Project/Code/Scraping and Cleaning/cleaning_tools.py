@@ -6,7 +6,18 @@ the filtered.csv and clean.csv files.
 """
 
 import pandas as pd
+import numpy as np
 import os
+import shutil
+import tempfile
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from cache_tools import CleanedTextCache
+from dataset_tools import get_storage, dataset_types
+from sampling_tools import sample_pool
+from label_tools import propagate_labels, label_winners
+from instrument_tools import instrumented, stage, current_stage
+from model_tools import ModelRegistry
 from joblib import dump, load
 
 # For further cleaning with word stemming and lemmatization:
@@ -17,10 +28,7 @@ from nltk.corpus import stopwords
 from nltk.stem import PorterStemmer
 from pybaseball import pitching_stats, batting_stats
 
-# Use get_current_date to write date for merged files
-
 from datetime import date
-from scraping_tools import get_current_date
 
 ### USED INFORMATION
 
@@ -96,10 +104,14 @@ def _get_contractions(contraction_dict):
 ### Written By: Jhagrut Lalwani
 ###
 ### Function which uses the elongated regular expression created by _get_contractions to replace contractions in text
-### with their expanded set of words represented in the dictionary's values.
+### with their expanded set of words represented in the dictionary's values. The expression is built once, when
+### cleaning_tools is imported.
+
+contractions, contractions_re = _get_contractions(contraction_dict)
 
 def replace_contractions(text):
-    contractions, contractions_re = _get_contractions(contraction_dict)
+    if "'" not in text:  # every contraction has an apostrophe
+        return text
 
     def replace(match):
         return contractions[match.group(0)]
@@ -113,37 +125,20 @@ def replace_contractions(text):
 ### Original function for cleaning text back in August 2020. Takes a singular string as input and outputs a string which
 ### has been cleaned up. Removes contractions, punctuation, and stopwords. Function is applied to the 'clean' column of
 ### clean.csv.
+###
+### The cleaning itself is done by TextCleaner.clean() so that the stopwords are only loaded once.
 
 def clean_text(txt):
+    return get_text_cleaner().clean(txt)
 
-    # replace contractions
-    txt = replace_contractions(txt)
-   
-    #remove punctuations
-    txt  = "".join([char for char in txt if char not in string.punctuation])
-    txt = re.sub('[0-9]+', '', txt)
-   
-    # split into words
-    words = word_tokenize(txt)
-   
-    # remove stopwords
-    stop_words = set(stopwords.words('english'))
-    words = [w for w in words if not w in stop_words]
-   
-    # removing leftover punctuations
-    words = [word for word in words if word.isalpha()]
-   
-    cleaned_text = ' '.join(words)
-    return cleaned_text
-
-### remove_emojis
+### emoji_re
 ###
 ### Admittedly found on the internet.
 ###
-### Function which removes 99% of emojis from tweets.
+### Character class matching 99% of emojis in tweets. Compiled once at import time so that remove_emojis() and
+### TweetNormalizer do not rebuild it for every tweet.
 
-def remove_emojis(data):
-    emoj = re.compile("["
+emoji_re = re.compile("["
                       u"\U0001F600-\U0001F64F"  # emoticons
                       u"\U0001F300-\U0001F5FF"  # symbols & pictographs
                       u"\U0001F680-\U0001F6FF"  # transport & map symbols
@@ -163,7 +158,77 @@ def remove_emojis(data):
                       u"\ufe0f"  # dingbats
                       u"\u3030"
                       "]+", re.UNICODE)
-    return re.sub(emoj, ' emojiToken ', data)
+
+### remove_emojis
+###
+### Function which removes 99% of emojis from tweets.
+
+def remove_emojis(data):
+    return emoji_re.sub(' emojiToken ', data)
+
+### TweetNormalizer
+###
+### Compiled version of the token rules used by cleaning_function_part_1(). Every regular expression (including the
+### contraction expression built from contraction_dict) is compiled once when the object is created, and the
+### substitutions are run as a fixed sequence of scans over the tweet.
+###
+### The rules are deliberately *not* merged into one big alternation: several of them feed into each other (e.g. a
+### hyperlink replaced by ' hyperlinkToken ' can expose a year surrounded by spaces, and an account inside a url is
+### replaced before the url is) so the order of the scans is part of the output. Instead, scans which cannot match are
+### skipped with cheap checks on the text:
+###
+###     1. No '@' means no account token, no 'http' means no hyperlink token.
+###     2. No digits means no year, phone number, date or time tokens. None of the tokens inserted contain digits.
+###     3. Pure ASCII text contains no emojis - every range in emoji_re is above the ASCII range.
+###     4. Every key of contraction_dict contains an apostrophe.
+###
+### Output is identical to the original chain of re.sub() and str.replace() calls.
+
+class TweetNormalizer:
+
+    def __init__(self, contractions=contraction_dict):
+        self.contractions = contractions
+        self.account_re = re.compile("@[A-Za-z0-9]+")
+        self.hyperlink_re = re.compile(r"http\S+")
+        self.year_re = re.compile(" 20[0-3][0-9] ")
+        self.phone_re = re.compile(r"[0-9]{3}-[0-9]{3}-[0-9]{4}|\([0-9]{3}\)[0-9]{3}-[0-9]{4}|"
+                                   r"[0-9]{3}\.[0-9]{3}\.[0-9]{4}")
+        self.date_re = re.compile(" [0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4} ")
+        self.time_re = re.compile("[0-9]:[0-9]{2}am|[0-9]:[0-9]{2}pm|[0-9][0-9]{2}am|[0-9][0-9]{2}pm|[0-9]:[0-9]{2}|"
+                                  "[0-9]am|[0-9]pm")
+        self.digit_re = re.compile("[0-9]")
+        self.contractions_re = re.compile('(%s)' % '|'.join(contractions.keys()))
+
+    def _replace_contraction(self, match):
+        return self.contractions[match.group(0)]
+
+    def normalize(self, x):
+        has_digits = self.digit_re.search(x) is not None
+
+        new = self.account_re.sub(" accountToken ", x) if '@' in x else x  # Replace twitter accounts with token
+        if 'http' in new:
+            new = self.hyperlink_re.sub(" hyperlinkToken ", new)  # Replace hyperlinks with token
+        if has_digits:
+            new = self.year_re.sub(' yearToken ', new)  # Replace year with token
+            new = self.phone_re.sub('  phoneNumberToken  ', new)  # Replace phone number with token
+            new = self.date_re.sub(" dateToken ", new)
+        if not new.isascii():
+            new = emoji_re.sub(' emojiToken ', new)
+
+        # Remove pound symbol from hashtags, ampersands and "w/", then lowercase to reduce duplicates with capitalization
+        new = new.replace('#', '').replace('&amp;', ' and ').replace('w/', ' with ').lower()
+
+        if has_digits:
+            new = self.time_re.sub(' timetoken ', new)  # replace time with token - easier with lowercase
+        if "'" in new:
+            new = self.contractions_re.sub(self._replace_contraction, new)  # must be after setting to lower case
+
+        return new
+
+    def normalize_many(self, texts):
+        return [self.normalize(x) for x in texts]
+
+tweet_normalizer = TweetNormalizer()
 
 ### cleaning_function_part_1(x)
 ###
@@ -180,25 +245,12 @@ def remove_emojis(data):
 ###     7. Times with a token
 ###     8. Contractions
 ###
+### The rules themselves live in TweetNormalizer so that they are only compiled once.
+###
 ### This function is listed as "part 1" because it is used in tandem with cleaning_function_part_1().
 
 def cleaning_function_part_1(x):
-    new = re.sub("@[A-Za-z0-9]+", " accountToken ", x)  # Replace twitter accounts with token
-    new = re.sub(r"http\S+", " hyperlinkToken ", new)  # Replace hyperlinks with token
-    new = re.sub(" 20[0-3][0-9] ", ' yearToken ', new)  # Replace year with token
-    new = re.sub("[0-9]{3}-[0-9]{3}-[0-9]{4}|\([0-9]{3}\)[0-9]{3}-[0-9]{4}|[0-9]{3}\.[0-9]{3}\.[0-9]{4}",
-                 '  phoneNumberToken  ', new)  # Replace phone number with token
-    new = re.sub(" [0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4} ", " dateToken ", new)
-    new = remove_emojis(new)
-    new = new.replace('#', '')  # Remove pound symbol from hashtags
-    new = new.replace('&amp;', ' and ')  # Remove ampersand symbol
-    new = new.replace('w/', ' with ')  # Remove w/ with "with"
-    new = new.lower()  # All lowercase to reduce duplicates with capitalization
-    new = re.sub("[0-9]:[0-9]{2}am|[0-9]:[0-9]{2}pm|[0-9][0-9]{2}am|[0-9][0-9]{2}pm|[0-9]:[0-9]{2}|[0-9]am|[0-9]pm",
-                 ' timetoken ', new)  # replace time with token - easier with lowercase
-    new = replace_contractions(new)  # remove contractions - must be after setting everything to lower case
-
-    return new
+    return tweet_normalizer.normalize(x)
 
 ### cleaning_function_part_2(x)
 ###
@@ -211,27 +263,306 @@ def cleaning_function_part_1(x):
 ###     3. Replace words with their stemmed version
 ###
 ### This function is listed as "part 1" because it is used in tandem with cleaning_function_part_1().
+###
+### The cleaning itself is done by TextCleaner.clean_part_2() so that the stopwords and stemmer are only loaded once.
 
 def cleaning_function_part_2(x):
-    # Remove punctuation
+    return get_text_cleaner().clean_part_2(x)
+
+### TextCleaner
+###
+### Holds everything clean_text() and cleaning_function_part_2() need - the stopword set, the PorterStemmer, the
+### punctuation table and the compiled regular expressions - so they are loaded once instead of for every tweet. Stems
+### are memoized by token in self.stems, since the vocabulary of tweets is heavily repeated.
+###
+### The *_many() methods take any iterable of tweets (e.g. a pandas column) and return a list, and are what the pipeline
+### functions use. Output is identical to the original functions.
+
+class TextCleaner:
+
+    def __init__(self, normalizer=None):
+        self.stop_words = set(stopwords.words('english'))
+        self.stemmer = PorterStemmer()
+        self.stems = {}
+        self.normalizer = tweet_normalizer if normalizer is None else normalizer
+        self.punctuation_table = str.maketrans('', '', string.punctuation)
+        self.digits_re = re.compile('[0-9]+')
+
+    def stem(self, word):
+        stem = self.stems.get(word)
+        if stem is None:
+            stem = self.stems[word] = self.stemmer.stem(word)
+        return stem
+
+    ### clean()
+    ###
+    ### clean_text() for a single tweet: removes contractions, punctuation, numbers and stopwords.
+
+    def clean(self, txt):
+        txt = replace_contractions(txt)
+        txt = txt.translate(self.punctuation_table)
+        txt = self.digits_re.sub('', txt)
+
+        # remove stopwords and leftover punctuations
+        return ' '.join([word for word in word_tokenize(txt) if word not in self.stop_words and word.isalpha()])
+
+    def clean_many(self, texts):
+        return [self.clean(txt) for txt in texts]
+
+    ### clean_part_2()
+    ###
+    ### cleaning_function_part_2() for a single tweet: removes punctuation, numbers and stopwords and stems every word.
+
+    def clean_part_2(self, x):
+        new = x.translate(self.punctuation_table)
+        new = self.digits_re.sub(' ', new)
+
+        words = [self.stem(word) for word in word_tokenize(new) if word not in self.stop_words]
+
+        # removing leftover punctuations
+        return ' '.join([word for word in words if word.isalpha()])
+
+    def clean_part_2_many(self, texts):
+        return [self.clean_part_2(x) for x in texts]
+
+    ### clean_total()
+    ###
+    ### Gives the ('clean2', 'clean2_no_names') pair of cleaning_total() for a single tweet, removing names with the
+    ### given PlayerNameReplacer.
+
+    def clean_total(self, tweet, replacer):
+        clean2 = self.normalizer.normalize(tweet)
+        return self.clean_part_2(clean2), self.clean_part_2(replacer.replace(clean2))
+
+    def clean_total_many(self, tweets, replacer):
+        return [self.clean_total(tweet, replacer) for tweet in tweets]
+
+_text_cleaner = None
+
+### get_text_cleaner()
+###
+### Returns the TextCleaner shared by the module level functions, creating it on first use so that importing
+### cleaning_tools does not need the nltk data.
+
+def get_text_cleaner():
+    global _text_cleaner
+    if _text_cleaner is None:
+        _text_cleaner = TextCleaner()
+    return _text_cleaner
+
+### PlayerNameReplacer
+###
+### Aho-Corasick automaton for replacing baseball player names in tweets. The trie of every full name and last name is
+### built once, and each tweet is then scanned a single time no matter how many names there are, instead of running one
+### str.replace() per name over the whole column.
+###
+### Matches are replaced leftmost-longest, so a full name ('mike trout') always wins over the last name inside of it
+### ('trout'). With word_boundaries=True a match only counts when it is not part of a longer word, so 'cole' does not
+### replace the start of 'coleman'.
+###
+### patterns is a dictionary of {text to find: replacement}. Patterns should be lowercase since they are run after
+### cleaning_function_part_1(). fingerprint is a hash of the patterns and word_boundaries, which keeps the cached
+### clean2_no_names of one name list apart from another's.
+
+class PlayerNameReplacer:
+
+    def __init__(self, patterns, word_boundaries=True):
+        self.word_boundaries = word_boundaries
+        self.fingerprint = hashlib.blake2b(repr((sorted(patterns.items()), word_boundaries)).encode('utf-8'),
+                                           digest_size=8).hexdigest()
+
+        # Each node of the trie is a dictionary of {character: child node}. fail[node] is the longest proper suffix of the
+        # node's text which is also in the trie, and out[node] is every pattern ending at that node as
+        # (length, replacement) pairs.
+
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+
+        for pattern, replacement in patterns.items():
+            if not pattern:
+                continue
+            node = 0
+            for char in pattern:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            self.out[node].append((len(pattern), replacement))
+
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for char, child in self.goto[node].items():
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(char, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+                queue.append(child)
+
+    def _is_boundary(self, text, index):
+        return index < 0 or index >= len(text) or not text[index].isalnum()
+
+    def find(self, text):
+        goto, fail, out = self.goto, self.fail, self.out
+        matches = []
+        node = 0
+
+        for end, char in enumerate(text, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length, replacement in out[node]:
+                start = end - length
+                if not self.word_boundaries or (self._is_boundary(text, start - 1) and self._is_boundary(text, end)):
+                    matches.append((start, -length, replacement))
+
+        # Keep the leftmost-longest matches which do not overlap an earlier match.
+
+        matches.sort()
+        selected = []
+        position = 0
+        for start, negative_length, replacement in matches:
+            if start >= position:
+                position = start - negative_length
+                selected.append((start, position, replacement))
+
+        return selected
+
+    def replace(self, text):
+        matches = self.find(text)
+        if not matches:
+            return text
+
+        pieces = []
+        position = 0
+        for start, end, replacement in matches:
+            pieces.append(text[position:start])
+            pieces.append(replacement)
+            position = end
+        pieces.append(text[position:])
+
+        return ''.join(pieces)
+
+    def replace_many(self, texts):
+        return [self.replace(x) for x in texts]
+
+### get_player_names()
+###
+### Returns the lowercase full names and last names of every pitcher and batter from 2015 to 2021 according to
+### pybaseball.
+
+def get_player_names():
+    names = [name.lower() for name in
+             set(pitching_stats(2015, 2021)['Name']).union(set(batting_stats(2015, 2021)['Name']))]
+    lastnames = [name.split(' ')[1] for name in names]
+    return names, lastnames
+
+### build_player_name_replacer()
+###
+### Builds the PlayerNameReplacer used by cleaning_total(). Full names become ' baseballplayertoken ' and last names
+### become ' baseballlastnametoken '.
+
+def build_player_name_replacer(names=None, lastnames=None, word_boundaries=True):
+    if names is None or lastnames is None:
+        names, lastnames = get_player_names()
+
+    patterns = {lastname: ' baseballlastnametoken ' for lastname in lastnames}
+    patterns.update({name: ' baseballplayertoken ' for name in names})
+
+    return PlayerNameReplacer(patterns, word_boundaries)
+
+### PARALLEL CLEANING
+###
+### Tools for splitting a column of tweets into batches and cleaning the batches on a pool of worker processes. Each
+### worker is set up once by _init_cleaning_worker() with its own TextCleaner and player name replacer rather than once
+### per tweet.
+
+_worker = {}
+
+def _init_cleaning_worker(replacer=None):
+    _worker['cleaner'] = get_text_cleaner()
+    _worker['replacer'] = replacer
+
+### _clean_text_batch()
+###
+### Worker function giving the 'clean' column for a batch of tweets.
+
+def _clean_text_batch(batch):
+    return _worker['cleaner'].clean_many(batch)
+
+### _cleaning_total_batch()
+###
+### Worker function giving the ('clean2', 'clean2_no_names') pair for a batch of tweets, the same way as
+### cleaning_total().
+
+def _cleaning_total_batch(batch):
+    return _worker['cleaner'].clean_total_many(batch, _worker['replacer'])
+
+### map_in_batches()
+###
+### Applies a batch function to items split into batches of batch_size, on a process pool of the given number of
+### workers. Results come back in the same order as items. With workers=1 everything runs in this process, which is
+### also what is used to check the parallel output against.
+
+def map_in_batches(function, items, workers=1, batch_size=2000, replacer=None):
+    items = list(items)
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+    if workers == 1:
+        _init_cleaning_worker(replacer)
+        results = [function(batch) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_cleaning_worker,
+                                 initargs=(replacer,)) as executor:
+            results = list(executor.map(function, batches))
+
+    return [entry for batch in results for entry in batch]
+
+### CACHED CLEANING
+###
+### The cleaned columns of a tweet only depend on its raw text and the cleaning rules, so they can be looked up in a
+### CleanedTextCache instead of being recomputed every run. cleaner_version is part of every cache key - change it
+### whenever the cleaning rules (or the player name list) change so that stale entries are no longer used.
+
+cleaner_version = '1'
+
+### open_cleaned_text_cache()
+###
+### Opens the cache of cleaned tweets for the current cleaner_version.
+
+def open_cleaned_text_cache(database='clean_cache.db', max_entries=5000000):
+    return CleanedTextCache(database, cleaner_version, max_entries)
 
-    new = "".join([char for char in x if char not in string.punctuation])
-    new = re.sub('[0-9]+', ' ', new)
+### clean_column()
+###
+### Gives the 'clean' column (clean_text()) for a column of tweets. With a cache only tweets missing from it are
+### cleaned.
 
-    # split into words
-    words = word_tokenize(new)
+def clean_column(tweets, cache=None, workers=1, batch_size=2000):
+    def compute(batch):
+        return [(clean,) for clean in map_in_batches(_clean_text_batch, batch, workers, batch_size)]
 
-    # remove stopwords
-    stop_words = set(stopwords.words('english'))
-    ps = PorterStemmer()
-    words = [ps.stem(w) for w in words if not w in stop_words]
+    cleaned = compute(list(tweets)) if cache is None else cache.cached_map(compute, tweets, ['clean'])
+    return [entry[0] for entry in cleaned]
 
-    # removing leftover punctuations
-    words = [word for word in words if word.isalpha()]
+### clean_total_columns()
+###
+### Gives the ('clean2', 'clean2_no_names') pair of cleaning_total() for a column of tweets. With a cache only tweets
+### missing from it are cleaned, and the player names are only downloaded if there are any. The default player name
+### list is covered by cleaner_version; a replacer given here is cached apart, under its fingerprint.
 
-    new = ' '.join(words)
+def clean_total_columns(tweets, cache=None, workers=1, batch_size=2000, replacer=None):
+    def compute(batch):
+        return map_in_batches(_cleaning_total_batch, batch, workers, batch_size,
+                              build_player_name_replacer() if replacer is None else replacer)
 
-    return new
+    if cache is None:
+        return compute(list(tweets))
+    variant = '' if replacer is None else replacer.fingerprint
+    return cache.cached_map(compute, tweets, ['clean2', 'clean2_no_names'], variant)
 
 ### cleaning_total()
 ###
@@ -240,23 +571,27 @@ def cleaning_function_part_2(x):
 ### Function which reduces text from tweets by combining cleaning_function_part_1() and cleaning_function_part_2() as
 ### well as removing names from the dataset. These are represented in the "clean2" column and "clean2_no_names" column
 ### of clean.csv.
+###
+### Names are removed with a PlayerNameReplacer in a single pass over each tweet, and the tweets are cleaned in batches
+### by a TextCleaner. If workers is more than 1 the batches are spread over a process pool with map_in_batches(). If a
+### CleanedTextCache is given, only tweets not already in it are cleaned.
+###
+### storage picks the backend clean is read from and written to (csv files by default, see dataset_tools). replacer can
+### be a PlayerNameReplacer to use instead of one built from the pybaseball player lists.
 
-def cleaning_total():
-    data = pd.read_csv('clean.csv')
-    data['clean2'] = data['tweet'].apply(cleaning_function_part_1)
-
-    names = [name.lower() for name in
-             set(pitching_stats(2015, 2021)['Name']).union(set(batting_stats(2015, 2021)['Name']))]
-    lastnames = [name.split(' ')[1] for name in names]
-
-    for i in range(len(names)):
-        data['clean2_no_names'] = data['clean2'].apply(lambda x: x.replace(names[i].lower(), ' baseballplayertoken '))
-        data['clean2_no_names'] = data['clean2'].apply(lambda x: x.replace(lastnames[i].lower(), ' baseballlastnametoken '))
+@instrumented()
+def cleaning_total(workers=1, batch_size=2000, cache=None, storage=None, replacer=None):
+    storage = get_storage(storage)
+    data = storage.read('clean')
+    current_stage().rows(rows_in=data.shape[0], rows_out=data.shape[0])
 
-    data['clean2'] = data['clean2'].apply(cleaning_function_part_2)
-    data['clean2_no_names'] = data['clean2'].apply(cleaning_function_part_2)
+    with stage('clean_total_columns', rows_in=data.shape[0]):
+        cleaned = clean_total_columns(data['tweet'], cache, workers, batch_size, replacer)
+    data['clean2'] = [entry[0] for entry in cleaned]
+    data['clean2_no_names'] = [entry[1] for entry in cleaned]
 
-    data.to_csv('clean.csv')
+    with stage('write clean', rows_out=data.shape[0]):
+        storage.write('clean', data, index=True)
 
 ### FILE CONVERTING FUNCTIONS
 ###
@@ -279,27 +614,106 @@ def cleaning_total():
 ###     2. After 2 million entries the data of a particular date is broken off into a second file.
 ###
 ### Once done, the data is converted into a file which has the format 'merged (file number here) (date here).csv'.
-### The older files before this standard are merged.csv, merged2.csv, merged3.csv and 'InsideInjuries merged.csv'.
+### The older files before this standard are merged.csv, merged2.csv, merged3.csv and 'InsideInjuries merged.csv'. With
+### the Parquet storage the files are written to the scrape date's partition instead.
+
+@instrumented()
+def scrape_to_merge(max_rows=2000000, storage=None):
+    # Use get_current_date to write date for merged files. scraping_tools needs twint and pydrive, so it is only imported
+    # here, and the rest of this module works without them.
 
-def scrape_to_merge():
+    from scraping_tools import get_current_date
+
+    storage = get_storage(storage)
     fileList = [os.getcwd()  + '/TweetData/' + files 
-                for files in os.listdir(os.getcwd()  + '/TweetData')]
+                for files in os.listdir(os.getcwd()  + '/TweetData')
+                if os.path.isfile(os.getcwd()  + '/TweetData/' + files)]
+
+    # Frames are collected in a list and concatenated once per merged file - appending to a DataFrame copies everything
+    # read so far on every file.
 
-    data = pd.DataFrame()
+    frames = []
+    rows = 0
     counter = 1
+    rows_read = 0
+    rows_written = 0
     
     for i in range(len(fileList)):
-        data = data.append(pd.read_csv(fileList[i]))
-        if data.shape[0] > 2000000:
-            data.drop_duplicates()
-            data.to_csv('merged ' + str(counter) +  ' ' + get_current_date() + '.csv', index=False)
+        frames.append(pd.read_csv(fileList[i]))
+        rows = rows + frames[-1].shape[0]
+        rows_read = rows_read + frames[-1].shape[0]
+        if rows > max_rows:
+            data = pd.concat(frames).drop_duplicates()
+            storage.write_merged(data, get_current_date(), counter)
+            rows_written = rows_written + data.shape[0]
             counter = counter + 1
-            data = pd.DataFrame()
+            frames = []
+            rows = 0
         
-    data = data.drop_duplicates()
-    data.to_csv('merged ' + str(counter) +  ' ' + get_current_date() + '.csv', index=False)
+    data = pd.concat(frames).drop_duplicates() if frames else pd.DataFrame()
+    storage.write_merged(data, get_current_date(), counter)
+    current_stage().rows(rows_in=rows_read, rows_out=rows_written + data.shape[0])
     del data
 
+### merged_columns, count_columns, merged_dtypes, merged_aggregates, filtered_dtypes
+###
+### The columns of the twint output needed to build filtered2.csv and the types they are read with, how each column of
+### filtered2.csv is aggregated when the same (link, tweet) pair shows up more than once, and the types of the
+### aggregated columns.
+###
+### Counts fit in int32 and the flags in int8. twint leaves a count empty now and then, which read_csv cannot read as
+### int32, so counts are read as float64 and reduce_merged() fills the missing ones before casting them to int32
+### (reading them as the nullable Int32 instead is half again as slow). urls and photos are read as categories: nearly
+### every value is '[]', so the flags are worked out once per distinct value rather than once per row. link is left as
+### text since almost every value is distinct, and building the categories costs more than it saves.
+
+merged_columns = ['link', 'tweet', 'replies_count', 'retweets_count', 'likes_count', 'urls', 'photos', 'retweet']
+
+count_columns = ['replies_count', 'retweets_count', 'likes_count']
+
+merged_dtypes = {'replies_count': 'float64', 'retweets_count': 'float64', 'likes_count': 'float64',
+                 'urls': 'category', 'photos': 'category'}
+
+merged_aggregates = {'replies_count': 'max', 'retweets_count': 'max', 'likes_count': 'max',
+                     'link_present': 'max', 'photo_present': 'max', 'retweet': 'max'}
+
+filtered_dtypes = {'replies_count': 'int32', 'retweets_count': 'int32', 'likes_count': 'int32',
+                   'link_present': 'int8', 'photo_present': 'int8', 'retweet': 'int8'}
+
+### has_entries()
+###
+### twint writes urls and photos as python lists, '[]' when there are none. Gives 1 for every value which is not empty
+### once its brackets are stripped and 0 otherwise, as an int8 array. Missing values count as present, since they used
+### to be stripped as the text 'nan'. Categorical columns are checked once per category.
+
+def has_entries(column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        present = np.append(has_entries(pd.Series(column.cat.categories)), np.int8(1))
+        return present[column.cat.codes.values]  # code -1 (missing) picks the 1 appended at the end
+
+    return (~column.astype(str).str.fullmatch(r'\[*\]*')).values.astype('int8')
+
+### add_flag_columns()
+###
+### Gives raw twint data the boolean columns denoting whether or not it contains a url, photo, or retweet.
+
+def add_flag_columns(data):
+    data['link_present'] = has_entries(data['urls'])
+    data['photo_present'] = has_entries(data['photos'])
+    data['retweet'] = data['retweet'].astype(bool).astype('int8')
+    return data
+
+### reduce_merged()
+###
+### Gives raw twint data its flag columns and reduces it to one row per (link, tweet) with the groupby max, sorted by
+### link and tweet. Missing counts are filled with 0 first, which leaves the max of a tweet's counts as it was and gives
+### 0 when every copy is missing it.
+
+def reduce_merged(data):
+    data[count_columns] = data[count_columns].fillna(0).astype('int32')
+    final = add_flag_columns(data).groupby(['link', 'tweet']).agg(merged_aggregates)
+    return final.astype(filtered_dtypes)
+
 ### aggregate_merged()
 ###
 ### aggregated_merged has two functions depending on the variable "mergetype":
@@ -309,31 +723,18 @@ def scrape_to_merge():
 ###         retweet and then its information regarding replies, retweets, or likes is updated to the latest version.
 ###
 ### This function is used inside the function merged_to_filtered() to reduced the raw data in the "merged" fileset into
-### a single file called "filtered2.csv".
+### a single file called "filtered2.csv". Only the merged_columns of a merged file are read, with the merged_dtypes.
 
-def aggregate_merged(file, mergetype):
+def aggregate_merged(file, mergetype, storage=None):
     if mergetype == 1:
 
-        data = pd.read_csv(file)
-        data['urls'] = data['urls'].apply(lambda x: str(x).lstrip("[").rstrip("]"))
-        data['link_present'] = data['urls'].apply(lambda x: ifelse(len(x) > 0, 1, 0))
-        data['photos'] = data['photos'].apply(lambda x: str(x).lstrip("[").rstrip("]"))
-        data['photo_present'] = data['photos'].apply(lambda x: ifelse(len(x) > 0, 1, 0))
-        data['retweet'] = data['retweet'].astype(bool).apply(lambda x: ifelse(x, 1, 0))
+        final = reduce_merged(get_storage(storage).read_file(file, merged_columns, merged_dtypes))
 
     else:
 
         data = pd.concat(file)
 
-    final = data.groupby(['link', 'tweet']).agg({'replies_count': 'max', 'retweets_count': 'max', 'likes_count': 'max',
-                                                 'link_present': 'max', 'photo_present': 'max', 'retweet': 'max'})
-
-    final['replies_count'] = final['replies_count'].astype(int)
-    final['retweets_count'] = final['retweets_count'].astype(int)
-    final['likes_count'] = final['likes_count'].astype(int)
-    final['link_present'] = final['link_present'].astype(int)
-    final['photo_present'] = final['photo_present'].astype(int)
-    final['retweet'] = final['retweet'].astype(int)
+        final = data.groupby(['link', 'tweet']).agg(merged_aggregates).astype(filtered_dtypes)
 
     final = final.reset_index(0).reset_index(0)
 
@@ -345,47 +746,159 @@ def aggregate_merged(file, mergetype):
 ### gather_fns_and_fps() and adds them into filtered2.csv. These are left-joined onto filtered.csv and then
 ### a new column is updated out of the two created from the join. This file is then returned to the original functions
 ### it was called from.
+###
+### file can also be a DataFrame which already holds the 'injury_report' and 'tweet' columns, e.g. from read_labels().
+###
+### The labels are matched on a hash of the tweet text by label_tools.propagate_labels(), which updates data in place
+### instead of merging. Labels come back as the text '0', '1' or 'x'.
 
 def append_labels(data, file):
+    return propagate_labels(data, [('labels', file)])[0]
 
-    # Left join onto existing filtered2.csv file after removing duplicates and empty rows.
+### read_labels()
+###
+### Reads only the labeled rows of a file such as filtered2.csv, a chunk at a time, so that the labels can be kept in
+### memory without loading the unlabeled pool.
 
-    labeled = pd.read_csv(file)
-    labeled = labeled[['injury_report', 'tweet']]
-    labeled = labeled[labeled['injury_report'] != 'x']
-    labeled = labeled.drop_duplicates()
-    labeled = labeled.dropna()
-    filtered = data.merge(labeled, on='tweet', how='left')
+def read_labels(file, chunksize=500000, storage=None):
+    chunks = [chunk[chunk['injury_report'] != 'x']
+              for chunk in get_storage(storage).read_chunks(file, ['injury_report', 'tweet'], chunksize)]
+    return pd.concat(chunks) if chunks else pd.DataFrame(columns=['injury_report', 'tweet'])
+
+### stream_aggregate_merged()
+###
+### Out-of-core version of aggregate_merged(). Raw twint csv files (the 'merged' files or the TweetData files directly)
+### are read chunksize rows at a time and aggregated in two passes:
+###
+###     1. Each chunk is given its flag columns and reduced with the same groupby max as aggregate_merged(). The
+###         reduced rows are hashed on their link into one of a number of partitions and spilled to disk.
+###     2. Each partition is read back on its own and reduced again. Since every copy of a (link, tweet) pair hashes to
+###         the same partition this gives the final value for each tweet, which is labeled with append_labels() and
+###         appended to the output file.
+###
+### Streaming trades time for memory. The labels are hashed once rather than once per partition, which on 60,000 rows
+### with labels took streaming from about 2.5 times the time of aggregating in memory to about 1.3 times; the rest is
+### the spilling and the second groupby. So reduced chunks are held in memory until they add up to more than
+### in_memory_rows rows, and only spilled from then on: smaller inputs are aggregated in one go without touching the
+### disk. in_memory_rows=0 always spills.
+###
+### Peak memory is bounded by one chunk plus one partition (or in_memory_rows reduced rows), so it can be lowered on the
+### pi by decreasing chunksize and in_memory_rows or increasing partitions. The rows written are the same as
+### aggregate_merged() followed by append_labels(), but are ordered by partition rather than sorted by link when
+### spilled. Returns the number of rows written.
+###
+### files and output are paths in the given storage backend (csv files by default).
+
+def _spill(reduced, partitions, spill_directory, spill_count):
+    partition_ids = pd.util.hash_pandas_object(reduced['link'], index=False).values % partitions
+    for partition, part in reduced.groupby(partition_ids):
+        part.to_pickle(os.path.join(spill_directory, '%d_%d.pkl' % (partition, spill_count)))
+
+def _spilled_partitions(spill_directory, partitions):
+    for partition in range(partitions):
+        yield [pd.read_pickle(os.path.join(spill_directory, entry)) for entry in os.listdir(spill_directory)
+               if entry.split('_')[0] == str(partition)]
+
+@instrumented()
+def stream_aggregate_merged(files, output, chunksize=250000, partitions=16, labels=None, storage=None,
+                            in_memory_rows=250000):
+    storage = get_storage(storage)
+    spill_directory = tempfile.mkdtemp(prefix='filtered_spill_', dir=os.path.dirname(os.path.abspath(output)))
+    writer = storage.writer(output, ['tweet', 'link'] + list(merged_aggregates), dataset_types['filtered2'])
+    sources = None if labels is None else [('labels', labels)]
+    winners = None if labels is None else label_winners(sources)
+    committed = False
+    rows = 0
+    rows_read = 0
 
     try:
-        filtered['injury_report'] = filtered['injury_report_y'].fillna(filtered['injury_report_x']).fillna('x')
-        filtered.drop(['injury_report_x', 'injury_report_y'], axis=1, inplace=True)
-    except KeyError:
-        filtered['injury_report'] = filtered['injury_report'].fillna('x')
-    return filtered
+        spill_count = 0
+        held = []
+        held_rows = 0
+
+        for file in files:
+            for chunk in storage.read_chunks(file, merged_columns, chunksize, merged_dtypes):
+                rows_read = rows_read + chunk.shape[0]
+                held.append(reduce_merged(chunk).reset_index())
+                held_rows = held_rows + held[-1].shape[0]
+
+                if spill_count or held_rows > in_memory_rows:
+                    for reduced in held:
+                        _spill(reduced, partitions, spill_directory, spill_count)
+                        spill_count = spill_count + 1
+                    held = []
+
+        for parts in (_spilled_partitions(spill_directory, partitions) if spill_count else [held]):
+            if not parts:
+                continue
+
+            final = aggregate_merged(parts, 0)
+            if labels is not None:
+                final = propagate_labels(final, sources, winners=winners)[0]
+
+            writer.write(final)
+            rows = rows + final.shape[0]
+            del parts, final
+
+        writer.close()
+        committed = True
+
+    finally:
+        shutil.rmtree(spill_directory, ignore_errors=True)
+        if not committed:
+            writer.close(commit=False)
+
+    current_stage().rows(rows_in=rows_read, rows_out=rows)
+    return rows
 
 ### merged_to_filtered()
 ###
 ### This function aggregates all merged files into one pandas dataframe, reduces its size to the columns of
 ### filtered2.csv, adds it to filtered.csv, and then updates the CSV file.
-
-def merged_to_filtered():
-    file_aggregates = [aggregate_merged(filename, 1) for filename in os.listdir() if 'merged' in filename]
-    filtered = aggregate_merged(file_aggregates, 0)
-    filtered = append_labels(filtered, 'filtered2.csv')
-    filtered.to_csv('filtered2.csv', index=False)
+###
+### If chunksize is given, the merged files are streamed through stream_aggregate_merged() instead so that they never
+### have to fit in memory at once. storage picks the backend the merged and filtered2 datasets are kept in.
+
+@instrumented()
+def merged_to_filtered(chunksize=None, partitions=16, storage=None):
+    storage = get_storage(storage)
+    merged_files = storage.merged_files()
+    output = storage.path('filtered2')
+
+    if chunksize is not None:
+        with stage('read_labels') as record:
+            labels = read_labels(output, storage=storage)
+            record.rows(rows_out=labels.shape[0])
+        rows = stream_aggregate_merged(merged_files, output, chunksize, partitions, labels, storage)
+        current_stage().rows(rows_out=rows)
+        return
+
+    with stage('aggregate files') as record:
+        file_aggregates = [aggregate_merged(filename, 1, storage) for filename in merged_files]
+        record.rows(rows_out=sum(aggregate.shape[0] for aggregate in file_aggregates))
+    with stage('aggregate all', rows_in=sum(aggregate.shape[0] for aggregate in file_aggregates)) as record:
+        filtered = aggregate_merged(file_aggregates, 0)
+        record.rows(rows_out=filtered.shape[0])
+    with stage('append_labels', rows_in=filtered.shape[0]):
+        filtered = append_labels(filtered, storage.read('filtered2', ['injury_report', 'tweet']))
+    with stage('write filtered2', rows_out=filtered.shape[0]):
+        storage.write('filtered2', filtered)
+    current_stage().rows(rows_out=filtered.shape[0])
 
 ### label_filtered_duplicates():
 ###
 ### A rarely-used function meant to make sure non-unique tweet text is labeled if one of its copies has already been
-### labeled.
-
-def label_filtered_duplicates():
-    filtered = pd.read_csv('filtered2.csv')
-    labeled_data = filtered[filtered['injury_report'] != 'x'][['tweet', 'injury_report']].drop_duplicates()
-    labeled_data.to_csv('copy.csv', index=False)
-    filtered = append_labels(filtered, 'copy.csv')
-    filtered.to_csv('filtered2.csv', index=False)
+### labeled. Only unlabeled rows are changed, and the number of them labeled is returned.
+
+@instrumented()
+def label_filtered_duplicates(storage=None):
+    storage = get_storage(storage)
+    filtered = storage.read('filtered2')
+    filtered, changed = propagate_labels(filtered, [('duplicates', filtered[['injury_report', 'tweet']].copy())],
+                                         fill_only=True)
+    storage.write('filtered2', filtered)
+    current_stage().rows(rows_in=filtered.shape[0], rows_out=changed['duplicates'])
+    return changed['duplicates']
 
 ### filtered_to_clean():
 ###
@@ -397,17 +910,41 @@ def label_filtered_duplicates():
 ###     3. clean - the tweet when modified the clean_text() function.
 ###     4. clean2 - the tweet when modified by the cleaning_total() function, but names are kept.
 ###     5. clean2_no_name - the tweet when the tweet when modified by the cleaning_total() function, but names aren't kept.
+###
+### data can be given to skip reading filtered2.csv, e.g. the labeled rows of a TweetStore. If workers is more than 1,
+### the cleaning is spread over a process pool (see map_in_batches()). If a CleanedTextCache is given, tweets cleaned in
+### earlier runs are looked up instead of cleaned again. storage picks the backend filtered2 is read from and clean is
+### written to; only the injury_report and tweet columns of filtered2 are read.
+###
+### near_duplicates can be a dedup_tools.NearDuplicateIndex, in which case tweets which are near-duplicates of each other
+### with the same label are only kept once, the same as exact copies. The tweets are added to the index and it is saved.
     
-def filtered_to_clean():
-    data = pd.read_csv('filtered2.csv')
+@instrumented()
+def filtered_to_clean(data=None, workers=1, batch_size=2000, cache=None, storage=None, near_duplicates=None):
+    storage = get_storage(storage)
+    if data is None:
+        with stage('read filtered2') as record:
+            data = storage.read('filtered2', ['injury_report', 'tweet'])
+            record.rows(rows_out=data.shape[0])
+    current_stage().rows(rows_in=data.shape[0])
     data = data[data['injury_report'] != 'x']
     data = data[['injury_report', 'tweet']]
     data = data.drop_duplicates()
     data = data[data['tweet'].apply(lambda x: isinstance(x, str))]
-    data['clean'] = data['tweet'].apply(lambda txt: clean_text(txt))
+    if near_duplicates is not None:
+        with stage('near duplicates', rows_in=data.shape[0]) as record:
+            clusters = pd.DataFrame({'injury_report': data['injury_report'].values,
+                                     'cluster': near_duplicates.add(data['tweet'])})
+            data = data[~clusters.duplicated().values]
+            near_duplicates.save()
+            record.rows(rows_out=data.shape[0])
+    with stage('clean_column', rows_in=data.shape[0]):
+        data['clean'] = clean_column(data['tweet'], cache, workers, batch_size)
     data.dropna(inplace = True)
-    data.to_csv('clean.csv', index=False)
-    cleaning_total()
+    with stage('write clean', rows_out=data.shape[0]):
+        storage.write('clean', data)
+    current_stage().rows(rows_out=data.shape[0])
+    cleaning_total(workers, batch_size, cache, storage)
     del data
 
 ### get_data_to_label()
@@ -417,54 +954,88 @@ def filtered_to_clean():
 ###     1. Randomly find 1000 datapoints to label.
 ###     2. Randomly take 100,000 tweets and use logistic regression to find positive cases to label. This produces new
 ###         datapoints which are disproportionately class 1 - otherwise it would be difficult to find positive tweets.
+###
+### cache can be a CleanedTextCache so that tweets already cleaned in earlier runs are not cleaned again, and registry a
+### ModelRegistry with logistic_regression already loaded. Only the injury_report and tweet columns of filtered2 are read
+### from the storage backend.
+###
+### filtered2 is streamed chunksize rows at a time through sampling_tools.sample_pool(), so only the samples are ever
+### held in memory. The number of samples and the strategy used to pick the scored ones ('positive', 'uncertainty' or
+### 'random') can be changed; screen_size=None scores every unlabeled tweet instead of a random 100,000. The scored
+### tweets are written best first with the model's probability.
+###
+### near_duplicates can be a dedup_tools.NearDuplicateIndex so that at most one tweet of each near-duplicate cluster is
+### sampled. The streamed tweets are only looked up in the index (sample_keys()), so it does not grow with the pool;
+### the sampled tweets alone are added at the end, any of them found to be near-duplicates of one sampled before are
+### dropped, and the index is saved. Running label_near_duplicates() first also keeps near-duplicates of tweets already
+### labeled out of the pool.
+###
+### models is the folder logistic_regression is loaded from, e.g. online_tools.latest_version() for the online models.
     
-def get_data_to_label():
-    data = pd.read_csv('filtered2.csv')
-    data = data[data['injury_report'] == 'x']
-    data = data[['injury_report', 'tweet']]
-    data.drop_duplicates(inplace = True)
-    data.dropna(inplace = True)
-    
-    samples_to_label = data.sample(1000)
-    samples_to_label.to_csv('sampled.csv')
+@instrumented()
+def get_data_to_label(cache=None, registry=None, storage=None, random_samples=1000, scored_samples=1000,
+                      strategy='positive', screen_size=100000, chunksize=250000, batch_size=2000, seed=None,
+                      near_duplicates=None, models='Classical Models'):
+    storage = get_storage(storage)
+
+    if registry is None and strategy != 'random':
+        registry = ModelRegistry(models, ['logistic_regression'])
+
+    def score(tweets):
+        return registry.predict_proba(clean_column(tweets, cache), 'logistic_regression')
+
+    chunks = storage.read_chunks(storage.path('filtered2'), ['injury_report', 'tweet'], chunksize)
+    samples_to_label, scored = sample_pool(chunks, random_samples, scored_samples, strategy, score, screen_size,
+                                           batch_size, seed, None if near_duplicates is None else
+                                           near_duplicates.sample_keys)
+    if near_duplicates is not None:
+        samples_to_label = samples_to_label[near_duplicates.add_distinct(samples_to_label['tweet'])]
+        scored = scored[near_duplicates.add_distinct(scored['tweet'])]
+        samples_to_label, scored = samples_to_label.reset_index(drop=True), scored.reset_index(drop=True)
+        near_duplicates.save()
 
-    lgr = load('Classical Models//logistic_regression.joblib')
-    v_tfidf = load('Classical Models//tfidf.joblib')
-
-    data = data.sample(100000)
-    data['clean'] = data['tweet'].apply(lambda txt: clean_text(txt))
-    data['lgr_predictions'] = lgr.predict(v_tfidf.transform(data['clean']))
-    positives = data[data['lgr_predictions'] == 1]
-    positives = positives[['injury_report', 'tweet']]
-    positives.to_csv('positive_samples.csv')
-    del data
+    samples_to_label.to_csv('sampled.csv')
+    scored.to_csv('positive_samples.csv')
+    current_stage().rows(rows_out=samples_to_label.shape[0] + scored.shape[0])
 
 ### label_new_data()
 ###
 ### Short function which takes all samples generated from the get_data_to_label() function and adds them to filtered2.csv.
+###
+### Both files are applied in one pass, positive_samples.csv taking priority over sampled.csv where they disagree. The
+### number of rows each file changed is printed and returned.
+
+@instrumented()
+def label_new_data(storage=None, files=('positive_samples.csv', 'sampled.csv')):
+    storage = get_storage(storage)
+    filtered = storage.read('filtered2')
+    filtered, changed = propagate_labels(filtered, [(file, file) for file in files])
+    storage.write('filtered2', filtered)
+    current_stage().rows(rows_in=filtered.shape[0], rows_out=sum(changed.values()))
 
-def label_new_data():
-    filtered = pd.read_csv('filtered2.csv')
-    filtered = append_labels(filtered, 'sampled.csv')
-    filtered = append_labels(filtered, 'positive_samples.csv')
-    filtered.to_csv('filtered2.csv', index=False)
+    for file in files:
+        print(file + ':', changed[file], 'rows relabeled')
+    return changed
 
 ### gather_fns_and_fps
 ###
 ### Extended function for finding all false positives and false negatives in our dataset from our models - typically
 ### we might find mislabelings here. All classical models are loaded, and then their outputs are recorded into csv files
 ### which are checked.
+###
+### The models are scored through a ModelRegistry, so each vectorizer transforms the text once for its whole group of
+### models, and the fps_total / fns_total files are built in memory rather than read back from the files just written.
+### The registry's timings are printed per model at the end; pass one in to reuse models which are already loaded.
+###
+### cache can be a CleanedTextCache so that tweets already cleaned in earlier runs are not cleaned again, and features a
+### FeatureStore so that the feature matrices of the file (stored under its name) are memory-mapped rather than built
+### again. models is the folder the models are loaded from, e.g. online_tools.latest_version() for the online models.
 
-def gather_fns_and_fps(filename):
+@instrumented()
+def gather_fns_and_fps(filename, cache=None, registry=None, features=None, models='Classical Models'):
     # load all models and transforming functions.
 
-    classical_models = [[entry.split('.')[0], load('Classical Models\\' + entry)]
-                        for entry in os.listdir('Classical Models')
-                        if entry not in ['bool.joblib', 'count.joblib', 'tfidf.joblib']]
-
-    v_bool = load('Classical Models\\bool.joblib')
-    v_tfidf = load('Classical Models\\tfidf.joblib')
-    v_count = load('Classical Models\\count.joblib')
+    registry = ModelRegistry(models) if registry is None else registry
 
     data = pd.read_csv(filename)
 
@@ -475,65 +1046,42 @@ def gather_fns_and_fps(filename):
         data = data[['injury_report', 'tweet']]
         data.drop_duplicates(inplace=True)
         data.dropna(inplace=True)
-        data['clean'] = data['tweet'].apply(lambda txt: clean_text(txt))
+        with stage('clean_column', rows_in=data.shape[0]):
+            data['clean'] = clean_column(data['tweet'], cache)
+    current_stage().rows(rows_in=data.shape[0])
 
     # Get all false positives and false negatives and send them to files for observation.
+    # We specifically exclude the kNN from the totals due to poor performance.
 
-    for models in classical_models:
-
-        if models[0] in ['bernoulliNB', 'gradient_boosting', 'kNN_bool', 'random_forest_bool']:
-
-            data[models[0] + '_predictions'] = models[1].predict(v_bool.transform(data['clean']))
-            data[models[0] + '_fns'] = ((data['injury_report'].astype(int) == 1) &
-                                        (data[models[0] + '_predictions'] == 0)).astype(int)
-            data[models[0] + '_fps'] = ((data['injury_report'].astype(int) == 0) &
-                                        (data[models[0] + '_predictions'] == 1)).astype(int)
-
-            data[data[models[0] + '_fns'] == 1][['injury_report', 'tweet', 'clean']].to_csv(
-                'fns and fps\\' + models[0] + '_fns.csv', index=False)
-
-            data[data[models[0] + '_fps'] == 1][['injury_report', 'tweet', 'clean']].to_csv(
-                'fns and fps\\' + models[0] + '_fps.csv', index=False)
+    labels = data['injury_report'].astype(int).values
+    fps_total = []
+    fns_total = []
 
+    matrices = None
+    if features is not None:
+        with stage('transform', rows_in=data.shape[0]):
+            matrices = registry.transform(data['clean'], store=features,
+                                          dataset=os.path.splitext(os.path.basename(filename))[0])
 
-        elif models[0] in ['kNN_tfidf', 'logistic_regression', 'random_forest_tfidf', 'svm']:
+    with stage('predict', rows_in=data.shape[0]):
+        model_predictions = registry.predict(data['clean'], features=matrices)
 
-            data[models[0] + '_predictions'] = models[1].predict(v_tfidf.transform(data['clean']))
-            data[models[0] + '_fns'] = ((data['injury_report'].astype(int) == 1) &
-                                        (data[models[0] + '_predictions'] == 0)).astype(int)
-            data[models[0] + '_fps'] = ((data['injury_report'].astype(int) == 0) &
-                                        (data[models[0] + '_predictions'] == 1)).astype(int)
+    for name, predictions in model_predictions.items():
+        fns = data[(labels == 1) & (predictions == 0)][['injury_report', 'tweet', 'clean']]
+        fps = data[(labels == 0) & (predictions == 1)][['injury_report', 'tweet', 'clean']]
 
-            data[data[models[0] + '_fns'] == 1][['injury_report', 'tweet', 'clean']].to_csv(
-                'fns and fps\\' + models[0] + '_fns.csv', index=False)
+        fns.to_csv(os.path.join('fns and fps', name + '_fns.csv'), index=False)
+        fps.to_csv(os.path.join('fns and fps', name + '_fps.csv'), index=False)
 
-            data[data[models[0] + '_fps'] == 1][['injury_report', 'tweet', 'clean']].to_csv(
-                'fns and fps\\' + models[0] + '_fps.csv', index=False)
+        if 'kNN' not in name:
+            fns_total.append(fns)
+            fps_total.append(fps)
 
-        else:
-
-            data[models[0] + '_predictions'] = models[1].predict(v_count.transform(data['clean']))
-            data[models[0] + '_fns'] = ((data['injury_report'].astype(int) == 1) &
-                                        (data[models[0] + '_predictions'] == 0)).astype(int)
-            data[models[0] + '_fps'] = ((data['injury_report'].astype(int) == 0) &
-                                        (data[models[0] + '_predictions'] == 1)).astype(int)
-
-            data[data[models[0] + '_fns'] == 1][['injury_report', 'tweet', 'clean']].to_csv(
-                'fns and fps\\' + models[0] + '_fns.csv', index=False)
+    # Create a file combining all false positives and false negatives.
 
-            data[data[models[0] + '_fps'] == 1][['injury_report', 'tweet', 'clean']].to_csv(
-                'fns and fps\\' + models[0] + '_fps.csv', index=False)
+    pd.concat(fps_total, axis=0).drop_duplicates().to_csv(os.path.join('fns and fps', 'fps_total.csv'), index=False)
+    pd.concat(fns_total, axis=0).drop_duplicates().to_csv(os.path.join('fns and fps', 'fns_total.csv'), index=False)
 
-    # Create a file combining all false positives and false negatives.
-    # We specifically exclude the kNN due to poor performance.
-
-    fps = pd.concat([pd.read_csv('fns and fps\\' + files) for files in os.listdir('fns and fps')
-                     if 'fps' in files and 'total' not in files and 'kNN' not in files], axis=0)
-    fps.drop_duplicates(inplace=True)
-    fps.to_csv('fns and fps\\fps_total.csv', index=False)
-
-    fns = pd.concat([pd.read_csv('fns and fps\\' + files) for files in os.listdir('fns and fps')
-                     if 'fns' in files and 'total' not in files and 'kNN' not in files], axis=0)
-    fns.drop_duplicates(inplace=True)
-    fns.to_csv('fns and fps\\fns_total.csv', index=False)
-    
\ No newline at end of file
+    registry.report()
+    if features is not None:
+        features.report()
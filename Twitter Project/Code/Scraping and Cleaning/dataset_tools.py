@@ -0,0 +1,325 @@
+"""
+Dataset Tools
+
+Holds the storage backends used to pass the merged, filtered2 and clean datasets between the stages of the pipeline.
+CsvStorage reads and writes the csv files the pipeline has always used, and ParquetStorage keeps the same datasets as
+compressed, typed Parquet files (the merged set partitioned by scrape date) so that readers only load the columns they
+need. convert_datasets() moves everything from one backend to the other.
+
+pyarrow is only needed for ParquetStorage.
+"""
+
+import os
+import re
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+### dataset_names, dataset_types
+###
+### The datasets which can be kept in a storage backend besides the merged set, and the types their columns are given
+### when written to Parquet. 'label' columns are kept as the text '0', '1' or 'x', the same way they read back from
+### filtered2.csv.
+
+dataset_names = ['filtered2', 'clean']
+
+dataset_types = {'filtered2': {'tweet': 'str', 'link': 'str', 'replies_count': 'int32', 'retweets_count': 'int32',
+                               'likes_count': 'int32', 'link_present': 'int8', 'photo_present': 'int8',
+                               'retweet': 'int8', 'injury_report': 'label'},
+                 'clean': {'injury_report': 'int8', 'tweet': 'str', 'clean': 'str', 'clean2': 'str',
+                           'clean2_no_names': 'str'}}
+
+### HELPER FUNCTIONS
+
+### _label()
+###
+### Labels are stored as text the same way they read back from filtered2.csv: '0', '1' or 'x'. Label files with empty
+### rows are read by pandas as floats, so 1.0 is stored as '1'.
+
+def _label(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+### typed()
+###
+### Returns a copy of data with its columns converted to the given types. Columns missing from data are ignored.
+
+def typed(data, types):
+    data = data.copy()
+
+    for column, dtype in types.items():
+        if column not in data.columns:
+            continue
+        if dtype == 'label':
+            data[column] = data[column].map(_label)
+        elif dtype == 'str':
+            values = data[column].astype(object)
+            data[column] = values.where(values.isna(), values.astype(str))
+        elif data[column].dtype == object:  # e.g. labels read back from csv as '1' or '1.0'
+            data[column] = pd.to_numeric(data[column]).astype(dtype)
+        else:
+            data[column] = data[column].astype(dtype)
+
+    return data
+
+### _astype()
+###
+### Gives the columns of data which are named in dtype (as in pd.read_csv()) their types.
+
+def _astype(data, dtype):
+    if not dtype:
+        return data
+    return data.astype({column: value for column, value in dtype.items() if column in data.columns})
+
+### arrow_safe()
+###
+### Raw twint frames concatenated from many files can hold numbers and text in the same column, which Parquet cannot
+### store. Every object column is turned into text, keeping missing values missing.
+
+def arrow_safe(data):
+    return typed(data, {column: 'str' for column in data.columns if data[column].dtype == object})
+
+### _merged_name()
+###
+### Gives the file number and scrape date of a merged file, either a 'merged (file number) (date).csv' file or a
+### 'scrape_date=(date)/part-(file number).parquet' file. The older csv files (merged.csv, merged2.csv,
+### 'InsideInjuries merged.csv') have no date and give (None, None).
+
+merged_csv_re = re.compile(r'^merged (\d+) (\d{4}-\d{1,2}-\d{1,2})\.csv$')
+merged_parquet_re = re.compile(r'^scrape_date=(.+)/part-(\d+)\.parquet$')
+
+def _merged_name(filename):
+    match = merged_csv_re.match(os.path.basename(filename))
+    if match is not None:
+        return int(match.group(1)), match.group(2)
+
+    match = merged_parquet_re.match(os.path.basename(os.path.dirname(filename)) + '/' + os.path.basename(filename))
+    if match is not None:
+        return int(match.group(2)), match.group(1)
+
+    return None, None
+
+### CsvStorage
+###
+### The csv files in a directory (the working directory by default): filtered2.csv, clean.csv and the
+### 'merged (file number) (date).csv' files written by scrape_to_merge(). Every file is a plain path, so this behaves
+### exactly like the pipeline did before the storage backends were added.
+
+class CsvStorage:
+
+    format = 'csv'
+
+    def __init__(self, directory=''):
+        self.directory = directory
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.csv')
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def read(self, name, columns=None):
+        return self.read_file(self.path(name), columns)
+
+    def read_file(self, path, columns=None, dtype=None):
+        return pd.read_csv(path, usecols=columns, dtype=dtype)
+
+    def read_chunks(self, path, columns=None, chunksize=250000, dtype=None):
+        return pd.read_csv(path, usecols=columns, chunksize=chunksize, dtype=dtype)
+
+    def columns(self, path):
+        return list(pd.read_csv(path, nrows=0).columns)
+
+    def write(self, name, data, index=False):
+        data.to_csv(self.path(name), index=index)
+
+    def writer(self, path, columns, types=None):
+        return _CsvWriter(path, columns)
+
+    ### merged_files()
+    ###
+    ### Every file in the directory with 'merged' in its name, or only the dated ones from the given scrape dates.
+
+    def merged_files(self, scrape_dates=None):
+        files = [os.path.join(self.directory, filename) for filename in os.listdir(self.directory or '.')
+                 if 'merged' in filename]
+        if scrape_dates is not None:
+            files = [file for file in files if _merged_name(file)[1] in scrape_dates]
+        return files
+
+    def write_merged(self, data, scrape_date, part):
+        data.to_csv(os.path.join(self.directory, 'merged ' + str(part) + ' ' + scrape_date + '.csv'), index=False)
+
+### ParquetStorage
+###
+### Datasets kept as zstd-compressed Parquet files in a directory ('datasets' by default): filtered2.parquet,
+### clean.parquet and merged/scrape_date=<date>/part-<number>.parquet. Columns are written with the types in
+### dataset_types, and reads only decode the columns asked for.
+
+class ParquetStorage:
+
+    format = 'parquet'
+
+    def __init__(self, directory='datasets', compression='zstd'):
+        if pa is None:
+            raise ImportError('ParquetStorage needs pyarrow - pip install pyarrow')
+
+        self.directory = directory
+        self.compression = compression
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.parquet')
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def read(self, name, columns=None):
+        return self.read_file(self.path(name), columns)
+
+    def read_file(self, path, columns=None, dtype=None):
+        # self_destruct frees each arrow column once it has been converted, so the table and the DataFrame are not both
+        # held in memory.
+        return _astype(pq.read_table(path, columns=columns).to_pandas(split_blocks=True, self_destruct=True), dtype)
+
+    def read_chunks(self, path, columns=None, chunksize=250000, dtype=None):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield _astype(batch.to_pandas(), dtype)
+
+    def columns(self, path):
+        return pq.read_schema(path).names
+
+    def write(self, name, data, index=False):
+        self.write_file(self.path(name), typed(data, dataset_types.get(name, {})))
+
+    def write_file(self, path, data):
+        temporary = path + '.tmp'
+        pq.write_table(pa.Table.from_pandas(data, preserve_index=False), temporary, compression=self.compression)
+        os.replace(temporary, path)
+
+    def writer(self, path, columns, types=None):
+        return _ParquetWriter(path, columns, types or {}, self.compression)
+
+    def merged_files(self, scrape_dates=None):
+        directory = os.path.join(self.directory, 'merged')
+        if not os.path.isdir(directory):
+            return []
+
+        files = []
+        for partition in sorted(os.listdir(directory)):
+            if scrape_dates is not None and partition.split('=', 1)[-1] not in scrape_dates:
+                continue
+            files = files + [os.path.join(directory, partition, filename)
+                             for filename in sorted(os.listdir(os.path.join(directory, partition)))
+                             if filename.endswith('.parquet')]
+        return files
+
+    def write_merged(self, data, scrape_date, part):
+        directory = os.path.join(self.directory, 'merged', 'scrape_date=' + scrape_date)
+        os.makedirs(directory, exist_ok=True)
+        self.write_file(os.path.join(directory, 'part-' + str(part) + '.parquet'), arrow_safe(data))
+
+### Writers
+###
+### Used by stream_aggregate_merged() to write a dataset a chunk at a time. Chunks go to a temporary file which replaces
+### path once the writer is closed with commit=True; closing a writer with nothing written leaves an empty dataset with
+### the given columns.
+
+class _CsvWriter:
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self.temporary = path + '.tmp'
+        self.header = True
+
+    def write(self, data):
+        data.to_csv(self.temporary, mode='w' if self.header else 'a', header=self.header, index=False)
+        self.header = False
+
+    def close(self, commit=True):
+        if commit and self.header:
+            self.write(pd.DataFrame(columns=self.columns))
+        if commit:
+            os.replace(self.temporary, self.path)
+        elif os.path.exists(self.temporary):
+            os.remove(self.temporary)
+
+class _ParquetWriter:
+
+    def __init__(self, path, columns, types, compression):
+        self.path = path
+        self.columns = columns
+        self.types = types
+        self.compression = compression
+        self.temporary = path + '.tmp'
+        self.writer = None
+
+    def write(self, data):
+        table = pa.Table.from_pandas(typed(data, self.types), preserve_index=False,
+                                     schema=None if self.writer is None else self.writer.schema)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.temporary, table.schema, compression=self.compression)
+        self.writer.write_table(table)
+
+    def close(self, commit=True):
+        if commit and self.writer is None:
+            self.write(pd.DataFrame({column: pd.Series(dtype=_empty_type(self.types.get(column)))
+                                     for column in self.columns}))
+        if self.writer is not None:
+            self.writer.close()
+        if commit:
+            os.replace(self.temporary, self.path)
+        elif os.path.exists(self.temporary):
+            os.remove(self.temporary)
+
+def _empty_type(dtype):
+    return object if dtype in (None, 'str', 'label') else dtype
+
+### get_storage()
+###
+### Pipeline functions take a storage argument which may be None (the csv files in the working directory), 'csv',
+### 'parquet' (the 'datasets' directory) or an existing backend.
+
+def get_storage(storage=None):
+    if storage is None or storage == 'csv':
+        return CsvStorage()
+    if storage == 'parquet':
+        return ParquetStorage()
+    return storage
+
+### convert_datasets()
+###
+### Copies the merged, filtered2 and clean datasets from one backend to another a chunk at a time, e.g.
+### convert_datasets('csv', 'parquet') to move over to Parquet or convert_datasets('parquet', 'csv') to export csv files
+### for the notebooks. The unnamed index columns clean.csv picks up from cleaning_total() are dropped. Merged csv files
+### without a date in their name are put under the scrape date 'undated'.
+
+def convert_datasets(source, target, names=dataset_names, merged=True, chunksize=250000):
+    source, target = get_storage(source), get_storage(target)
+
+    for name in names:
+        if not source.exists(name):
+            continue
+
+        columns = [column for column in source.columns(source.path(name)) if not column.startswith('Unnamed: ')]
+        writer = target.writer(target.path(name), columns, dataset_types.get(name))
+
+        try:
+            for chunk in source.read_chunks(source.path(name), columns, chunksize):
+                writer.write(chunk)
+        except BaseException:
+            writer.close(commit=False)
+            raise
+        writer.close()
+
+    if merged:
+        for number, file in enumerate(source.merged_files(), 1):
+            part, scrape_date = _merged_name(file)
+            target.write_merged(source.read_file(file), scrape_date or 'undated', number if part is None else part)
@@ -0,0 +1,302 @@
+"""
+Dedup Tools
+
+Holds the NearDuplicateIndex, a MinHash / locality-sensitive hashing index over the tokens of cleaning_function_part_1()
+which groups tweets that are near-duplicates of each other: retweets and reposts differing only by a hyperlink, a
+handle or an emoji. Candidate pairs come from LSH buckets rather than comparing every pair of tweets, so clustering
+takes close to linear time, and the index is saved to disk so new scrapes are only checked against it.
+
+label_near_duplicates() uses it to give unlabeled near-duplicates the label of their cluster, and filtered_to_clean()
+and get_data_to_label() can take an index to collapse near-duplicates.
+"""
+
+import os
+import re
+import json
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from cleaning_tools import tweet_normalizer, cleaner_version
+from dataset_tools import get_storage
+from feature_tools import _save_array
+from label_tools import propagate_labels, text_labels
+from instrument_tools import instrumented, current_stage
+
+### HELPER FUNCTIONS
+
+### tweet_shingles()
+###
+### The shingles a tweet is compared on: runs of shingle_size word tokens of its cleaning_function_part_1() text, so
+### hyperlinks, handles and emojis have already become hyperlinkToken, accountToken and emojiToken. Every tweet gives
+### at least one shingle.
+
+token_re = re.compile(r"\w+")
+
+def tweet_shingles(tweet, shingle_size=1, normalizer=tweet_normalizer):
+    tokens = token_re.findall(normalizer.normalize(tweet))
+    if len(tokens) <= shingle_size:
+        return [' '.join(tokens)]
+    return list(set(' '.join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)))
+
+# numpy 2.0 renamed trapz() to trapezoid(), and later releases drop trapz().
+try:
+    _trapezoid = np.trapezoid
+except AttributeError:
+    _trapezoid = np.trapz
+
+### lsh_bands()
+###
+### Splits num_perm MinHash values into bands of rows so that two tweets share a bucket with probability
+### 1 - (1 - s ** rows) ** bands at similarity s. The split picked is the one whose false positives below threshold and
+### false negatives above it add up to the smallest area.
+
+def lsh_bands(threshold, num_perm):
+    similarity = np.linspace(0, 1, 1001)
+    best, best_error = (1, num_perm), np.inf
+
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        collision = 1 - (1 - similarity ** rows) ** bands
+        error = _trapezoid(np.where(similarity < threshold, collision, 0), similarity) + \
+            _trapezoid(np.where(similarity >= threshold, 1 - collision, 0), similarity)
+        if error < best_error:
+            best, best_error = (bands, rows), error
+
+    return best
+
+### NearDuplicateIndex
+###
+### Every distinct tweet added gets a row holding the key of its token text, its MinHash signature (num_perm 32 bit
+### values, one per multiply-shift hash of its shingles) and one bucket key per LSH band. Two tweets are near-duplicates
+### when the share of their signatures which agree, an estimate of the Jaccard similarity of their shingles, is at least
+### threshold. Clusters are the connected groups of near-duplicates, and are named by their first row.
+###
+### Tweets are only compared with the first tweet in each of their buckets, so a group of a thousand copies costs a
+### thousand comparisons, not half a million. Tweets with the same tokens share a row and are never hashed twice.
+###
+### With a directory, the index is loaded from it if it was built with the same settings and cleaner_version, and
+### save() writes it back (keys.npy, signatures.npy, band_keys.npy, clusters.npy and meta.json). Without one it only
+### lives in memory.
+
+class NearDuplicateIndex:
+
+    def __init__(self, directory='Near Duplicate Index', threshold=0.8, num_perm=128, shingle_size=1, seed=1,
+                 batch_size=2000, normalizer=tweet_normalizer):
+        self.directory = directory
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.batch_size = batch_size
+        self.normalizer = normalizer
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+
+        state = np.random.RandomState(seed)
+        self.multipliers = state.randint(0, 2 ** 62, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.offsets = state.randint(0, 2 ** 62, num_perm, dtype=np.uint64)
+        self.meta = {'cleaner_version': cleaner_version, 'threshold': threshold, 'num_perm': num_perm,
+                     'shingle_size': shingle_size, 'seed': seed}
+
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self.band_keys = np.zeros((0, self.bands), dtype=np.uint64)
+        self.clusters = np.zeros(0, dtype=np.int64)
+
+        if directory is not None and self._saved_meta() == self.meta:
+            for name in ['keys', 'signatures', 'band_keys', 'clusters']:
+                setattr(self, name, np.load(os.path.join(directory, name + '.npy')))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _saved_meta(self):
+        if not os.path.exists(os.path.join(self.directory, 'meta.json')):
+            return None
+        with open(os.path.join(self.directory, 'meta.json')) as file:
+            return json.load(file)
+
+    def save(self):
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+
+        # The meta is removed first, so a save interrupted half way leaves nothing that looks valid.
+        if os.path.exists(os.path.join(self.directory, 'meta.json')):
+            os.remove(os.path.join(self.directory, 'meta.json'))
+
+        for name in ['keys', 'signatures', 'band_keys', 'clusters']:
+            _save_array(self.directory, name, getattr(self, name))
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as file:
+            json.dump(self.meta, file)
+
+    ### signatures_of()
+    ###
+    ### The token key, MinHash signature and band keys of every tweet, computed batch_size tweets at a time so the
+    ### (shingles x num_perm) array stays small.
+
+    def signatures_of(self, tweets):
+        shingles = [tweet_shingles(tweet, self.shingle_size, self.normalizer) for tweet in tweets]
+        keys = pd.util.hash_pandas_object(pd.Series(['\n'.join(sorted(entry)) for entry in shingles], dtype=object),
+                                          index=False).values
+        signatures = np.zeros((len(shingles), self.num_perm), dtype=np.uint32)
+
+        for start in range(0, len(shingles), self.batch_size):
+            batch = shingles[start:start + self.batch_size]
+            lengths = np.array([len(entry) for entry in batch])
+            flat = pd.Series([shingle for entry in batch for shingle in entry], dtype=object)
+            hashes = pd.util.hash_pandas_object(flat, index=False).values >> np.uint64(32)
+
+            # Multiply-shift hashing: the top 32 bits of (a * x + b) mod 2 ** 64 for a random odd a.
+            values = (hashes[:, None] * self.multipliers + self.offsets) >> np.uint64(32)
+            starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+            signatures[start:start + len(batch)] = np.minimum.reduceat(values, starts, axis=0)
+
+        return keys, signatures, self._band_keys(signatures)
+
+    def _band_keys(self, signatures):
+        bands = signatures[:, :self.bands * self.rows].reshape(len(signatures), self.bands, self.rows)
+        keys = np.full((len(signatures), self.bands), 0xcbf29ce484222325, dtype=np.uint64)
+        for row in range(self.rows):
+            keys = (keys ^ bands[:, :, row].astype(np.uint64)) * np.uint64(0x100000001b3)
+        return keys
+
+    ### _matches()
+    ###
+    ### Pairs (row, head) of rows from `first` onwards which are near-duplicates of the first row in one of their
+    ### buckets, among all the rows in band_keys.
+
+    def _matches(self, signatures, band_keys, first):
+        rows, heads = [], []
+        new_rows = np.arange(first, len(band_keys))
+
+        for band in range(self.bands):
+            _, head_index, inverse = np.unique(band_keys[:, band], return_index=True, return_inverse=True)
+            band_heads = head_index[inverse.ravel()][first:]
+            candidates = band_heads != new_rows
+            rows.append(new_rows[candidates])
+            heads.append(band_heads[candidates])
+
+        pairs = np.unique(np.stack([np.concatenate(rows), np.concatenate(heads)], axis=1), axis=0)
+        similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+        return pairs[similarity >= self.threshold]
+
+    ### add()
+    ###
+    ### Adds tweets to the index and returns the cluster of each. Adding tweets can join clusters together, so the
+    ### clusters of tweets added earlier may change to the smaller cluster number.
+
+    def add(self, tweets):
+        keys, signatures, band_keys = self.signatures_of(list(tweets))
+        rows = pd.Index(self.keys).get_indexer(keys)
+
+        # New rows are added in the order the tweets were given, so the clusters do not depend on how tweets are split
+        # between calls.
+        _, new_positions = np.unique(keys[rows < 0], return_index=True)
+        new_positions = np.flatnonzero(rows < 0)[np.sort(new_positions)]
+        first = len(self.keys)
+
+        if len(new_positions):
+            self.keys = np.concatenate([self.keys, keys[new_positions]])
+            self.signatures = np.concatenate([self.signatures, signatures[new_positions]])
+            self.band_keys = np.concatenate([self.band_keys, band_keys[new_positions]])
+            pairs = self._matches(self.signatures, self.band_keys, first)
+
+            edges = np.concatenate([np.stack([np.arange(first), self.clusters], axis=1), pairs])
+            graph = sparse.coo_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])),
+                                      shape=(len(self.keys), len(self.keys)))
+            _, components = connected_components(graph, directed=False)
+
+            names = np.full(components.max() + 1, len(self.keys), dtype=np.int64)
+            np.minimum.at(names, components, np.arange(len(self.keys)))
+            self.clusters = names[components]
+
+        return self.clusters[pd.Index(self.keys).get_indexer(keys)]
+
+    ### query()
+    ###
+    ### The cluster of each tweet without adding anything: the tweet's own cluster if it is in the index, the cluster of
+    ### the closest near-duplicate found otherwise, and -1 if there is none. Used to check new scrapes against the
+    ### index.
+
+    def query(self, tweets):
+        keys, signatures, band_keys = self.signatures_of(list(tweets))
+        clusters = np.full(len(keys), -1, dtype=np.int64)
+
+        rows = pd.Index(self.keys).get_indexer(keys)
+        clusters[rows >= 0] = self.clusters[rows[rows >= 0]]
+
+        missing = np.flatnonzero(rows < 0)
+        if len(missing) and len(self.keys):
+            first = len(self.keys)
+            pairs = self._matches(np.concatenate([self.signatures, signatures[missing]]),
+                                  np.concatenate([self.band_keys, band_keys[missing]]), first)
+            pairs = pairs[pairs[:, 1] < first]
+
+            similarity = (signatures[missing][pairs[:, 0] - first] == self.signatures[pairs[:, 1]]).mean(axis=1)
+            best = pd.DataFrame({'row': pairs[:, 0] - first, 'head': pairs[:, 1], 'similarity': similarity})
+            best = best.sort_values('similarity', kind='stable').drop_duplicates('row', keep='last')
+            clusters[missing[best['row'].values]] = self.clusters[best['head'].values]
+
+        return clusters
+
+    ### sample_keys()
+    ###
+    ### A sampling key for each tweet, without adding anything: 'cluster (n)' when the index holds a near-duplicate of
+    ### it, the tweet itself otherwise. Given to sampling_tools.sample_pool() as keys, so the index does not grow with
+    ### the pool streamed through it.
+
+    def sample_keys(self, tweets):
+        tweets = list(tweets)
+        clusters = self.query(tweets)
+        return [tweet if cluster < 0 else 'cluster %d' % cluster for tweet, cluster in zip(tweets, clusters)]
+
+    ### add_distinct()
+    ###
+    ### Adds tweets to the index and returns a mask keeping the first tweet of each of their clusters, in the order
+    ### given.
+
+    def add_distinct(self, tweets):
+        return ~pd.Series(self.add(tweets)).duplicated().values
+
+### near_duplicate_labels()
+###
+### Gives unlabeled rows of data the label of the labeled tweets in their cluster, as propagate_labels() does for exact
+### copies. Clusters whose labeled tweets disagree are left alone. Returns data and the number of rows labeled.
+
+def near_duplicate_labels(data, index):
+    clusters = index.add(data['tweet'].astype(str))
+    labels = text_labels(data['injury_report'])
+    labeled = labels != 'x'
+
+    agreed = pd.Series(labels[labeled]).groupby(clusters[labeled]).nunique()
+    agreed = agreed.index[agreed.values == 1]
+
+    # Labels are propagated between rows with the same cluster number in place of the same text.
+    keyed = pd.DataFrame({'injury_report': labels, 'tweet': clusters.astype(str)})
+    source = keyed[labeled & np.isin(clusters, agreed)].copy()
+    keyed, changed = propagate_labels(keyed, [('near duplicates', source)], fill_only=True, normalize=None)
+    data['injury_report'] = keyed['injury_report'].values
+
+    return data, changed['near duplicates']
+
+### PIPELINE FUNCTIONS
+
+### label_near_duplicates()
+###
+### Near-duplicate version of label_filtered_duplicates(): every tweet of filtered2 is added to the index (only new ones
+### are hashed) and unlabeled near-duplicates of labeled tweets are given their label. Returns the number of rows
+### labeled.
+
+@instrumented()
+def label_near_duplicates(index=None, storage=None):
+    storage = get_storage(storage)
+    index = NearDuplicateIndex() if index is None else index
+
+    filtered = storage.read('filtered2')
+    filtered, changed = near_duplicate_labels(filtered, index)
+    storage.write('filtered2', filtered)
+    index.save()
+    current_stage().rows(rows_in=filtered.shape[0], rows_out=changed)
+
+    return changed
@@ -0,0 +1,280 @@
+"""
+Evaluation Tools
+
+Scores the deep learning models from the raw logits they wrote to the 'Model Outputs' folder. Every
+'(model)/(run)_model_outputs.csv' file is read into one models x tweets array, and the sensitivity, specificity,
+precision, F1 score and accuracy of every model (and of every ensemble averaging the logits of two or more models) on
+'test 25-08.csv' are worked out together with a few matrix products. Decision thresholds are swept from the sorted
+scores of each model with cumulative counts, so thousands of thresholds cost one sort. A results table in the
+README's format and the '_fp_tweets' / '_fn_tweets' files written by hand in the notebooks are made from the same
+arrays.
+"""
+
+import os
+import re
+import glob
+import itertools
+import numpy as np
+import pandas as pd
+
+from instrument_tools import instrumented, current_stage
+
+### metric_names
+###
+### The metrics worked out for every model, in the order of the README table, with their column headings.
+
+metric_names = ['sensitivity', 'specificity', 'precision', 'f1', 'accuracy']
+
+metric_headings = {'sensitivity': 'Sensitivity', 'specificity': 'Specificity', 'precision': 'Precision',
+                   'f1': 'F1 Score', 'accuracy': 'Accuracy'}
+
+table_headings = ['Model', 'Data Type / Epochs'] + [metric_headings[name] for name in metric_names]
+
+### HELPER FUNCTIONS
+
+def _divide(numerator, denominator):
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    return np.divide(numerator, denominator, out=np.zeros(np.broadcast(numerator, denominator).shape),
+                     where=denominator != 0)
+
+def _epochs(run):
+    found = re.search(r'(\d+)-epochs', run)
+    return found.group(1) if found else ''
+
+def _cell(value):
+    return value if isinstance(value, str) else str(round(float(value), 4))
+
+### load_model_outputs()
+###
+### Reads every '(model)/(run)_model_outputs.csv' file of directory and returns the model names (the folder names), the
+### run names (the file names without '_model_outputs.csv') and a models x tweets x 2 array of the P0 and P1 logits.
+### Every file must hold one row per tweet of the same test file.
+
+def load_model_outputs(directory='../Model Outputs'):
+    files = sorted(glob.glob(os.path.join(directory, '*', '*_model_outputs.csv')))
+    if not files:
+        raise FileNotFoundError('No model output files found in ' + directory)
+
+    names = [os.path.basename(os.path.dirname(file)) for file in files]
+    runs = [os.path.basename(file)[:-len('_model_outputs.csv')] for file in files]
+    logits = [pd.read_csv(file, usecols=['P0', 'P1'], dtype=np.float64).to_numpy() for file in files]
+
+    lengths = set(len(entry) for entry in logits)
+    if len(lengths) > 1:
+        raise ValueError('Model output files have different numbers of rows: ' + str(sorted(lengths)))
+
+    return names, runs, np.stack(logits)
+
+### load_test_labels()
+###
+### The labels (as a 0 / 1 array) and the tweets of the test file the models were scored on.
+
+def load_test_labels(filename='../../Data/test 25-08.csv'):
+    test = pd.read_csv(filename, usecols=['tweet', 'injury_report'])
+    return test['injury_report'].astype(int).to_numpy(), test['tweet'].to_numpy(dtype=object)
+
+### logit_margins()
+###
+### P1 - P0 for every model and tweet, the log-odds of class 1 after a softmax. A tweet is predicted to be an injury
+### report when its margin is above the threshold, which at 0 is the same as taking the larger logit.
+
+def logit_margins(logits):
+    return logits[..., 1] - logits[..., 0]
+
+### ensemble_weights()
+###
+### A matrix with a row for every combination of at least min_size models, holding 1 / (number of models) for the
+### models in it. Multiplying it with the margins of the models gives the margins of each ensemble averaging their
+### logits. Returns the names of the ensembles ('RoBERTa + XLNet') along with the matrix.
+
+def ensemble_weights(names, min_size=2):
+    combinations = [combination for size in range(min_size, len(names) + 1)
+                    for combination in itertools.combinations(range(len(names)), size)]
+    weights = np.zeros((len(combinations), len(names)))
+    for row, combination in enumerate(combinations):
+        weights[row, list(combination)] = 1 / len(combination)
+    return [' + '.join(names[i] for i in combination) for combination in combinations], weights
+
+### confusion_counts()
+###
+### The true positives, false positives, false negatives and true negatives of every row of a models x tweets array of
+### predictions against labels, as four arrays with one entry per model.
+
+def confusion_counts(predictions, labels):
+    predictions = np.asarray(predictions, dtype=np.int64)
+    labels = np.asarray(labels, dtype=np.int64)
+    positives = labels.sum()
+
+    true_positives = predictions @ labels
+    predicted = predictions.sum(axis=-1)
+    false_positives = predicted - true_positives
+    false_negatives = positives - true_positives
+    true_negatives = len(labels) - positives - false_positives
+    return true_positives, false_positives, false_negatives, true_negatives
+
+### confusion_metrics()
+###
+### The metrics of metric_names from arrays of confusion counts of any shape. A metric whose denominator is 0 (say the
+### precision of a model predicting nothing positive) is given as 0.
+
+def confusion_metrics(true_positives, false_positives, false_negatives, true_negatives):
+    sensitivity = _divide(true_positives, true_positives + false_negatives)
+    precision = _divide(true_positives, true_positives + false_positives)
+    return {'sensitivity': sensitivity,
+            'specificity': _divide(true_negatives, true_negatives + false_positives),
+            'precision': precision,
+            'f1': _divide(2 * precision * sensitivity, precision + sensitivity),
+            'accuracy': _divide(true_positives + true_negatives,
+                                true_positives + false_positives + false_negatives + true_negatives)}
+
+### threshold_sweep()
+###
+### Confusion counts and metrics of every model at every threshold, without predicting once per threshold. Each model's
+### margins are sorted once, highest first, and a running count of the positive labels down that order gives the true
+### positives of the top k tweets for every k. The tweets above a threshold are the top k for the k found by a binary
+### search of the sorted margins, so the counts at every threshold are looked up from the running count.
+###
+### thresholds is an array of thresholds, or a number of evenly spaced thresholds across the range of the margins.
+### Returns a dictionary of models x thresholds arrays ('true_positives' ... and the metrics) along with 'thresholds'.
+
+def threshold_sweep(margins, labels, thresholds=4001):
+    margins = np.atleast_2d(margins)
+    labels = np.asarray(labels, dtype=np.int64)
+    if np.isscalar(thresholds):
+        thresholds = np.linspace(margins.min(), margins.max(), int(thresholds))
+    thresholds = np.asarray(thresholds, dtype=float)
+
+    order = np.argsort(-margins, axis=1, kind='stable')
+    descending = np.take_along_axis(margins, order, axis=1)
+    running = np.zeros((len(margins), margins.shape[1] + 1), dtype=np.int64)
+    np.cumsum(labels[order], axis=1, out=running[:, 1:])
+
+    # Negated, the sorted margins are in ascending order, and a tweet is above a threshold when its negated margin is
+    # below the negated threshold, so a search from the left gives the number of tweets above it.
+
+    above = np.stack([np.searchsorted(-row, -thresholds, side='left') for row in descending])
+    true_positives = np.take_along_axis(running, above, axis=1)
+    false_positives = above - true_positives
+    false_negatives = labels.sum() - true_positives
+    true_negatives = len(labels) - labels.sum() - false_positives
+
+    sweep = {'thresholds': thresholds, 'true_positives': true_positives, 'false_positives': false_positives,
+             'false_negatives': false_negatives, 'true_negatives': true_negatives}
+    sweep.update(confusion_metrics(true_positives, false_positives, false_negatives, true_negatives))
+    return sweep
+
+### best_thresholds()
+###
+### The threshold giving each model its highest value of metric in a sweep, with every metric at that threshold. Ties
+### go to the threshold closest to 0.
+
+def best_thresholds(sweep, names, metric='f1'):
+    values = sweep[metric]
+    highest = values == values.max(axis=1, keepdims=True)
+    best = np.where(highest, np.abs(sweep['thresholds']), np.inf).argmin(axis=1)
+    rows = np.arange(len(names))
+    table = pd.DataFrame({'model': names, 'threshold': sweep['thresholds'][best]})
+    for name in metric_names:
+        table[name] = sweep[name][rows, best]
+    return table
+
+### format_table()
+###
+### The markdown table of the README from a list of rows (model, data type / epochs, then the metrics), with the best
+### value of each metric in bold as the README has it.
+
+def format_table(rows):
+    rows = [[_cell(value) for value in row] for row in rows]
+    best = [max(float(row[column]) for row in rows) for column in range(2, len(table_headings))] if rows else []
+
+    lines = ['|  ' + '  |  '.join(table_headings) + '  |', '|' + ':---:|' * len(table_headings)]
+    for row in rows:
+        cells = row[:2] + ['**' + value + '**' if float(value) == top else value
+                           for value, top in zip(row[2:], best)]
+        lines.append('| ' + ' | '.join(cells) + ' |')
+    return '\n'.join(lines)
+
+### table_rows()
+###
+### Rows for format_table() from the metrics DataFrame of evaluate_model_outputs().
+
+def table_rows(metrics):
+    return [[row['model'], row['epochs']] + [row[name] for name in metric_names] for _, row in metrics.iterrows()]
+
+### write_results_table()
+###
+### Writes the markdown table of a run to its own file, under a line naming the test file with its number of tweets
+### and injury reports. The README table is left alone: its deep model rows were not scored on 'test 25-08.csv' (their
+### sensitivity, specificity and precision imply about 25% injury reports, against 292 of 3340 in this file, and no
+### threshold of the logits here reproduces them), so the two tables are not comparable.
+
+def write_results_table(filename, table, test, labels):
+    with open(filename, 'w', encoding='utf-8') as file:
+        file.write('Scored on %s: %d tweets, %d injury reports, threshold 0.\n\n%s\n'
+                   % (os.path.basename(test), len(labels), int(labels.sum()), table))
+
+### write_error_tweets()
+###
+### Writes the false positives and false negatives of one model as '(run)_fp_tweets.csv' and '(run)_fn_tweets.csv' in
+### directory, each with the row of the tweet in the test file ('index') and the tweet ('fp tweet' / 'fn tweet').
+
+def write_error_tweets(directory, run, predictions, labels, tweets):
+    for kind, wrong in [('fp', predictions & (labels == 0)), ('fn', ~predictions & (labels == 1))]:
+        rows = np.flatnonzero(wrong)
+        pd.DataFrame({'index': rows, kind + ' tweet': tweets[rows]}).to_csv(
+            os.path.join(directory, run + '_' + kind + '_tweets.csv'))
+
+### PIPELINE FUNCTIONS
+
+### evaluate_model_outputs()
+###
+### Scores every model of the 'Model Outputs' folder on the test file in one pass:
+###
+###     1. The logits of every model are loaded into one array, and with ensembles=True the margins of every ensemble
+###         averaging the logits of two or more models are added as extra rows with one matrix product.
+###     2. The confusion counts and metrics of every row at threshold 0 (the larger logit) are worked out together.
+###     3. threshold_sweep() runs every row over `thresholds` thresholds, and the best threshold by F1 is kept.
+###     4. With write_errors=True each model's '_fp_tweets' and '_fn_tweets' files are written next to its outputs.
+###         With results set to a filename, the table of the models and ensembles is written there (see
+###         write_results_table()).
+###
+### The table is printed, and a dictionary with the metrics DataFrame ('metrics'), the sweep ('sweep'), the best
+### thresholds ('best') and the markdown table ('table') is returned.
+
+@instrumented()
+def evaluate_model_outputs(directory='../Model Outputs', test='../../Data/test 25-08.csv', thresholds=4001,
+                           ensembles=True, write_errors=True, results=None):
+    names, runs, logits = load_model_outputs(directory)
+    labels, tweets = load_test_labels(test)
+    if logits.shape[1] != len(labels):
+        raise ValueError('Model outputs have %d rows but %s has %d' % (logits.shape[1], test, len(labels)))
+    current_stage().rows(logits.shape[0] * logits.shape[1])
+
+    margins = logit_margins(logits)
+    epochs = [_epochs(run) for run in runs]
+    if ensembles and len(names) > 1:
+        ensemble_names, weights = ensemble_weights(names)
+        margins = np.concatenate([margins, weights @ margins])
+        epochs = epochs + ['/'.join(sorted(set(epochs[i] for i in np.flatnonzero(row)))) for row in weights]
+        names = names + ensemble_names
+
+    predictions = margins > 0
+    metrics = pd.DataFrame({'model': names, 'epochs': epochs})
+    for name, values in confusion_metrics(*confusion_counts(predictions, labels)).items():
+        metrics[name] = values
+
+    sweep = threshold_sweep(margins, labels, thresholds)
+    best = best_thresholds(sweep, names)
+
+    if write_errors:
+        for i, run in enumerate(runs):
+            write_error_tweets(os.path.join(directory, names[i]), run, predictions[i], labels, tweets)
+
+    table = format_table(table_rows(metrics))
+    if results is not None:
+        write_results_table(results, table, test, labels)
+
+    print(table)
+    print(best.round(4).to_string(index=False))
+    return {'metrics': metrics, 'sweep': sweep, 'best': best, 'table': table}
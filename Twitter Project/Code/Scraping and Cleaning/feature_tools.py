@@ -0,0 +1,194 @@
+"""
+Feature Tools
+
+Holds the FeatureStore, an on-disk cache of the bool, count and tfidf feature matrices of a dataset's cleaned text.
+Matrices are saved as the raw arrays of a CSR matrix, so they can be memory-mapped instead of re-tokenizing the whole
+'clean' column every time the models are trained, cross-validated or checked with gather_fns_and_fps(). When a dataset
+only gains rows, only the new tweets are transformed.
+"""
+
+import os
+import json
+import hashlib
+import time
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from joblib import dump, load
+
+from cleaning_tools import cleaner_version
+
+### HELPER FUNCTIONS
+
+### text_keys()
+###
+### 64 bit hash of every text, used to find the row of a text already in the store.
+
+def text_keys(texts):
+    return pd.util.hash_pandas_object(pd.Series(texts, dtype=object), index=False).values
+
+### vectorizer_fingerprint()
+###
+### Hash of everything a fitted vectorizer's output depends on: its vocabulary, its idf weights (for tfidf) and its
+### plain settings (binary, ngram_range, norm...). Settings holding functions are left out, since their repr changes
+### from run to run.
+
+def vectorizer_fingerprint(vectorizer):
+    digest = hashlib.blake2b(digest_size=16)
+    settings = {key: value for key, value in vectorizer.get_params().items()
+                if value is None or isinstance(value, (str, int, float, bool, tuple))}
+
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode('utf-8'))
+    digest.update('\0'.join(sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)).encode('utf-8'))
+    if hasattr(vectorizer, 'idf_'):
+        digest.update(np.ascontiguousarray(vectorizer.idf_).tobytes())
+
+    return digest.hexdigest()
+
+def _save_array(folder, name, array):
+    with open(os.path.join(folder, name + '.npy.tmp'), 'wb') as file:
+        np.save(file, array)
+    os.replace(os.path.join(folder, name + '.npy.tmp'), os.path.join(folder, name + '.npy'))
+
+### FeatureStore
+###
+### Matrices are kept in directory/<dataset>/<feature type>/ as data.npy, indices.npy and indptr.npy (the arrays of the
+### CSR matrix), keys.npy (the text_keys() of each row), vocabulary.json (the vectorizer's vocabulary) and meta.json. The
+### meta records the cleaner version, the fingerprint of the vectorizer and the dataset version, a hash of the keys of
+### every row in order.
+###
+### matrix() gives the feature matrix of a list of texts:
+###
+###     1. If the dataset version, cleaner version and vectorizer all match, the saved matrix is memory-mapped.
+###     2. If only the dataset changed, rows of texts already saved are copied from the saved matrix and only the other
+###         texts are transformed, then the matrix is saved again.
+###     3. Otherwise (first use, new cleaning rules or a refitted vectorizer) every text is transformed.
+###
+### self.reused and self.transformed count rows per feature type, and report() prints them.
+
+class FeatureStore:
+
+    def __init__(self, directory='Feature Cache', version=cleaner_version):
+        self.directory = directory
+        self.version = version
+        self.reused = {}
+        self.transformed = {}
+        self.seconds = {}
+
+    def folder(self, dataset, feature_type):
+        return os.path.join(self.directory, dataset, feature_type)
+
+    def _meta(self, folder):
+        if not os.path.exists(os.path.join(folder, 'meta.json')):
+            return None
+        with open(os.path.join(folder, 'meta.json')) as file:
+            return json.load(file)
+
+    ### load()
+    ###
+    ### Memory-maps a saved matrix. The arrays are read-only and only paged in from disk as rows are used.
+
+    def load(self, dataset, feature_type):
+        folder = self.folder(dataset, feature_type)
+        meta = self._meta(folder)
+        arrays = [np.load(os.path.join(folder, name + '.npy'), mmap_mode='r') for name in ['data', 'indices', 'indptr']]
+        return sparse.csr_matrix(tuple(arrays), shape=tuple(meta['shape']), copy=False)
+
+    def save(self, dataset, feature_type, matrix, keys, meta, vocabulary):
+        folder = self.folder(dataset, feature_type)
+        os.makedirs(folder, exist_ok=True)
+
+        # The meta is removed first, so a save interrupted half way leaves nothing that looks valid.
+        if os.path.exists(os.path.join(folder, 'meta.json')):
+            os.remove(os.path.join(folder, 'meta.json'))
+
+        matrix = matrix.tocsr()
+        for name, array in [('data', matrix.data), ('indices', matrix.indices), ('indptr', matrix.indptr),
+                            ('keys', keys)]:
+            _save_array(folder, name, array)
+
+        with open(os.path.join(folder, 'vocabulary.json'), 'w') as file:
+            json.dump({term: int(index) for term, index in vocabulary.items()}, file)
+        with open(os.path.join(folder, 'meta.json'), 'w') as file:
+            json.dump(dict(meta, shape=list(matrix.shape)), file)
+
+    ### vectorizer()
+    ###
+    ### The vectorizer fitted by matrix() for a dataset, if it was given an unfitted one. Use it to transform the texts
+    ### of a test set the same way as the training set.
+
+    def vectorizer(self, dataset, feature_type):
+        return load(os.path.join(self.folder(dataset, feature_type), 'vectorizer.joblib'))
+
+    ### matrix()
+    ###
+    ### Returns the feature matrix of texts for a dataset name ('clean', 'train', 'test'...), building or updating the
+    ### saved copy as needed (see above). vectorizer should already be fitted, e.g. ModelRegistry.vectorizer(). An
+    ### unfitted one is fitted on texts the first time and saved with the matrix, and the saved one is used from then on.
+
+    def matrix(self, dataset, feature_type, texts, vectorizer):
+        start = time.perf_counter()
+        folder = self.folder(dataset, feature_type)
+        texts = list(texts)
+        keys = text_keys(texts)
+
+        if not hasattr(vectorizer, 'vocabulary_'):
+            if os.path.exists(os.path.join(folder, 'vectorizer.joblib')):
+                vectorizer = self.vectorizer(dataset, feature_type)
+            else:
+                os.makedirs(folder, exist_ok=True)
+                vectorizer.fit(texts)
+                dump(vectorizer, os.path.join(folder, 'vectorizer.joblib'))
+
+        meta = {'cleaner_version': self.version, 'vectorizer': vectorizer_fingerprint(vectorizer),
+                'dataset_version': hashlib.blake2b(keys.tobytes(), digest_size=16).hexdigest()}
+        saved = self._meta(folder)
+
+        if saved is not None and saved['cleaner_version'] == meta['cleaner_version'] and \
+                saved['vectorizer'] == meta['vectorizer']:
+
+            if saved['dataset_version'] == meta['dataset_version']:
+                self._count(feature_type, len(texts), 0, start)
+                return self.load(dataset, feature_type)
+
+            matrix, transformed = self._update(dataset, feature_type, texts, keys, vectorizer)
+        else:
+            matrix, transformed = vectorizer.transform(texts).tocsr(), len(texts)
+
+        self.save(dataset, feature_type, matrix, keys, meta, vectorizer.vocabulary_)
+        del matrix
+        self._count(feature_type, len(texts) - transformed, transformed, start)
+
+        return self.load(dataset, feature_type)
+
+    ### _update()
+    ###
+    ### Builds the matrix of a changed dataset from the saved one: every text already saved takes its saved row, and the
+    ### rest are transformed and stacked underneath before the rows are put in the order of texts. Returns the matrix
+    ### (in memory, so the saved files can be replaced) and the number of texts transformed.
+
+    def _update(self, dataset, feature_type, texts, keys, vectorizer):
+        saved = self.load(dataset, feature_type)
+        saved_keys = np.load(os.path.join(self.folder(dataset, feature_type), 'keys.npy'))
+
+        rows = pd.Series(np.arange(len(saved_keys)), index=saved_keys)
+        rows = rows[~rows.index.duplicated()]
+        positions = rows.reindex(keys).fillna(-1).values.astype(np.int64)
+
+        missing = np.flatnonzero(positions < 0)
+        new_rows = vectorizer.transform([texts[i] for i in missing]).tocsr()
+        positions[missing] = saved.shape[0] + np.arange(len(missing))
+
+        matrix = sparse.vstack([saved, new_rows], format='csr')[positions]
+        return matrix, len(missing)
+
+    def _count(self, feature_type, reused, transformed, start):
+        self.reused[feature_type] = self.reused.get(feature_type, 0) + reused
+        self.transformed[feature_type] = self.transformed.get(feature_type, 0) + transformed
+        self.seconds[feature_type] = self.seconds.get(feature_type, 0) + time.perf_counter() - start
+
+    def report(self):
+        for feature_type in self.reused:
+            print('%-6s %8d rows reused, %8d rows transformed, %.2fs'
+                  % (feature_type, self.reused[feature_type], self.transformed[feature_type],
+                     self.seconds[feature_type]))
@@ -0,0 +1,382 @@
+"""
+Instrument Tools
+
+Holds the RunReport, which records the wall time, CPU time, peak memory and rows in / out of every stage of the
+pipeline (scrape_to_merge(), merged_to_filtered(), filtered_to_clean(), cleaning_total(), gather_fns_and_fps()...) and
+their main steps, and writes them to a JSON file so runs on the pi and the laptop can be compared. Each stage can also
+be profiled with cProfile.
+
+Stages are marked in the pipeline with the @instrumented decorator or the stage() context manager. Both do nothing
+unless a run has been started with start_run(), so the pipeline runs as before when nothing is being recorded.
+
+psutil is used to read memory if it is installed, otherwise /proc/self/statm (linux) or getrusage().
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import threading
+import functools
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+### HELPER FUNCTIONS
+
+### rss_mb()
+###
+### Resident memory of this process in megabytes. Without psutil or /proc, getrusage() only gives the highest it has
+### been since the process started.
+
+def rss_mb():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2 ** 20
+    if os.path.exists('/proc/self/statm'):
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+    return 0.0
+
+### children_cpu()
+###
+### CPU seconds used by finished child processes, e.g. the process pools of map_in_batches().
+
+def children_cpu():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+### StageRecord
+###
+### The measurements of one stage. rows() sets the rows going in and out of it; rows/sec is worked out from rows_in, or
+### from rows_out if rows_in was not given.
+
+class StageRecord:
+
+    def __init__(self, name, path, depth):
+        self.name = name
+        self.path = path
+        self.depth = depth
+        self.rows_in = None
+        self.rows_out = None
+        self.profile = None
+        self.started = time.time()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.start_children = children_cpu()
+        self.rss_start = rss_mb()
+        self.peak_rss = self.rss_start
+        self.wall = self.cpu = self.children = self.rss_end = None
+        self.error = None
+
+    def rows(self, rows_in=None, rows_out=None):
+        if rows_in is not None:
+            self.rows_in = int(rows_in)
+        if rows_out is not None:
+            self.rows_out = int(rows_out)
+        return self
+
+    def finish(self):
+        self.wall = time.perf_counter() - self.start_wall
+        self.cpu = time.process_time() - self.start_cpu
+        self.children = children_cpu() - self.start_children
+        self.rss_end = rss_mb()
+        self.peak_rss = max(self.peak_rss, self.rss_end)
+
+    def as_dict(self):
+        rows = self.rows_in if self.rows_in is not None else self.rows_out
+        return {'name': self.name, 'path': self.path, 'depth': self.depth,
+                'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'wall_s': round(self.wall, 4), 'cpu_s': round(self.cpu, 4), 'children_cpu_s': round(self.children, 4),
+                'rss_start_mb': round(self.rss_start, 1), 'rss_end_mb': round(self.rss_end, 1),
+                'peak_rss_mb': round(self.peak_rss, 1), 'rows_in': self.rows_in, 'rows_out': self.rows_out,
+                'rows_per_sec': round(rows / self.wall, 1) if rows is not None and self.wall > 0 else None,
+                'profile': self.profile, 'error': self.error}
+
+### _NullRecord
+###
+### Stands in for a StageRecord when no run is being recorded, so stage code can always call rows().
+
+class _NullRecord:
+
+    def rows(self, rows_in=None, rows_out=None):
+        return self
+
+_null_record = _NullRecord()
+
+### RunReport
+###
+### Collects the StageRecords of one run of the pipeline. Stages can be nested (a sub-step inside a stage), and each
+### thread has its own stack of open stages. A background thread samples memory every sample_interval seconds so the
+### peak of every open stage is known, not just its memory at the start and end.
+###
+### profile can be True to profile every stage, or a list of stage names. Each profiled stage is dumped to
+### '<directory>/<run id>/<stage number> <stage path>.prof', to be read with pstats or snakeviz. A stage inside one already being profiled
+### is not profiled again.
+###
+### write() saves the report as <directory>/<run id>.json, and report() prints it as a table.
+
+class RunReport:
+
+    def __init__(self, name='pipeline', directory='Run Reports', profile=False, sample_interval=0.05):
+        self.name = name
+        self.directory = directory
+        self.profile = profile
+        self.sample_interval = sample_interval
+        self.started = datetime.now()
+        self.run_id = self.started.strftime('%Y-%m-%d_%H-%M-%S_') + socket.gethostname() + '_' + name
+        self.records = []
+        self.open = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.profiling = False
+
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self._sample, daemon=True)
+        self.sampler.start()
+
+    def _sample(self):
+        while not self.stopped.wait(self.sample_interval):
+            rss = rss_mb()
+            with self.lock:
+                for record in self.open:
+                    record.peak_rss = max(record.peak_rss, rss)
+
+    def _stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def _profiled(self, name):
+        return self.profile is True or (not isinstance(self.profile, bool) and name in self.profile)
+
+    @contextmanager
+    def stage(self, name, rows_in=None, rows_out=None):
+        stack = self._stack()
+        path = '/'.join([record.name for record in stack] + [name])
+        record = StageRecord(name, path, len(stack)).rows(rows_in, rows_out)
+
+        profiler = None
+        with self.lock:
+            self.records.append(record)
+            self.open.append(record)
+            if self._profiled(name) and not self.profiling:
+                self.profiling = True
+                profiler = cProfile.Profile()
+        stack.append(record)
+
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        except BaseException as error:
+            record.error = type(error).__name__
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                record.profile = self._dump(profiler, record)
+            record.finish()
+            stack.pop()
+            with self.lock:
+                self.open.remove(record)
+                if profiler is not None:
+                    self.profiling = False
+
+    def _dump(self, profiler, record):
+        folder = os.path.join(self.directory, self.run_id)
+        os.makedirs(folder, exist_ok=True)
+        filename = os.path.join(folder, '%03d %s.prof' % (self.records.index(record), record.path.replace('/', '.')))
+        profiler.dump_stats(filename)
+        return filename
+
+    def close(self):
+        self.stopped.set()
+        self.sampler.join()
+
+    def as_dict(self):
+        finished = [record for record in self.records if record.wall is not None]
+        return {'run_id': self.run_id, 'name': self.name, 'started': self.started.isoformat(timespec='seconds'),
+                'host': socket.gethostname(), 'machine': platform.machine(), 'platform': platform.platform(),
+                'python': platform.python_version(), 'cpus': os.cpu_count(),
+                'wall_s': round(sum(record.wall for record in finished if record.depth == 0), 4),
+                'stages': [record.as_dict() for record in finished]}
+
+    def write(self, filename=None):
+        os.makedirs(self.directory, exist_ok=True)
+        filename = os.path.join(self.directory, self.run_id + '.json') if filename is None else filename
+        with open(filename + '.tmp', 'w') as file:
+            json.dump(self.as_dict(), file, indent=2)
+        os.replace(filename + '.tmp', filename)
+        return filename
+
+    def report(self):
+        print_stages(self.as_dict())
+
+### print_stages()
+###
+### Prints the stages of a run report (a RunReport.as_dict() or a loaded JSON report) as an indented table.
+
+def print_stages(report):
+    print(report['run_id'])
+    print('%-44s %9s %9s %9s %10s %10s %12s' % ('stage', 'wall s', 'cpu s', 'peak MB', 'rows in', 'rows out',
+                                                'rows/sec'))
+    for stage in report['stages']:
+        print('%-44s %9.2f %9.2f %9.1f %10s %10s %12s'
+              % (('  ' * stage['depth'] + stage['name'])[:44], stage['wall_s'], stage['cpu_s'] + stage['children_cpu_s'],
+                 stage['peak_rss_mb'], _blank(stage['rows_in']), _blank(stage['rows_out']),
+                 _blank(stage['rows_per_sec'])))
+
+def _blank(value):
+    return '' if value is None else value
+
+### load_report()
+###
+### Reads a JSON report written by RunReport.write().
+
+def load_report(filename):
+    with open(filename) as file:
+        return json.load(file)
+
+### compare_reports()
+###
+### Compares the stages of two run reports (file names or loaded reports) by stage path, printing the wall time and
+### peak memory of each with the ratio new / old, so regressions between runs or machines stand out. Stages run more
+### than once are summed. Returns {path: {'old': seconds, 'new': seconds, 'ratio': new / old}}.
+
+def compare_reports(old, new):
+    old = load_report(old) if isinstance(old, str) else old
+    new = load_report(new) if isinstance(new, str) else new
+
+    def totals(report):
+        result = {}
+        for stage in report['stages']:
+            wall, peak = result.get(stage['path'], (0.0, 0.0))
+            result[stage['path']] = (wall + stage['wall_s'], max(peak, stage['peak_rss_mb']))
+        return result
+
+    old_totals, new_totals = totals(old), totals(new)
+    comparison = {}
+
+    print('%-44s %9s %9s %7s %9s %9s' % ('stage', 'old s', 'new s', 'ratio', 'old MB', 'new MB'))
+    for path in list(old_totals) + [path for path in new_totals if path not in old_totals]:
+        old_wall, old_peak = old_totals.get(path, (None, None))
+        new_wall, new_peak = new_totals.get(path, (None, None))
+        ratio = new_wall / old_wall if old_wall and new_wall is not None else None
+        comparison[path] = {'old': old_wall, 'new': new_wall, 'ratio': ratio}
+        print('%-44s %9s %9s %7s %9s %9s' % (path[:44], _format(old_wall, '%.2f'), _format(new_wall, '%.2f'),
+                                            _format(ratio, '%.2f'), _format(old_peak, '%.1f'),
+                                            _format(new_peak, '%.1f')))
+
+    return comparison
+
+def _format(value, pattern):
+    return '-' if value is None else pattern % value
+
+### RECORDING A RUN
+
+### _active
+###
+### The RunReport stages are recorded to, if a run has been started.
+
+_active = None
+
+### start_run(), finish_run()
+###
+### start_run() starts recording stages to a new RunReport, and finish_run() stops, writes the JSON report and prints it.
+### finish_run() returns the file written.
+
+def start_run(name='pipeline', directory='Run Reports', profile=False, sample_interval=0.05):
+    global _active
+    if _active is not None:
+        _active.close()
+    _active = RunReport(name, directory, profile, sample_interval)
+    return _active
+
+def finish_run(show=True):
+    global _active
+    if _active is None:
+        return None
+
+    report, _active = _active, None
+    report.close()
+    filename = report.write()
+    if show:
+        report.report()
+    return filename
+
+### recorded_run()
+###
+### Context manager version of start_run() and finish_run(), e.g.
+###
+###     with recorded_run('weekly', profile=['filtered_to_clean']):
+###         merged_to_filtered()
+###         filtered_to_clean()
+
+@contextmanager
+def recorded_run(name='pipeline', directory='Run Reports', profile=False, sample_interval=0.05, show=True):
+    report = start_run(name, directory, profile, sample_interval)
+    try:
+        yield report
+    finally:
+        if _active is report:
+            finish_run(show)
+
+### stage()
+###
+### Context manager marking a stage or sub-step of the active run. Yields its StageRecord, whose rows() can be called
+### once the rows out are known. Without an active run it only yields a record which ignores rows().
+
+@contextmanager
+def stage(name, rows_in=None, rows_out=None):
+    report = _active
+    if report is None:
+        yield _null_record
+        return
+
+    with report.stage(name, rows_in, rows_out) as record:
+        yield record
+
+### current_stage()
+###
+### The innermost open stage of this thread, so a function wrapped with @instrumented can set its rows.
+
+def current_stage():
+    report = _active
+    if report is None or not report._stack():
+        return _null_record
+    return report._stack()[-1]
+
+### instrumented()
+###
+### Decorator recording every call of a function as a stage, named after the function unless a name is given.
+
+def instrumented(name=None):
+    def decorator(function):
+        stage_name = function.__name__ if name is None else name
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return function(*args, **kwargs)
+            with stage(stage_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+    return decorator
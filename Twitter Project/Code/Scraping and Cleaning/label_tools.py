@@ -0,0 +1,114 @@
+"""
+Label Tools
+
+Holds propagate_labels(), which copies labels from any number of label sources (sampled.csv, positive_samples.csv,
+fns and fps corrections, or the labeled rows of filtered2 itself) onto every row with the same tweet text. Tweets are
+matched on a 64 bit hash of their normalized text in a single pass, rather than merging the full tweet strings of each
+source onto filtered2 one after another.
+"""
+
+import unicodedata
+import numpy as np
+import pandas as pd
+
+from dataset_tools import _label
+
+### normalize_text()
+###
+### The text labels are matched on: unicode normalized to NFC, with runs of whitespace collapsed to one space and
+### leading / trailing whitespace removed, so copies of a tweet differing only in spacing share their label. Each
+### distinct tweet is only normalized once.
+
+def _normalize(tweet):
+    if not unicodedata.is_normalized('NFC', tweet):
+        tweet = unicodedata.normalize('NFC', tweet)
+    return ' '.join(tweet.split())
+
+def normalize_text(tweets):
+    tweets = pd.Series(tweets, dtype=object).astype(str)
+    codes, uniques = pd.factorize(tweets)
+    return pd.Series(np.array([_normalize(tweet) for tweet in uniques], dtype=object)[codes], index=tweets.index)
+
+### text_hashes()
+###
+### 64 bit hash of the (normalized) text of every tweet. With normalize=None the text is hashed exactly as given.
+
+def text_hashes(tweets, normalize=normalize_text):
+    tweets = pd.Series(tweets, dtype=object).astype(str) if normalize is None else normalize(tweets)
+    return pd.util.hash_pandas_object(tweets, index=False).values
+
+### text_labels()
+###
+### _label() of every value, worked out once per distinct value since a column holds only a handful of them. Missing
+### values give 'x'.
+
+def text_labels(values):
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    labels = np.array([_label(value) for value in uniques] + ['x'], dtype=object)
+    return labels[codes]
+
+### read_label_source()
+###
+### Gives the labeled rows of a label source, a csv file or a DataFrame with 'injury_report' and 'tweet' columns.
+### Unlabeled ('x') and empty rows are dropped, and labels are turned into the text '0' or '1'.
+
+def read_label_source(source):
+    labels = source if isinstance(source, pd.DataFrame) else pd.read_csv(source, usecols=['injury_report', 'tweet'])
+    labels = labels[['injury_report', 'tweet']].dropna()
+    labels = labels[labels['injury_report'].astype(str) != 'x']
+    return text_labels(labels['injury_report']), labels['tweet'].values
+
+### label_winners()
+###
+### The winning label of every tweet hash over a list of (name, source) pairs, highest priority first, as a DataFrame
+### indexed by hash with the label and the rank of the source it came from. propagate_labels() builds it from its
+### sources, but it can be built once and passed in when many frames are labeled from the same sources.
+
+def label_winners(sources, normalize=normalize_text):
+    # Every source's labels are stacked lowest priority first, so keeping the last label of each hash applies the
+    # priorities.
+
+    labels, keys, ranks = [], [], []
+    for rank, (name, source) in enumerate(reversed(sources)):
+        source_labels, source_tweets = read_label_source(source)
+        labels.append(source_labels)
+        keys.append(text_hashes(source_tweets, normalize))
+        ranks.append(np.full(len(source_labels), len(sources) - 1 - rank))
+
+    winners = pd.DataFrame({'label': np.concatenate(labels).astype(object), 'source': np.concatenate(ranks)},
+                           index=np.concatenate(keys))
+    return winners[~winners.index.duplicated(keep='last')]
+
+### propagate_labels()
+###
+### Sets the injury_report of every row of data whose tweet matches a labeled tweet in one of the sources, and returns
+### data along with the number of rows each source changed. data is updated in place.
+###
+### sources is a list of (name, source) pairs, highest priority first: when sources disagree about a tweet the label of
+### the earlier source is used, and within one source the last row for a tweet wins. Labels already in data rank below
+### every source. With fill_only=True only unlabeled rows are given labels. winners is the label_winners() of sources,
+### if already built.
+
+def propagate_labels(data, sources, fill_only=False, normalize=normalize_text, winners=None):
+    if 'injury_report' in data.columns:
+        current = text_labels(data['injury_report'])
+    else:
+        current = np.full(len(data), 'x', dtype=object)
+
+    if not sources:
+        data['injury_report'] = current
+        return data, {}
+
+    names = [name for name, source in sources]
+    winners = label_winners(sources, normalize) if winners is None else winners
+
+    matched = winners.reindex(text_hashes(data['tweet'], normalize))
+    new = matched['label'].values
+    changed = matched['label'].notna().values & (new != current)
+    if fill_only:
+        changed = changed & (current == 'x')
+
+    data['injury_report'] = np.where(changed, new, current)
+    changed_by = np.bincount(matched['source'].values[changed].astype(int), minlength=len(sources))
+
+    return data, {name: int(count) for name, count in zip(names, changed_by)}
@@ -0,0 +1,132 @@
+"""
+Legacy Tools
+
+Copies of functions as they were before being optimized. They are kept as the baseline the benchmarks in
+benchmark_tools time against, and that the tests check the optimized versions give the same output as.
+"""
+
+import re
+import string
+import pandas as pd
+from nltk.tokenize import word_tokenize
+from nltk.corpus import stopwords
+from nltk.stem import PorterStemmer
+
+import cleaning_tools
+import evaluation_tools
+from cleaning_tools import contraction_dict
+
+def cleaning_function_part_1(x):
+    contractions_re = re.compile('(%s)' % '|'.join(contraction_dict.keys()))
+    emoj = re.compile("["
+                      u"\U0001F600-\U0001F64F"
+                      u"\U0001F300-\U0001F5FF"
+                      u"\U0001F680-\U0001F6FF"
+                      u"\U0001F1E0-\U0001F1FF"
+                      u"\U00002500-\U00002BEF"
+                      u"\U00002702-\U000027B0"
+                      u"\U00002702-\U000027B0"
+                      u"\U000024C2-\U0001F251"
+                      u"\U0001f926-\U0001f937"
+                      u"\U00010000-\U0010ffff"
+                      u"\u2640-\u2642"
+                      u"\u2600-\u2B55"
+                      u"\u200d"
+                      u"\u23cf"
+                      u"\u23e9"
+                      u"\u231a"
+                      u"\ufe0f"
+                      u"\u3030"
+                      "]+", re.UNICODE)
+
+    new = re.sub("@[A-Za-z0-9]+", " accountToken ", x)
+    new = re.sub(r"http\S+", " hyperlinkToken ", new)
+    new = re.sub(" 20[0-3][0-9] ", ' yearToken ', new)
+    new = re.sub(r"[0-9]{3}-[0-9]{3}-[0-9]{4}|\([0-9]{3}\)[0-9]{3}-[0-9]{4}|[0-9]{3}\.[0-9]{3}\.[0-9]{4}",
+                 '  phoneNumberToken  ', new)
+    new = re.sub(" [0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4} ", " dateToken ", new)
+    new = re.sub(emoj, ' emojiToken ', new)
+    new = new.replace('#', '')
+    new = new.replace('&amp;', ' and ')
+    new = new.replace('w/', ' with ')
+    new = new.lower()
+    new = re.sub("[0-9]:[0-9]{2}am|[0-9]:[0-9]{2}pm|[0-9][0-9]{2}am|[0-9][0-9]{2}pm|[0-9]:[0-9]{2}|[0-9]am|[0-9]pm",
+                 ' timetoken ', new)
+    new = contractions_re.sub(lambda match: contraction_dict[match.group(0)], new)
+
+    return new
+
+def clean_text(txt):
+    contractions_re = re.compile('(%s)' % '|'.join(contraction_dict.keys()))
+    txt = contractions_re.sub(lambda match: contraction_dict[match.group(0)], txt)
+    txt = "".join([char for char in txt if char not in string.punctuation])
+    txt = re.sub('[0-9]+', '', txt)
+    words = word_tokenize(txt)
+    stop_words = set(stopwords.words('english'))
+    words = [w for w in words if not w in stop_words]
+    words = [word for word in words if word.isalpha()]
+    return ' '.join(words)
+
+def cleaning_function_part_2(x):
+    new = "".join([char for char in x if char not in string.punctuation])
+    new = re.sub('[0-9]+', ' ', new)
+    words = word_tokenize(new)
+    stop_words = set(stopwords.words('english'))
+    ps = PorterStemmer()
+    words = [ps.stem(w) for w in words if not w in stop_words]
+    words = [word for word in words if word.isalpha()]
+    return ' '.join(words)
+
+def add_flag_columns(data):
+    ifelse = cleaning_tools.ifelse
+    data['urls'] = data['urls'].apply(lambda x: str(x).lstrip("[").rstrip("]"))
+    data['link_present'] = data['urls'].apply(lambda x: ifelse(len(x) > 0, 1, 0))
+    data['photos'] = data['photos'].apply(lambda x: str(x).lstrip("[").rstrip("]"))
+    data['photo_present'] = data['photos'].apply(lambda x: ifelse(len(x) > 0, 1, 0))
+    data['retweet'] = data['retweet'].astype(bool).apply(lambda x: ifelse(x, 1, 0))
+    return data
+
+def aggregate_merged(file, mergetype):
+    if mergetype == 1:
+        data = add_flag_columns(pd.read_csv(file))
+    else:
+        data = pd.concat(file)
+
+    final = data.groupby(['link', 'tweet']).agg(cleaning_tools.merged_aggregates)
+
+    final['replies_count'] = final['replies_count'].astype(int)
+    final['retweets_count'] = final['retweets_count'].astype(int)
+    final['likes_count'] = final['likes_count'].astype(int)
+    final['link_present'] = final['link_present'].astype(int)
+    final['photo_present'] = final['photo_present'].astype(int)
+    final['retweet'] = final['retweet'].astype(int)
+
+    return final.reset_index(0).reset_index(0)
+
+def append_labels(data, file):
+    labeled = file if isinstance(file, pd.DataFrame) else pd.read_csv(file)
+    labeled = labeled[['injury_report', 'tweet']]
+    labeled = labeled[labeled['injury_report'] != 'x']
+    labeled = labeled.drop_duplicates()
+    labeled = labeled.dropna()
+    filtered = data.merge(labeled, on='tweet', how='left')
+
+    try:
+        filtered['injury_report'] = filtered['injury_report_y'].fillna(filtered['injury_report_x']).fillna('x')
+        filtered.drop(['injury_report_x', 'injury_report_y'], axis=1, inplace=True)
+    except KeyError:
+        filtered['injury_report'] = filtered['injury_report'].fillna('x')
+    return filtered
+
+### threshold_metrics()
+###
+### The metrics of one model at one threshold worked out from its own predictions, as the notebooks did once per model.
+
+def threshold_metrics(margins, labels, threshold):
+    predicted = margins > threshold
+    true_positives = int((predicted & (labels == 1)).sum())
+    false_positives = int((predicted & (labels == 0)).sum())
+    false_negatives = int((~predicted & (labels == 1)).sum())
+    true_negatives = int((~predicted & (labels == 0)).sum())
+    return evaluation_tools.confusion_metrics(true_positives, false_positives, false_negatives, true_negatives)
+
@@ -0,0 +1,116 @@
+"""
+Model Tools
+
+Holds the ModelRegistry, which loads the classical models and their vectorizers from the 'Classical Models' folder
+once and scores tweets with every model while building each feature matrix only once.
+"""
+
+import os
+import time
+from joblib import load
+
+### feature_types
+###
+### Which vectorizer each classical model was trained on. Any model not listed here uses the count vectorizer.
+
+feature_types = {'bernoulliNB': 'bool', 'gradient_boosting': 'bool', 'kNN_bool': 'bool', 'random_forest_bool': 'bool',
+                 'kNN_tfidf': 'tfidf', 'logistic_regression': 'tfidf', 'random_forest_tfidf': 'tfidf', 'svm': 'tfidf'}
+
+vectorizer_names = ['bool', 'tfidf', 'count']
+
+### ModelRegistry
+###
+### Loads every model in directory (or only the ones named in models) when created, and each vectorizer the first time
+### a model needing it is used. transform() builds the feature matrix of each vectorizer once for a set of texts, and
+### predict() scores every model off the matrix of its vectorizer, so a group of four models sharing the tfidf
+### vectorizer only transforms the text once.
+###
+### self.timings records the seconds spent loading, transforming and predicting, and report() prints them per model.
+
+class ModelRegistry:
+
+    def __init__(self, directory='Classical Models', models=None):
+        self.directory = directory
+        self.vectorizers = {}
+        self.timings = {'load': {}, 'transform': {}, 'predict': {}}
+
+        self.models = {}
+        for entry in sorted(os.listdir(directory)):
+            name = entry.split('.')[0]
+            if name in vectorizer_names or (models is not None and name not in models):
+                continue
+            start = time.perf_counter()
+            self.models[name] = load(os.path.join(directory, entry))
+            self.timings['load'][name] = time.perf_counter() - start
+
+    def feature_type(self, name):
+        return feature_types.get(name, 'count')
+
+    def vectorizer(self, feature_type):
+        if feature_type not in self.vectorizers:
+            start = time.perf_counter()
+            self.vectorizers[feature_type] = load(os.path.join(self.directory, feature_type + '.joblib'))
+            self.timings['load'][feature_type] = time.perf_counter() - start
+        return self.vectorizers[feature_type]
+
+    ### transform()
+    ###
+    ### Returns a dictionary of {feature type: sparse matrix} for every feature type needed by the given models (all of
+    ### the loaded models by default).
+    ###
+    ### With a FeatureStore (feature_tools) and a dataset name, the matrices are taken from the store, which only
+    ### transforms the texts it has not seen before.
+
+    def transform(self, texts, names=None, store=None, dataset=None):
+        names = list(self.models) if names is None else names
+        features = {}
+
+        for feature_type in dict.fromkeys(self.feature_type(name) for name in names):
+            start = time.perf_counter()
+            if store is None:
+                features[feature_type] = self.vectorizer(feature_type).transform(texts)
+            else:
+                features[feature_type] = store.matrix(dataset, feature_type, texts, self.vectorizer(feature_type))
+            self.timings['transform'][feature_type] = time.perf_counter() - start
+
+        return features
+
+    ### predict()
+    ###
+    ### Returns a dictionary of {model name: predictions} for the given models (all of the loaded models by default).
+    ### features can be passed in from transform() to reuse matrices already built.
+
+    def predict(self, texts, names=None, features=None):
+        names = list(self.models) if names is None else names
+        features = self.transform(texts, names) if features is None else features
+        predictions = {}
+
+        for name in names:
+            start = time.perf_counter()
+            predictions[name] = self.models[name].predict(features[self.feature_type(name)])
+            self.timings['predict'][name] = time.perf_counter() - start
+
+        return predictions
+
+    ### predict_proba()
+    ###
+    ### Returns the probability of class 1 from a single model.
+
+    def predict_proba(self, texts, name, features=None):
+        feature_type = self.feature_type(name)
+        matrix = self.transform(texts, [name])[feature_type] if features is None else features[feature_type]
+
+        start = time.perf_counter()
+        probabilities = self.models[name].predict_proba(matrix)[:, 1]
+        self.timings['predict'][name] = time.perf_counter() - start
+
+        return probabilities
+
+    def report(self):
+        print('%-22s %-8s %10s %10s %10s' % ('model', 'features', 'load', 'transform', 'predict'))
+        for name in self.models:
+            feature_type = self.feature_type(name)
+            print('%-22s %-8s %9.3fs %9.3fs %9.3fs' % (name, feature_type, self.timings['load'].get(name, 0),
+                                                       self.timings['transform'].get(feature_type, 0),
+                                                       self.timings['predict'].get(name, 0)))
+        print('transform is shared by every model with the same features.')
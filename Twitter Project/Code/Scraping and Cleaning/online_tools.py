@@ -0,0 +1,298 @@
+"""
+Online Tools
+
+Trains logistic_regression, svm, bernoulliNB and multinomialNB a batch at a time instead of refitting them (and the
+bool, count and tfidf vocabularies) on the whole of clean.csv every time label_new_data() adds a few hundred labels.
+Tweets are turned into features by hashing their words into a fixed number of columns, so there is no vocabulary to
+refit, and the models are updated in place with partial_fit(). Every update is saved as a new version folder holding
+the models and vectorizers under the same names as 'Classical Models', so ModelRegistry, gather_fns_and_fps() and
+get_data_to_label() load a version the same way.
+"""
+
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from joblib import dump, load
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.naive_bayes import BernoulliNB, MultinomialNB
+from sklearn.preprocessing import normalize
+from sklearn.utils.validation import check_is_fitted
+
+from cleaning_tools import clean_column
+from dataset_tools import get_storage
+from feature_tools import _save_array
+from label_tools import text_hashes, text_labels
+from instrument_tools import instrumented, stage, current_stage
+from model_tools import ModelRegistry, feature_types
+
+### online_models
+###
+### The models trained online, each with the estimator that stands in for the notebook's model. logistic_regression
+### and svm become an SGDClassifier with the log and hinge loss, and the naive Bayes models keep their own
+### partial_fit().
+### Their feature types are the ones of model_tools.feature_types, so each saves next to the vectorizer it expects.
+
+online_models = {'logistic_regression': lambda seed: SGDClassifier(loss='log_loss', alpha=1e-4, random_state=seed),
+                 'svm': lambda seed: SGDClassifier(loss='hinge', alpha=1e-4, random_state=seed),
+                 'bernoulliNB': lambda seed: BernoulliNB(alpha=0.01),
+                 'multinomialNB': lambda seed: MultinomialNB(alpha=0.01)}
+
+classes = np.array([0, 1])
+
+def _feature_type(name):
+    return feature_types.get(name, 'count')
+
+### HashedVectorizer
+###
+### Stand-in for the fitted bool, count and tfidf vectorizers over a fixed space of n_features hashed columns. With
+### binary=True words are only marked present (bool), and with tfidf=True counts are weighted by the idf of the
+### documents passed to partial_fit() so far and every row scaled to length 1, as TfidfVectorizer does. partial_fit()
+### only counts document frequencies, so the vectorizer never has to see the whole dataset.
+###
+### The fitted attributes are only set by fit() and partial_fit(), as sklearn expects. vocabulary_ is always empty,
+### since hashed columns have no words, which lets the FeatureStore cache its matrices.
+
+class HashedVectorizer(BaseEstimator, TransformerMixin):
+
+    def __init__(self, n_features=2 ** 18, binary=False, tfidf=False):
+        self.n_features = n_features
+        self.binary = binary
+        self.tfidf = tfidf
+
+    def _hashed(self, texts):
+        return HashingVectorizer(n_features=self.n_features, binary=self.binary, alternate_sign=False,
+                                 norm=None).transform(texts)
+
+    @property
+    def idf_(self):
+        return np.log((1 + self.documents_) / (1 + self.document_counts_)) + 1
+
+    def _reset(self):
+        self.vocabulary_ = {}
+        self.documents_ = 0
+        self.document_counts_ = np.zeros(self.n_features, dtype=np.int64)
+
+    def partial_fit(self, texts, y=None):
+        if not hasattr(self, 'document_counts_'):
+            self._reset()
+        counts = self._hashed(texts).tocsc()
+        self.documents_ = self.documents_ + counts.shape[0]
+        self.document_counts_ += np.diff(counts.indptr)
+        return self
+
+    def fit(self, texts, y=None):
+        self._reset()
+        return self.partial_fit(texts)
+
+    def transform(self, texts):
+        check_is_fitted(self, 'document_counts_')
+        counts = self._hashed(texts)
+        if not self.tfidf:
+            return counts
+        return normalize(counts @ sparse.diags(self.idf_), copy=False)
+
+### new_vectorizers()
+###
+### A fresh bool, count and tfidf HashedVectorizer, keyed by feature type.
+
+def new_vectorizers(n_features=2 ** 18):
+    return {'bool': HashedVectorizer(n_features, binary=True), 'count': HashedVectorizer(n_features),
+            'tfidf': HashedVectorizer(n_features, tfidf=True)}
+
+### row_keys()
+###
+### 64 bit key of every (tweet, label) pair: the hash of the normalized tweet with its last bit flipped for label 1. A
+### tweet whose label changes gets a new key, so it is trained on again with its new label.
+
+def row_keys(tweets, labels):
+    return text_hashes(tweets) ^ np.asarray(labels, dtype=np.uint64)
+
+### read_versions()
+###
+### The entries of directory/versions.json, oldest first.
+
+def read_versions(directory='Online Models'):
+    if not os.path.exists(os.path.join(directory, 'versions.json')):
+        return []
+    with open(os.path.join(directory, 'versions.json')) as file:
+        return json.load(file)
+
+### OnlineTrainer
+###
+### Holds the online models, their vectorizers and the keys of every row trained on, and saves them as versions in
+### directory:
+###
+###     directory/v0001/          the models and vectorizers as '(name).joblib', loadable by ModelRegistry
+###     directory/trained/v0001.npy   the sorted row_keys() trained on up to that version
+###     directory/versions.json   one entry per version: rows trained, total rows and seconds spent
+###
+### A new trainer picks up from the latest version (or `version`) if there is one. update() trains on a batch of
+### cleaned tweets, and save() writes the next version.
+###
+### logistic_regression and svm weigh every row by how rare its class has been so far, which stands in for the
+### class_weight='balanced' of the notebook (partial_fit() cannot balance by itself).
+
+class OnlineTrainer:
+
+    def __init__(self, directory='Online Models', models=tuple(online_models), n_features=2 ** 18, version=None,
+                 seed=0):
+        self.directory = directory
+        self.versions = read_versions(directory)
+        self.version = version if version is not None else (self.versions[-1]['version'] if self.versions else 0)
+
+        if self.version:
+            folder = self.path(self.version)
+            self.models = {name: load(os.path.join(folder, name + '.joblib')) for name in models}
+            self.vectorizers = {feature_type: load(os.path.join(folder, feature_type + '.joblib'))
+                                for feature_type in dict.fromkeys(_feature_type(name) for name in models)}
+            self.trained = np.load(os.path.join(directory, 'trained', 'v%04d.npy' % self.version))
+            self.class_counts = np.array(self.versions[self.version - 1]['class_counts'])
+        else:
+            self.models = {name: online_models[name](seed) for name in models}
+            vectorizers = new_vectorizers(n_features)
+            self.vectorizers = {feature_type: vectorizers[feature_type]
+                                for feature_type in dict.fromkeys(_feature_type(name) for name in models)}
+            self.trained = np.zeros(0, dtype=np.uint64)
+            self.class_counts = np.zeros(2, dtype=np.int64)
+
+        self.new_keys = []
+        self.rows = 0
+        self.seconds = 0
+
+    def path(self, version):
+        return os.path.join(self.directory, 'v%04d' % version)
+
+    ### untrained()
+    ###
+    ### The rows of a DataFrame with 'injury_report' and 'tweet' columns which are labeled and have not been trained on
+    ### with that label, one row per tweet (the last one).
+
+    def untrained(self, data):
+        data = data.dropna(subset=['tweet'])
+        labels = text_labels(data['injury_report'])
+        data = data[labels != 'x'].assign(injury_report=labels[labels != 'x'].astype(float).astype(int))
+
+        keys = row_keys(data['tweet'], data['injury_report'])
+        data = data.assign(key=keys)[~np.isin(keys, np.concatenate([self.trained] + self.new_keys))]
+        return data[~data['key'].duplicated(keep='last')]
+
+    ### update()
+    ###
+    ### Trains every model on cleaned tweets and their 0 / 1 labels, batch_size rows at a time, `passes` times over the
+    ### rows in a shuffled order. keys are the row_keys() of the rows, recorded as trained.
+
+    def update(self, clean, labels, keys=None, passes=1, batch_size=2000, seed=0):
+        start = time.perf_counter()
+        clean = np.asarray(clean, dtype=object)
+        labels = np.asarray(labels, dtype=np.int64)
+        state = np.random.RandomState(seed)
+
+        for feature_type, vectorizer in self.vectorizers.items():
+            vectorizer.partial_fit(clean)
+        self.class_counts = self.class_counts + np.bincount(labels, minlength=2)
+        class_weights = self.class_counts.sum() / (2 * np.maximum(self.class_counts, 1))
+
+        for _ in range(passes):
+            order = state.permutation(len(labels))
+            for i in range(0, len(order), batch_size):
+                batch = order[i:i + batch_size]
+                matrices = {feature_type: vectorizer.transform(clean[batch])
+                            for feature_type, vectorizer in self.vectorizers.items()}
+                for name, model in self.models.items():
+                    weights = class_weights[labels[batch]] if isinstance(model, SGDClassifier) else None
+                    model.partial_fit(matrices[_feature_type(name)], labels[batch], classes=classes,
+                                      sample_weight=weights)
+
+        if keys is not None:
+            self.new_keys.append(np.asarray(keys, dtype=np.uint64))
+        self.rows = self.rows + len(labels)
+        self.seconds = self.seconds + time.perf_counter() - start
+
+    ### save()
+    ###
+    ### Writes the models, vectorizers and trained keys as the next version and returns its folder. The version is only
+    ### listed in versions.json once everything is written, so an interrupted save is never loaded.
+
+    def save(self):
+        version = (self.versions[-1]['version'] if self.versions else 0) + 1
+        folder = self.path(version)
+        os.makedirs(folder, exist_ok=True)
+        os.makedirs(os.path.join(self.directory, 'trained'), exist_ok=True)
+
+        for name, model in self.models.items():
+            dump(model, os.path.join(folder, name + '.joblib'))
+        for feature_type, vectorizer in self.vectorizers.items():
+            dump(vectorizer, os.path.join(folder, feature_type + '.joblib'))
+
+        self.trained = np.unique(np.concatenate([self.trained] + self.new_keys))
+        _save_array(os.path.join(self.directory, 'trained'), 'v%04d' % version, self.trained)
+
+        self.versions.append({'version': version, 'rows': self.rows, 'trained': len(self.trained),
+                              'class_counts': [int(count) for count in self.class_counts],
+                              'seconds': round(self.seconds, 3), 'created': time.strftime('%Y-%m-%d %H:%M:%S')})
+        with open(os.path.join(self.directory, 'versions.json.tmp'), 'w') as file:
+            json.dump(self.versions, file, indent=1)
+        os.replace(os.path.join(self.directory, 'versions.json.tmp'), os.path.join(self.directory, 'versions.json'))
+
+        self.version, self.new_keys, self.rows, self.seconds = version, [], 0, 0
+        return folder
+
+### latest_version()
+###
+### The folder of the latest saved version in directory, or None if nothing has been trained yet. Pass it as the
+### models folder of gather_fns_and_fps() or get_data_to_label().
+
+def latest_version(directory='Online Models'):
+    versions = read_versions(directory)
+    return os.path.join(directory, 'v%04d' % versions[-1]['version']) if versions else None
+
+### online_registry()
+###
+### A ModelRegistry of a saved version (the latest by default).
+
+def online_registry(directory='Online Models', version=None, models=None):
+    folder = latest_version(directory) if version is None else os.path.join(directory, 'v%04d' % version)
+    return ModelRegistry(folder, models)
+
+### PIPELINE FUNCTIONS
+
+### update_online_models()
+###
+### Streams filtered2 a chunk at a time, trains the online models on every labeled row not yet trained on with its
+### label, and saves a new version. The first run trains on every labeled row, with `passes` passes; later runs only see
+### the rows label_new_data() labeled or relabeled since, and make update_passes passes over them. Returns the folder of
+### the new version, or of the latest one if there was nothing new.
+
+@instrumented()
+def update_online_models(directory='Online Models', storage=None, cache=None, chunksize=250000, batch_size=2000,
+                         passes=5, update_passes=1, n_features=2 ** 18, seed=0):
+    storage = get_storage(storage)
+    trainer = OnlineTrainer(directory, n_features=n_features, seed=seed)
+    first = trainer.version == 0
+
+    with stage('read filtered2'):
+        new_rows = []
+        for chunk in storage.read_chunks(storage.path('filtered2'), ['injury_report', 'tweet'], chunksize):
+            new_rows.append(trainer.untrained(chunk))
+        new_rows = pd.concat(new_rows) if new_rows else pd.DataFrame(columns=['injury_report', 'tweet', 'key'])
+        new_rows = new_rows[~new_rows['key'].duplicated(keep='last')]
+    current_stage().rows(rows_out=new_rows.shape[0])
+
+    if new_rows.empty:
+        print('No new labels since version', trainer.version)
+        return latest_version(directory)
+
+    with stage('clean_column', rows_in=new_rows.shape[0]):
+        clean = clean_column(new_rows['tweet'], cache)
+    with stage('partial_fit', rows_in=new_rows.shape[0]):
+        trainer.update(clean, new_rows['injury_report'].values, new_rows['key'].values,
+                       passes if first else update_passes, batch_size, seed + trainer.version)
+
+    folder = trainer.save()
+    print('Trained on', new_rows.shape[0], 'rows in %.2fs, saved as' % trainer.versions[-1]['seconds'], folder)
+    return folder
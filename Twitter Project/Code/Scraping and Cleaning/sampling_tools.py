@@ -0,0 +1,140 @@
+"""
+Sampling Tools
+
+Holds the streaming sampler behind get_data_to_label(). The unlabeled pool is read a chunk at a time and only bounded
+heaps are kept between chunks: a random sample of distinct tweets, and the top tweets by a model's score. Memory stays
+the same however large filtered2 grows.
+"""
+
+import heapq
+import random
+import numpy as np
+import pandas as pd
+
+### strategies
+###
+### How a scored tweet is ranked for labeling, from the probability of class 1 given by the model. 'positive' keeps the
+### most likely injury reports among those predicted positive, and 'uncertainty' the tweets the model is least sure
+### about. 'random' scores nothing.
+
+strategies = {'positive': lambda p: np.where(p > 0.5, p, np.nan),
+              'uncertainty': lambda p: -np.abs(p - 0.5),
+              'random': None}
+
+### tweet_priorities()
+###
+### A pseudo-random 64 bit number for every tweet, fixed for a given seed. Copies of the same tweet get the same number,
+### so keeping the tweets with the smallest numbers gives a uniform sample of distinct tweets. They are uint64 and must
+### stay integers: as float64 numbers above 2 ** 53 collide, and the sample would no longer depend only on the seed.
+
+def tweet_priorities(tweets, seed):
+    return pd.util.hash_pandas_object(pd.Series(tweets, dtype=object), index=False,
+                                      hash_key='%016x' % (seed % 2 ** 64)).values
+
+def _complement(priorities):
+    return np.iinfo(np.uint64).max - priorities
+
+### BoundedHeap
+###
+### Keeps the `size` items with the highest scores pushed so far, each key at most once. threshold() is the score an item
+### must beat to get in once the heap is full, so whole chunks can be filtered with numpy before anything is pushed.
+### Integer scores are compared as integers, so uint64 priorities keep every bit.
+
+class BoundedHeap:
+
+    def __init__(self, size):
+        self.size = size
+        self.heap = []
+        self.keys = set()
+
+    def threshold(self):
+        return self.heap[0][0] if len(self.heap) >= self.size else -np.inf
+
+    def push(self, score, key, item):
+        if key in self.keys or self.size <= 0:
+            return
+        if len(self.heap) < self.size:
+            heapq.heappush(self.heap, (score, key, item))
+            self.keys.add(key)
+        elif score > self.heap[0][0]:
+            removed = heapq.heapreplace(self.heap, (score, key, item))
+            self.keys.discard(removed[1])
+            self.keys.add(key)
+
+    def push_many(self, scores, keys, items):
+        scores = np.asarray(scores)
+        if scores.dtype.kind not in 'iu':
+            scores = scores.astype(float)
+        for i in np.flatnonzero(scores > self.threshold()):
+            self.push(scores[i], keys[i], items[i])
+
+    ### items()
+    ###
+    ### The kept items, best first.
+
+    def items(self):
+        return [entry[2] for entry in sorted(self.heap, reverse=True)]
+
+### sample_pool()
+###
+### Samples tweets to label from an iterator of DataFrame chunks with 'injury_report' and 'tweet' columns. Labeled rows
+### and missing tweets are skipped. Returns two DataFrames in the format of sampled.csv and positive_samples.csv:
+###
+###     1. random_samples distinct unlabeled tweets chosen uniformly at random.
+###     2. scored_samples tweets ranked highest by the strategy, with the model's probability. score is called on lists
+###         of up to batch_size tweets and returns the probability of class 1 for each. With screen_size, a random
+###         sample of that many distinct tweets is kept while streaming and only those are scored at the end (as
+###         get_data_to_label() used to screen 100,000 tweets); with screen_size=None every unlabeled tweet is scored a
+###         batch at a time.
+###
+### seed fixes both samples; by default a new one is drawn on every call.
+###
+### keys can be a function giving a key for each tweet of a list, e.g. NearDuplicateIndex.sample_keys() which gives the
+### near-duplicate cluster the index already holds. Tweets are then sampled per key rather than per distinct text, so
+### at most one tweet of each such cluster is picked.
+
+def sample_pool(chunks, random_samples=1000, scored_samples=1000, strategy='positive', score=None, screen_size=100000,
+                batch_size=2000, seed=None, keys=None):
+    seed = random.getrandbits(64) if seed is None else seed
+    rank = strategies[strategy]
+    scoring = rank is not None and score is not None and scored_samples > 0
+
+    random_heap = BoundedHeap(random_samples)
+    screen_heap = BoundedHeap(screen_size if scoring and screen_size is not None else 0)
+    scored_heap = BoundedHeap(scored_samples if scoring else 0)
+
+    def score_batches(tweets, tweet_keys):
+        for i in range(0, len(tweets), batch_size):
+            batch = tweets[i:i + batch_size]
+            probabilities = np.asarray(score(batch), dtype=float)
+            scored_heap.push_many(np.nan_to_num(rank(probabilities), nan=-np.inf), tweet_keys[i:i + batch_size],
+                                  list(zip(batch, probabilities)))
+
+    for chunk in chunks:
+        chunk = chunk[chunk['injury_report'] == 'x'].dropna(subset=['tweet'])
+        tweets = list(dict.fromkeys(chunk['tweet'].astype(str).tolist()))
+        if not tweets:
+            continue
+        tweet_keys = tweets if keys is None else [str(key) for key in keys(tweets)]
+
+        # Smallest priorities are kept, so they are pushed complemented (largest uint64 minus the priority), which
+        # keeps them exact integers. The screening sample uses a different seed so it is independent of the random
+        # sample.
+
+        random_heap.push_many(_complement(tweet_priorities(tweet_keys, seed)), tweet_keys, tweets)
+
+        if scoring and screen_size is not None:
+            screen_heap.push_many(_complement(tweet_priorities(tweet_keys, seed + 1)), tweet_keys,
+                                  list(zip(tweets, tweet_keys)))
+        elif scoring:
+            score_batches(tweets, tweet_keys)
+
+    if scoring and screen_size is not None:
+        screened = screen_heap.items()
+        score_batches([tweet for tweet, key in screened], [key for tweet, key in screened])
+
+    random_sampled = pd.DataFrame({'injury_report': 'x', 'tweet': random_heap.items()}, columns=['injury_report', 'tweet'])
+    scored = pd.DataFrame(scored_heap.items(), columns=['tweet', 'probability'])
+    scored.insert(0, 'injury_report', 'x')
+
+    return random_sampled, scored
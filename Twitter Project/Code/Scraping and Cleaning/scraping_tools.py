@@ -10,11 +10,18 @@ import requests
 import time
 import os
 import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from instrument_tools import instrumented, current_stage
 
 # for twint
 
 import twint
 import nest_asyncio
+import asyncio
+import json
+import csv
 from datetime import date
 
 def download_file_from_google_drive(id, destination):
@@ -46,49 +53,248 @@ def save_response_content(response, destination):
             if chunk: # filter out keep-alive new chunks
                 f.write(chunk)
                 
-def download_files():
+### GOOGLE DRIVE TRANSFERS
+###
+### download_files() and upload_files() move the files listed in download_ids_and_locations.csv (id,destination[,md5])
+### and upload_ids_and_locations.csv (parent,id,location) through a TransferManager: a bounded pool of worker threads
+### runs the transfers at the same time, downloads are written to a '.part' file and continue from it with a Range
+### request after a dropped connection or an interrupted run, and files whose local md5 already matches the manifest
+### are skipped. Every transfer is reported with its size and bytes/sec.
+###
+### The manifest (transfer_manifest.json) maps each Drive file id to the md5 of the copy last downloaded or uploaded.
+### For downloads an md5 given in the third column of the csv (Drive's md5Checksum for the file) takes its place, so a
+### file changed on Drive is fetched again; without one, pass refresh=True to ignore the manifest.
+
+drive_download_url = "https://docs.google.com/uc?export=download"
+
+### file_md5()
+###
+### md5 of a file, read a chunk at a time. None if the file does not exist.
+
+def file_md5(filename, chunk_size=1048576):
+    if not os.path.isfile(filename):
+        return None
+
+    digest = hashlib.md5()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class TransferManifest:
+
+    def __init__(self, filename='transfer_manifest.json'):
+        self.filename = filename
+        self.checksums = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(filename):
+            with open(filename) as file:
+                self.checksums = json.load(file)
+
+    def get(self, file_id):
+        with self.lock:
+            return self.checksums.get(file_id)
+
+    def record(self, file_id, md5):
+        with self.lock:
+            self.checksums[file_id] = md5
+            with open(self.filename + '.tmp', 'w') as file:
+                json.dump(self.checksums, file, indent=1, sort_keys=True)
+            os.replace(self.filename + '.tmp', self.filename)
+
+### TransferManager
+###
+### Runs downloads and uploads on up to `workers` threads. Each thread keeps its own requests.Session for downloads (and
+### its own authorized http object for uploads), since neither is safe to share between threads. Failed transfers are
+### retried `retries` times with exponential backoff (backoff, then twice that, ...), as run_account_scrape() retries
+### accounts, each retry of a download picking up from its '.part' file.
+###
+### url is the download endpoint, so a local stand-in for docs.google.com/uc can be used when testing.
+
+class TransferManager:
+
+    def __init__(self, workers=4, manifest=None, url=drive_download_url, chunk_size=32768, retries=3, refresh=False,
+                 backoff=1.0):
+        self.workers = workers
+        self.manifest = TransferManifest() if manifest is None else manifest
+        self.url = url
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.refresh = refresh
+        self.backoff = backoff
+        self.local = threading.local()
+
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    ### download()
+    ###
+    ### Downloads one file to destination unless the local copy already has the expected md5. Returns a report of the
+    ### transfer: status ('skipped', 'downloaded', 'resumed' or 'failed'), bytes received, seconds and bytes/sec.
+
+    def download(self, file_id, destination, md5=None):
+        expected = md5 if md5 else (None if self.refresh else self.manifest.get(file_id))
+        start = time.perf_counter()
+
+        if expected is not None and file_md5(destination) == expected:
+            return _transfer_report(file_id, destination, 'skipped', 0, start)
+
+        received = [0]
+        resumed = False
+        error = None
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                resumed = self._fetch(file_id, destination + '.part', received) or resumed
+                error = None
+                break
+            except requests.RequestException as exception:
+                error = exception
+
+        if error is not None:
+            report = _transfer_report(file_id, destination, 'failed', received[0], start)
+            report['error'] = str(error)
+            return report
+
+        checksum = file_md5(destination + '.part')
+        if md5 and checksum != md5:
+            os.remove(destination + '.part')
+            report = _transfer_report(file_id, destination, 'failed', received[0], start)
+            report['error'] = 'md5 mismatch'
+            return report
+
+        os.replace(destination + '.part', destination)
+        self.manifest.record(file_id, checksum)
+        return _transfer_report(file_id, destination, 'resumed' if resumed else 'downloaded', received[0], start)
+
+    ### _fetch()
+    ###
+    ### Streams a file into its '.part' file, asking only for the bytes after the ones already there. Servers which
+    ### ignore the Range header send the whole file, which then replaces the partial one. Bytes are counted into
+    ### received[0] as they arrive, so a dropped connection still counts what it delivered. Returns whether an existing
+    ### partial file was continued.
+
+    def _fetch(self, file_id, part, received):
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+        session = self.session()
+
+        response = session.get(self.url, params={'id': file_id}, headers=headers, stream=True, timeout=60)
+        token = get_confirm_token(response)
+        if token:
+            response.close()
+            response = session.get(self.url, params={'id': file_id, 'confirm': token}, headers=headers,
+                                   stream=True, timeout=60)
+
+        with response:
+            if response.status_code == 416:  # the partial file already holds everything
+                return True
+            response.raise_for_status()
+
+            resumed = offset > 0 and response.status_code == 206
+            with open(part, 'ab' if resumed else 'wb') as file:
+                for chunk in response.iter_content(self.chunk_size):
+                    if chunk: # filter out keep-alive new chunks
+                        file.write(chunk)
+                        received[0] = received[0] + len(chunk)
+
+        return resumed
+
+    ### upload()
+    ###
+    ### Uploads a local file as the new content of a Drive file unless its md5 matches the one last uploaded. Only the
+    ### content is replaced; the Drive file keeps its title.
+
+    def upload(self, gauth, drive, parent, file_id, filename):
+        start = time.perf_counter()
+        checksum = file_md5(filename)
+
+        if not self.refresh and checksum == self.manifest.get(file_id):
+            return _transfer_report(file_id, filename, 'skipped', 0, start)
+
+        if not hasattr(self.local, 'http'):
+            self.local.http = gauth.Get_Http_Object()
+
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                gfile = drive.CreateFile({'parents': [{'id': parent}], 'id': file_id})
+                gfile.SetContentFile(filename)
+                gfile.Upload(param={'http': self.local.http})
+                error = None
+                break
+            except Exception as exception:
+                error = exception
+
+        if error is not None:
+            report = _transfer_report(file_id, filename, 'failed', 0, start)
+            report['error'] = str(error)
+            return report
+
+        self.manifest.record(file_id, checksum)
+        return _transfer_report(file_id, filename, 'uploaded', os.path.getsize(filename), start)
+
+    ### run()
+    ###
+    ### Calls a transfer method for every tuple of arguments on the worker pool and prints each report as it finishes.
+    ### Returns the reports in the order given.
+
+    def run(self, transfer, jobs):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(transfer, *job) for job in jobs]
+            for future in as_completed(futures):
+                print_transfer_report(future.result())
+            return [future.result() for future in futures]
+
+def _transfer_report(file_id, filename, status, transferred, start):
+    seconds = time.perf_counter() - start
+    return {'id': file_id, 'file': filename, 'status': status, 'bytes': transferred, 'seconds': seconds,
+            'bytes_per_sec': transferred / seconds if seconds > 0 else 0.0}
+
+def print_transfer_report(report):
+    print('%-9s %-40s %12d bytes %8.2fs %10.0f KB/s' % (report['status'], report['file'], report['bytes'],
+                                                      report['seconds'], report['bytes_per_sec'] / 1024)
+          + ('  (' + report['error'] + ')' if 'error' in report else ''))
+
+### _upload_path()
+###
+### Where upload_ids_and_locations.csv's location lives locally: files under 'Classical Models' are in that folder and
+### everything else is in the working directory.
+
+def _upload_path(location):
+    filename = location.split('/')[-1]
+    return os.path.join('Classical Models', filename) if 'Classical Models' in location else filename
+
+@instrumented()
+def download_files(workers=4, refresh=False, url=drive_download_url):
 
     with open('download_ids_and_locations.csv') as file:
-        
-        ids_and_locations = [line.rstrip('\n').split(',') 
-        for line in file.readlines()]
-    
-        for i in range(len(ids_and_locations)):
-            file_id = ids_and_locations[i][0]
-            destination = ids_and_locations[i][1]
-            download_file_from_google_drive(file_id, destination)
-    
-def upload_files():
-    gauth = GoogleAuth()          
+        ids_and_locations = [line.rstrip('\n').split(',') for line in file.readlines() if line.strip()]
+
+    jobs = [(entry[0], entry[1], entry[2] if len(entry) > 2 else None) for entry in ids_and_locations]
+    manager = TransferManager(workers, url=url, refresh=refresh)
+    current_stage().rows(rows_in=len(jobs))
+    return manager.run(manager.download, jobs)
+
+@instrumented()
+def upload_files(workers=4, refresh=False):
+    gauth = GoogleAuth()
     drive = GoogleDrive(gauth)
 
     with open('upload_ids_and_locations.csv') as file:
-        
-        ids_and_locations = [line.rstrip('\n').split(',') 
-        for line in file.readlines()]
-    
-        for i in range(len(ids_and_locations)):
-    
-            gfile = drive.CreateFile({'parents': [{'id': ids_and_locations[i][0]}],
-                                      'id': ids_and_locations[i][1]})
-
-            file_location = ids_and_locations[i][2]
-            filename = ids_and_locations[i][2].split('/')
-            filename = filename[len(filename)-1]
-            cwd = os.getcwd()
-            new_file_location = cwd + '\\' + filename
-            starting_file_location = file_location.rstrip(filename)
-
-            if 'Classical Models' in file_location:
-                os.chdir(os.getcwd() + '\\' + 'Classical Models')
-                gfile.SetContentFile(filename)
-                gfile.Upload()
-                os.chdir(os.getcwd().rstrip('\\Classical Models'))
-            else:
-                gfile.SetContentFile(filename)
-                gfile.Upload()
+        ids_and_locations = [line.rstrip('\n').split(',') for line in file.readlines() if line.strip()]
 
-            time.sleep(5)
+    jobs = [(gauth, drive, entry[0], entry[1], _upload_path(entry[2])) for entry in ids_and_locations]
+    manager = TransferManager(workers, refresh=refresh)
+    current_stage().rows(rows_in=len(jobs))
+    return manager.run(manager.upload, jobs)
 
 def get_file_list(fileName):
     file = open(fileName)
@@ -106,57 +312,295 @@ def write_file_list(list, filename):
 
 def get_current_date(): return str(date.today().year) + '-' + str(date.today().month) + '-' + str(date.today().day)
     
-def scrape_twitter_accounts():
+### INCREMENTAL SCRAPING
+###
+### Every account and hashtag has a high-water mark: the id and date of the newest tweet already collected from it,
+### kept in lists\\scrape_state.json. A scrape searches from the date of that tweet (or today for a new source), twint
+### writes its results to an 'incoming' file, and only tweets with a larger id than the mark are appended to the
+### source's partition TweetData/<name>.csv. Re-fetched tweets are therefore dropped at scrape time rather than by
+### drop_duplicates() in scrape_to_merge() or the groupby in aggregate_merged().
+
+class ScrapeState:
+
+    def __init__(self, filename='lists\\scrape_state.json'):
+        self.filename = filename
+        self.marks = {}
+
+        if os.path.exists(filename):
+            with open(filename) as file:
+                self.marks = json.load(file)
+
+    def save(self):
+        with open(self.filename + '.tmp', 'w') as file:
+            json.dump(self.marks, file, indent=1, sort_keys=True)
+        os.replace(self.filename + '.tmp', self.filename)
+
+    ### since()
+    ###
+    ### The date to search from for a source: the date of its newest collected tweet, or `default` for a new source.
+
+    def since(self, key, default):
+        mark = self.marks.get(key)
+        return default if mark is None else mark['date']
+
+    ### absorb()
+    ###
+    ### Appends the tweets of a twint csv file newer than the source's mark to its partition file, updates the mark and
+    ### deletes the incoming file. Returns the number of new tweets.
+    ###
+    ### The whole incoming file is read before anything is written, so a file without an id or date column or with a
+    ### malformed id raises PartitionError and leaves the partition and the mark as they were.
+
+    def absorb(self, key, incoming, partition):
+        if not os.path.exists(incoming):
+            return 0
+
+        mark = self.marks.get(key, {'id': -1, 'date': None})
+        newest = dict(mark)
+        rows = []
+
+        with open(incoming, newline='', encoding='utf-8') as source:
+            reader = csv.reader(source)
+            header = next(reader, None)
+
+            if header is not None:
+                try:
+                    id_column, date_column = header.index('id'), header.index('date')
+                    for row in reader:
+                        tweet_id = int(row[id_column])
+                        if tweet_id <= mark['id']:
+                            continue
+                        rows.append(row)
+                        if tweet_id > newest['id']:
+                            newest = {'id': tweet_id, 'date': row[date_column][:10]}
+                except (ValueError, IndexError) as error:
+                    raise PartitionError('Cannot read %s (line %d): %s' % (incoming, reader.line_num, error))
+
+        if rows:
+            write_header = not os.path.exists(partition)
+            with open(partition, 'a', newline='', encoding='utf-8') as destination:
+                writer = csv.writer(destination)
+                if write_header:
+                    writer.writerow(header)
+                writer.writerows(rows)
+            self.marks[key] = newest
+
+        os.remove(incoming)
+        return len(rows)
+
+### PartitionError
+###
+### Raised by ScrapeState.absorb() for an incoming file it cannot read. It is kept apart from the ValueError twint
+### raises for a missing account, so a bad file never puts a working account on the broken list.
+
+class PartitionError(Exception):
+    pass
+
+### ACCOUNT SCRAPING SCHEDULER
+###
+### scrape_twitter_accounts() runs the searches for accountList.txt on an asyncio event loop: up to `concurrency`
+### searches run at once (each on its own thread, since twint blocks), a TokenBucket spaces out the start of each search
+### instead of sleeping 15 seconds after every one, and searches which fail with anything other than a ValueError are
+### retried with exponential backoff. Finished accounts are checkpointed, so an interrupted sweep started again on the
+### same day picks up where it stopped.
+
+class TokenBucket:
+
+    ### Allows `rate` acquisitions per second on average, with bursts of up to `capacity`.
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens = self.tokens - 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+### twint_account_search()
+###
+### The search backend used by scrape_twitter_accounts(): a twint search of one account's tweets since a date, written to
+### a csv file. Runs on a worker thread, so it is given its own event loop for twint.
+
+def twint_account_search(username, since, output):
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+    c = twint.Config()
+    c.Username = username
+    c.Limit = 1000
+    c.Store_csv = True
+    c.Since = since
+    c.Output = output
+    c.Hide_output = True
+
+    twint.run.Search(c)
+
+def _read_checkpoint(checkpoint, current_date):
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as file:
+            state = json.load(file)
+        if state.get('date') == current_date:
+            return state
+
+    return {'date': current_date, 'done': [], 'broken': []}
+
+def _write_checkpoint(checkpoint, state):
+    with open(checkpoint + '.tmp', 'w') as file:
+        json.dump(state, file)
+    os.replace(checkpoint + '.tmp', checkpoint)
+
+### run_account_scrape()
+###
+### Coroutine doing the work of scrape_twitter_accounts(). search is called as search(username, since, output) and
+### should raise ValueError for accounts which no longer exist. Returns the checkpoint state, with the accounts which
+### still failed after every retry under 'failed'.
+###
+### With a ScrapeState each account is searched from its high-water mark and only newer tweets are appended to its
+### partition. An account whose results cannot be absorbed (PartitionError) is put under 'failed' rather than
+### 'broken', so it is searched again on the next run.
+
+async def run_account_scrape(userids, search, current_date, checkpoint, concurrency=4, rate=0.25, retries=3,
+                             backoff=5.0, output_directory='TweetData', scrape_state=None):
+    state = _read_checkpoint(checkpoint, current_date)
+    finished = set(state['done']) | set(state['broken'])
+    remaining = [userid for userid in userids if userid not in finished]
+    state['failed'] = []
+
+    bucket = TokenBucket(rate, capacity=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def scrape(userid):
+        key = 'account:' + userid
+        partition = output_directory + '/' + userid + '.csv'
+        incoming = output_directory + '/incoming/' + userid + '.csv'
+        since = current_date if scrape_state is None else scrape_state.since(key, current_date)
+        output = partition if scrape_state is None else incoming
+
+        async with semaphore:
+            for attempt in range(retries + 1):
+                await bucket.acquire()
+                if scrape_state is not None and os.path.exists(incoming):
+                    os.remove(incoming)
+                try:
+                    await asyncio.to_thread(search, userid, since, output)
+                except ValueError:
+                    state['broken'].append(userid)
+                    break
+                except Exception:
+                    if attempt == retries:
+                        state['failed'].append(userid)
+                    else:
+                        await asyncio.sleep(backoff * 2 ** attempt)
+                    continue
+
+                try:
+                    if scrape_state is not None:
+                        scrape_state.absorb(key, incoming, partition)
+                    state['done'].append(userid)
+                except PartitionError as error:
+                    print(error)
+                    state['failed'].append(userid)
+                break
+
+            if scrape_state is not None:
+                scrape_state.save()
+            _write_checkpoint(checkpoint, state)
+
+            completed = len(state['done']) + len(state['broken'])
+            if completed % 250 == 0: print(completed, 'usernames reached.')
+
+    if scrape_state is not None:
+        os.makedirs(output_directory + '/incoming', exist_ok=True)
+
+    await asyncio.gather(*[scrape(userid) for userid in remaining])
+    return state
+
+### scrape_twitter_accounts()
+###
+### Scrapes today's tweets from every account in accountList.txt into TweetData, then moves any accounts which no
+### longer exist into brokenList.txt. See run_account_scrape() for the settings; search can be swapped for a fake
+### backend when testing.
+
+@instrumented()
+def scrape_twitter_accounts(concurrency=4, rate=0.25, retries=3, backoff=5.0, search=twint_account_search,
+                            checkpoint='lists\\scrape_checkpoint.json', incremental=True):
     
     nest_asyncio.apply()
 
     userids = get_file_list('lists\\accountList.txt')
     broken_ids = get_file_list('lists\\brokenList.txt')
     current_date = get_current_date()
-    count=0
-    
-    while count < len(userids) - 1:
-        
-        if count % 250 == 0: print(count, 'usernames reached.')
-        
-        try:
-            c = twint.Config()
-            c.Username = userids[count]
-            c.Limit = 1000
-            c.Store_csv = True
-            c.Since = current_date
-            c.Output = 'TweetData/' + userids[count] + ".csv"
-            c.Hide_output = True
-            
-            twint.run.Search(c)
-            del c
-            time.sleep(15)
-            count+=1
-            
-        except ValueError:
-            broken_ids.append(userids[count])
-            
-        count+=1
+    scrape_state = ScrapeState() if incremental else None
+
+    state = asyncio.run(run_account_scrape(userids, search, current_date, checkpoint, concurrency, rate, retries,
+                                           backoff, scrape_state=scrape_state))
+    broken_ids = broken_ids + state['broken']
+    current_stage().rows(rows_in=len(userids), rows_out=len(state['done']))
 
     write_file_list(set(userids) - set(broken_ids), 'lists\\accountList.txt')
     write_file_list(set(broken_ids), 'lists\\brokenList.txt')
 
-def scrape_twitter_hashtags():
+    if not state['failed'] and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+### twint_hashtag_search()
+###
+### twint search of English tweets containing a hashtag since a date, written to a csv file.
+
+def twint_hashtag_search(hashtag, since, output):
+    c = twint.Config()
+    c.Search = hashtag
+    c.Since = since
+    c.Lang = 'en'
+    c.Store_csv = True
+    c.Output = output
+    c.Hide_output = True
+
+    twint.run.Search(c)
+
+### scrape_twitter_hashtags()
+###
+### Scrapes every hashtag in hashtagList.txt into TweetData. With incremental=True each hashtag is searched from its
+### high-water mark in the ScrapeState and only newer tweets are appended to its partition.
+
+@instrumented()
+def scrape_twitter_hashtags(search=twint_hashtag_search, incremental=True):
 
     nest_asyncio.apply()
 
     hashtagList = get_file_list('lists\\hashtagList.txt')
     current_date = get_current_date()
+    scrape_state = ScrapeState() if incremental else None
+
+    if incremental:
+        os.makedirs('TweetData/incoming', exist_ok=True)
 
+    added = 0
     for hashtags in hashtagList:
 
-        c = twint.Config()
-        c.Search = hashtags
-        c.Since = current_date
-        c.Lang = 'en'
-        c.Store_csv = True
-        c.Output = 'TweetData/' + hashtags + '.csv'
-        c.Hide_output = True
+        if scrape_state is None:
+            search(hashtags, current_date, 'TweetData/' + hashtags + '.csv')
+        else:
+            key = 'hashtag:' + hashtags
+            search(hashtags, scrape_state.since(key, current_date), 'TweetData/incoming/' + hashtags + '.csv')
+            try:
+                added = added + scrape_state.absorb(key, 'TweetData/incoming/' + hashtags + '.csv',
+                                                    'TweetData/' + hashtags + '.csv')
+            except PartitionError as error:
+                print(error)
+            scrape_state.save()
+
+        time.sleep(15)
 
-        twint.run.Search(c)
-        time.sleep(15)
\ No newline at end of file
+    current_stage().rows(rows_in=len(hashtagList), rows_out=added if incremental else None)
@@ -0,0 +1,269 @@
+"""
+Search Tools
+
+Cross-validates the classical models of the "Classical Machine Learning Models" notebook over their hyperparameter
+grids on a process pool. The bool, count and tfidf matrices of every fold are built once and saved in a FeatureStore,
+and every worker memory-maps them instead of being sent a pickled copy with each task. Jobs (one model, one fold and
+one set of hyperparameters each) are handed out longest first, so a slow random forest is not left running alone at
+the end, and every score ends up in one results table.
+"""
+
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from sklearn import svm
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import StratifiedKFold
+from sklearn.naive_bayes import BernoulliNB, MultinomialNB
+from sklearn.neighbors import KNeighborsClassifier
+
+from evaluation_tools import confusion_counts, confusion_metrics, format_table, metric_names
+from feature_tools import FeatureStore, _save_array
+from instrument_tools import instrumented, stage, current_stage
+from model_tools import feature_types
+
+### model_zoo
+###
+### Every model of the notebook with its estimator and the grid it was searched over. The naive Bayes alphas are 100
+### steps of the notebook's 1000 (alpha=0 is left out, since sklearn clips it anyway). Models are named as in
+### 'Classical Models', so model_tools.feature_types gives the features each is trained on.
+
+model_zoo = {'kNN_bool': (KNeighborsClassifier, {'weights': ['distance'], 'n_neighbors': list(range(1, 20))}),
+             'kNN_tfidf': (KNeighborsClassifier, {'weights': ['distance'], 'n_neighbors': list(range(1, 20))}),
+             'bernoulliNB': (BernoulliNB, {'alpha': list(np.linspace(0.001, 0.1, 100))}),
+             'multinomialNB': (MultinomialNB, {'alpha': list(np.linspace(0.001, 0.1, 100))}),
+             'logistic_regression': (LogisticRegression, {'penalty': ['l1', 'l2'],
+                                                          'C': [2 ** i for i in range(-5, 16)],
+                                                          'class_weight': ['balanced'], 'solver': ['liblinear']}),
+             'random_forest_bool': (RandomForestClassifier, {'criterion': ['entropy', 'gini'],
+                                                             'max_depth': list(range(20, 41)), 'n_estimators': [100],
+                                                             'class_weight': ['balanced', 'balanced_subsample']}),
+             'random_forest_tfidf': (RandomForestClassifier, {'criterion': ['entropy', 'gini'],
+                                                              'min_samples_split': [5],
+                                                              'max_depth': list(range(20, 41)), 'min_samples_leaf': [5],
+                                                              'n_estimators': [100],
+                                                              'class_weight': ['balanced', 'balanced_subsample']}),
+             'svm': (svm.SVC, {'C': [2 ** i for i in range(-5, 16)], 'kernel': ['linear']})}
+
+### feature_vectorizers, data_types, model_titles
+###
+### The unfitted vectorizer of each feature type, and the names of the feature types and models in the README table.
+
+feature_vectorizers = {'bool': lambda: CountVectorizer(binary=True), 'count': CountVectorizer, 'tfidf': TfidfVectorizer}
+
+data_types = {'bool': 'Boolean', 'count': 'Count', 'tfidf': 'TF-IDF'}
+
+model_titles = {'kNN_bool': 'kNN', 'kNN_tfidf': 'kNN', 'bernoulliNB': 'Bernoulli NB', 'multinomialNB': 'Multinomial NB',
+                'logistic_regression': 'Logistic Regression', 'random_forest_bool': 'Random Forest',
+                'random_forest_tfidf': 'Random Forest', 'svm': 'SVM'}
+
+### model_costs
+###
+### Rough seconds per thousand training rows of each kind of model at its default settings, used to order the jobs
+### when no earlier results are given. Only the order matters, not the values.
+
+model_costs = {'kNN': 0.2, 'bernoulliNB': 0.01, 'multinomialNB': 0.005, 'logistic_regression': 0.05,
+               'random_forest': 3.0, 'svm': 1.0}
+
+### HELPER FUNCTIONS
+
+def _feature_type(name):
+    return feature_types.get(name, 'count')
+
+def _params_key(params):
+    return json.dumps(params, sort_keys=True, default=float)
+
+### parameter_grid()
+###
+### Every combination of a grid's values, as a list of dictionaries.
+
+def parameter_grid(grid):
+    combinations = [{}]
+    for key in sorted(grid):
+        combinations = [dict(combination, **{key: value}) for combination in combinations for value in grid[key]]
+    return combinations
+
+### estimate_cost()
+###
+### The expected seconds of a job. With a table of earlier results the mean seconds of the same model and parameters
+### are used; otherwise model_costs is scaled by the number of training rows and the settings that make a model slower
+### (more and deeper trees, a larger C for the svm, the l1 penalty).
+
+def estimate_cost(name, params, rows, previous=None):
+    if previous is not None:
+        earlier = previous[(previous['model'] == name) & (previous['params'] == _params_key(params))]
+        if not earlier.empty:
+            return float(earlier['seconds'].mean())
+
+    kind = next((kind for kind in model_costs if name.startswith(kind)), None)
+    cost = model_costs.get(kind, 1.0) * rows / 1000
+    if kind == 'random_forest':
+        cost = cost * params.get('n_estimators', 100) / 100 * params.get('max_depth', 30) / 30
+    elif kind == 'svm':
+        cost = cost * (1 + max(np.log2(params.get('C', 1)), 0) / 4)
+    elif kind == 'logistic_regression' and params.get('penalty') == 'l1':
+        cost = cost * 2
+    return cost
+
+### FOLD FEATURES
+###
+### Folds are saved in the FeatureStore as datasets 'fold (k) train' and 'fold (k) test', with their labels next to them
+### as directory/folds/(k) train.npy and (k) test.npy. Workers map them read-only the first time a job needs them and
+### keep them for every later job of the same fold.
+
+_worker = {}
+
+def _init_search_worker(directory):
+    _worker['store'] = FeatureStore(directory)
+    _worker['directory'] = directory
+    _worker['matrices'] = {}
+
+def _fold_arrays(fold, feature_type):
+    key = (fold, feature_type)
+    if key not in _worker['matrices']:
+        store, folder = _worker['store'], os.path.join(_worker['directory'], 'folds')
+        _worker['matrices'][key] = tuple(
+            (store.load('fold %d %s' % (fold, part), feature_type),
+             np.load(os.path.join(folder, '%d %s.npy' % (fold, part)), mmap_mode='r')) for part in ['train', 'test'])
+    return _worker['matrices'][key]
+
+### build_fold_features()
+###
+### Splits texts into stratified folds and saves, for every fold, the matrix of each feature type with its vectorizer
+### fitted on the training part only, so no fold sees the words of its own test part. Returns the number of training
+### rows of each fold.
+
+def build_fold_features(texts, labels, feature_types_used, folds=8, directory='CV Features', seed=0):
+    store = FeatureStore(directory)
+    os.makedirs(os.path.join(directory, 'folds'), exist_ok=True)
+    texts = np.asarray(texts, dtype=object)
+    labels = np.asarray(labels, dtype=np.int64)
+    splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+
+    train_rows = []
+    for fold, (train, test) in enumerate(splitter.split(texts, labels)):
+        for feature_type in feature_types_used:
+            vectorizer = feature_vectorizers[feature_type]().fit(texts[train])
+            store.matrix('fold %d train' % fold, feature_type, texts[train], vectorizer)
+            store.matrix('fold %d test' % fold, feature_type, texts[test], vectorizer)
+        _save_array(os.path.join(directory, 'folds'), '%d train' % fold, labels[train])
+        _save_array(os.path.join(directory, 'folds'), '%d test' % fold, labels[test])
+        train_rows.append(len(train))
+
+    return train_rows
+
+### run_job()
+###
+### Fits one model with one set of parameters on one fold and scores it on the fold's test part. Runs in a worker.
+
+def run_job(job):
+    name, params, fold, seed = job
+    (train, train_labels), (test, test_labels) = _fold_arrays(fold, _feature_type(name))
+    estimator, _ = model_zoo[name]
+    model = estimator(**params)
+    if 'random_state' in model.get_params():
+        model.set_params(random_state=seed)
+
+    start = time.perf_counter()
+    model.fit(train, np.asarray(train_labels))
+    predictions = model.predict(test)
+    seconds = time.perf_counter() - start
+
+    metrics = confusion_metrics(*confusion_counts(predictions, np.asarray(test_labels)))
+    result = {'model': name, 'params': _params_key(params), 'fold': fold, 'seconds': seconds, 'pid': os.getpid()}
+    result.update({metric: float(value) for metric, value in metrics.items()})
+    return result
+
+### run_jobs()
+###
+### Runs jobs on a pool of `workers` processes (or in this process with workers=1), longest first by costs. Returns
+### the results in the order of the jobs, along with the wall time.
+
+def run_jobs(jobs, costs, directory, workers=1):
+    order = sorted(range(len(jobs)), key=lambda i: -costs[i])
+    start = time.perf_counter()
+
+    if workers == 1:
+        _init_search_worker(directory)
+        results = {i: run_job(jobs[i]) for i in order}
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_search_worker,
+                                 initargs=(directory,)) as executor:
+            futures = {i: executor.submit(run_job, jobs[i]) for i in order}
+            results = {i: future.result() for i, future in futures.items()}
+
+    return [results[i] for i in range(len(jobs))], time.perf_counter() - start
+
+### summarize_results()
+###
+### Mean of every metric over the folds for each model and set of parameters, and the best parameters of each model by
+### scoring.
+
+def summarize_results(results, scoring='sensitivity'):
+    summary = results.groupby(['model', 'params'], sort=False)[metric_names + ['seconds']].mean().reset_index()
+    best = summary.loc[summary.groupby('model', sort=False)[scoring].idxmax()].reset_index(drop=True)
+    return summary, best
+
+### results_table()
+###
+### The README table of the best parameters of each model.
+
+def results_table(best):
+    return format_table([[model_titles.get(row['model'], row['model']), data_types[_feature_type(row['model'])]] +
+                         [row[metric] for metric in metric_names] for _, row in best.iterrows()])
+
+### PIPELINE FUNCTIONS
+
+### search_models()
+###
+### Cross-validates every model of models (all of model_zoo by default) over its grid on the labeled rows of a csv
+### file's `column`:
+###
+###     1. The fold matrices are built once and saved to directory.
+###     2. One job per model, fold and set of parameters is run on a pool of `workers` processes, longest first. The
+###         costs come from estimate_cost(), or from an earlier results table (previous) when there is one.
+###     3. Every job's metrics and seconds are written to `results`, one row each, and the mean over folds and best
+###         parameters by scoring (sensitivity, the recall the notebook searched on) are printed as the README table.
+###
+### grids can replace the grid of any model. Returns the results, the summary, the best parameters and the wall time
+### of the jobs.
+
+@instrumented()
+def search_models(filename='clean.csv', column='clean', models=None, grids=None, folds=8, workers=1,
+                  scoring='sensitivity', directory='CV Features', results='cv_results.csv', previous=None, seed=0):
+    models = list(model_zoo) if models is None else models
+    grids = {} if grids is None else grids
+
+    data = pd.read_csv(filename, usecols=['injury_report', column]).dropna()
+    data = data[data['injury_report'].astype(str) != 'x']
+    labels = data['injury_report'].astype(float).astype(int).values
+
+    with stage('fold features', rows_in=data.shape[0]):
+        train_rows = build_fold_features(data[column].values, labels,
+                                         list(dict.fromkeys(_feature_type(name) for name in models)), folds, directory,
+                                         seed)
+
+    jobs, costs = [], []
+    for name in models:
+        for params in parameter_grid(grids.get(name, model_zoo[name][1])):
+            for fold in range(folds):
+                jobs.append((name, params, fold, seed))
+                costs.append(estimate_cost(name, params, train_rows[fold], previous))
+
+    with stage('jobs', rows_in=len(jobs)):
+        table, wall_time = run_jobs(jobs, costs, directory, workers)
+
+    table = pd.DataFrame(table)
+    if results is not None:
+        table.to_csv(results, index=False)
+    summary, best = summarize_results(table, scoring)
+    current_stage().rows(rows_in=data.shape[0], rows_out=len(jobs))
+
+    print(len(jobs), 'jobs on', workers, 'workers in %.2fs (%.2fs of fitting)' % (wall_time, table['seconds'].sum()))
+    print(results_table(best))
+    return table, summary, best, wall_time
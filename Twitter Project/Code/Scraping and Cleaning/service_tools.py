@@ -0,0 +1,312 @@
+"""
+Service Tools
+
+Holds a long-running local scoring service for the classical injury classifiers. The models and vectorizers are loaded
+once, tweets sent by many callers are grouped into micro-batches, and every batch is cleaned and scored together. Also
+holds a load test which drives the service with a local client.
+"""
+
+import json
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cleaning_tools import get_text_cleaner
+from model_tools import ModelRegistry
+
+### HELPER FUNCTIONS
+
+### percentile()
+###
+### Nearest-rank percentile of a list of numbers.
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+### ClassicalScorer
+###
+### Scores a batch of raw tweets with a set of models from a ModelRegistry: the tweets are cleaned with clean_text(),
+### each vectorizer transforms the batch once, and every model gives a label and (where the model supports it) the
+### probability of class 1.
+
+class ClassicalScorer:
+
+    def __init__(self, registry=None, models=('logistic_regression', 'svm')):
+        self.models = list(models)
+        self.registry = ModelRegistry('Classical Models', self.models) if registry is None else registry
+        self.cleaner = get_text_cleaner()
+
+    def score(self, tweets):
+        clean = self.cleaner.clean_many(tweets)
+        features = self.registry.transform(clean, self.models)
+        predictions = self.registry.predict(clean, self.models, features)
+
+        probabilities = {}
+        for name in self.models:
+            try:
+                probabilities[name] = self.registry.predict_proba(clean, name, features)
+            except AttributeError:  # e.g. an SVC trained without probability=True
+                probabilities[name] = None
+
+        return [{name: {'label': int(predictions[name][i]),
+                        'probability': None if probabilities[name] is None else float(probabilities[name][i])}
+                 for name in self.models}
+                for i in range(len(tweets))]
+
+### MicroBatcher
+###
+### Collects tweets submitted from many threads into batches for a scoring function. A batch is sent once it holds
+### max_batch_size tweets or max_wait seconds have passed since its first request arrived, whichever comes first.
+### submit() blocks until the caller's tweets have been scored.
+###
+### Latency of the last few thousand requests, and the number of tweets and batches scored, are kept for metrics().
+
+class _Request:
+
+    def __init__(self, tweets):
+        self.tweets = tweets
+        self.submitted = time.perf_counter()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+class MicroBatcher:
+
+    def __init__(self, score_batch, max_batch_size=64, max_wait=0.01, history=10000):
+        self.score_batch = score_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.latencies = deque(maxlen=history)
+        self.batch_sizes = deque(maxlen=history)
+        self.tweets_scored = 0
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, tweets):
+        request = _Request(list(tweets))
+        self.requests.put(request)
+        request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        size = len(batch[0].tweets)
+        deadline = time.perf_counter() + self.max_wait
+
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size = size + len(request.tweets)
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            tweets = [tweet for request in batch for tweet in request.tweets]
+
+            try:
+                results = self.score_batch(tweets)
+            except Exception as error:
+                results = None
+                for request in batch:
+                    request.error = error
+
+            position = 0
+            finished = time.perf_counter()
+            for request in batch:
+                if results is not None:
+                    request.results = results[position:position + len(request.tweets)]
+                    position = position + len(request.tweets)
+                with self.lock:
+                    self.latencies.append(finished - request.submitted)
+                request.done.set()
+
+            with self.lock:
+                self.batch_sizes.append(len(tweets))
+                self.tweets_scored = self.tweets_scored + len(tweets)
+
+    def metrics(self):
+        with self.lock:
+            latencies = list(self.latencies)
+            batch_sizes = list(self.batch_sizes)
+            tweets_scored = self.tweets_scored
+
+        elapsed = time.perf_counter() - self.started
+        return {'requests': len(latencies), 'tweets_scored': tweets_scored,
+                'p50_latency_ms': 1000 * percentile(latencies, 0.5),
+                'p99_latency_ms': 1000 * percentile(latencies, 0.99),
+                'mean_batch_size': sum(batch_sizes) / len(batch_sizes) if batch_sizes else 0.0,
+                'tweets_per_sec': tweets_scored / elapsed if elapsed > 0 else 0.0}
+
+### SERVICE
+###
+### The service speaks JSON over HTTP:
+###
+###     POST /score     {"tweets": ["...", ...]}  ->  {"results": [{"logistic_regression": {"label": 1,
+###                                                                                       "probability": 0.93}, ...}]}
+###     GET /metrics    latency percentiles, mean batch size and throughput since the service started.
+###
+### A body which is not a JSON object holding a list of strings under "tweets" gets a 400, and an empty list is answered
+### with no results without waiting on the batcher.
+
+def _make_handler(batcher):
+
+    class ScoringHandler(BaseHTTPRequestHandler):
+
+        def _send(self, status, body):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._send(200, batcher.metrics())
+            else:
+                self._send(404, {'error': 'unknown path'})
+
+        def do_POST(self):
+            if self.path != '/score':
+                self._send(404, {'error': 'unknown path'})
+                return
+
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                if not isinstance(body, dict) or 'tweets' not in body:
+                    raise ValueError('body must be a JSON object with a "tweets" list')
+                tweets = body['tweets']
+                if not isinstance(tweets, list) or not all(isinstance(tweet, str) for tweet in tweets):
+                    raise ValueError('tweets must be a list of strings')
+            except ValueError as error:
+                self._send(400, {'error': str(error)})
+                return
+
+            if not tweets:
+                self._send(200, {'results': []})
+                return
+
+            try:
+                self._send(200, {'results': batcher.submit(tweets)})
+            except Exception as error:
+                self._send(500, {'error': str(error)})
+
+        def log_message(self, format, *args):  # keep the console quiet under load
+            pass
+
+    return ScoringHandler
+
+### make_server()
+###
+### Builds (but does not start) the scoring server. score_batch defaults to a ClassicalScorer over the
+### logistic_regression and svm models.
+
+def make_server(host='127.0.0.1', port=8765, max_batch_size=64, max_wait=0.01, score_batch=None):
+    if score_batch is None:
+        score_batch = ClassicalScorer().score
+
+    batcher = MicroBatcher(score_batch, max_batch_size, max_wait)
+    server = ThreadingHTTPServer((host, port), _make_handler(batcher))
+    server.batcher = batcher
+    return server
+
+### serve()
+###
+### Runs the scoring service until interrupted.
+
+def serve(host='127.0.0.1', port=8765, max_batch_size=64, max_wait=0.01):
+    server = make_server(host, port, max_batch_size, max_wait)
+    print('scoring service listening on http://%s:%d' % (host, port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+### LOAD TEST
+
+### score_tweets()
+###
+### Client for the service: sends a list of tweets and returns the results.
+
+def score_tweets(tweets, url='http://127.0.0.1:8765'):
+    request = urllib.request.Request(url + '/score', data=json.dumps({'tweets': tweets}).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())['results']
+
+def get_metrics(url='http://127.0.0.1:8765'):
+    with urllib.request.urlopen(url + '/metrics') as response:
+        return json.loads(response.read())
+
+### load_test()
+###
+### Sends requests_per_client requests of tweets_per_request tweets from each of a number of concurrent clients, cycling
+### through the given tweets. Prints the client-side latency percentiles and throughput along with the service's own
+### metrics, and returns both.
+
+def load_test(tweets, url='http://127.0.0.1:8765', clients=16, requests_per_client=50, tweets_per_request=1):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(number):
+        for i in range(requests_per_client):
+            start = (number * requests_per_client + i) * tweets_per_request
+            batch = [tweets[(start + j) % len(tweets)] for j in range(tweets_per_request)]
+            began = time.perf_counter()
+            try:
+                score_tweets(batch, url)
+            except Exception as error:
+                with lock:
+                    errors.append(error)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - began)
+
+    began = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    results = {'clients': clients, 'requests': len(latencies), 'errors': len(errors),
+               'p50_latency_ms': 1000 * percentile(latencies, 0.5), 'p99_latency_ms': 1000 * percentile(latencies, 0.99),
+               'tweets_per_sec': len(latencies) * tweets_per_request / elapsed, 'service': get_metrics(url)}
+
+    print('load test: %d clients, %d requests, %d errors' % (clients, len(latencies), len(errors)))
+    print('    client p50 %.1f ms, p99 %.1f ms, %.0f tweets/sec'
+          % (results['p50_latency_ms'], results['p99_latency_ms'], results['tweets_per_sec']))
+    print('    service p50 %.1f ms, p99 %.1f ms, mean batch %.1f tweets'
+          % (results['service']['p50_latency_ms'], results['service']['p99_latency_ms'],
+             results['service']['mean_batch_size']))
+
+    return results
+
+if __name__ == '__main__':
+    serve()
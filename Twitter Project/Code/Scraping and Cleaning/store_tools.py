@@ -0,0 +1,254 @@
+"""
+Store Tools
+
+Holds the TweetStore, an SQLite database which replaces rewriting filtered2.csv on every run. Tweets are keyed on
+(link, tweet) so new scrapes are upserted into it and labels are applied with indexed updates. filtered2.csv and
+clean.csv can still be exported from it for the notebooks.
+"""
+
+import os
+import sqlite3
+import pandas as pd
+
+from cleaning_tools import reduce_merged, merged_columns, merged_dtypes, merged_aggregates, filtered_to_clean
+from dataset_tools import _label
+from instrument_tools import instrumented, current_stage
+
+### filtered_columns
+###
+### The columns of filtered2.csv, in the order they are written by merged_to_filtered().
+
+filtered_columns = ['tweet', 'link', 'replies_count', 'retweets_count', 'likes_count', 'link_present',
+                    'photo_present', 'retweet', 'injury_report']
+
+### TweetStore
+###
+### Wrapper around the tweets database. The 'tweets' table holds one row per (link, tweet) with the same columns as
+### filtered2.csv, indexed on the tweet text and on injury_report. The 'ingested_files' table records every scrape file
+### already loaded along with its size and modification time, so that running ingest() over the whole TweetData folder
+### only reads the files which are new or have changed since the last run.
+
+class TweetStore:
+
+    def __init__(self, database='tweets.db'):
+        self.database = database
+        self.connection = sqlite3.connect(database)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+
+        with self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS tweets (
+                                           link TEXT NOT NULL,
+                                           tweet TEXT NOT NULL,
+                                           replies_count INTEGER,
+                                           retweets_count INTEGER,
+                                           likes_count INTEGER,
+                                           link_present INTEGER,
+                                           photo_present INTEGER,
+                                           retweet INTEGER,
+                                           injury_report TEXT NOT NULL DEFAULT 'x',
+                                           PRIMARY KEY (link, tweet))''')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS tweets_tweet ON tweets (tweet)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS tweets_injury_report ON tweets (injury_report)')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS ingested_files (
+                                           filename TEXT PRIMARY KEY,
+                                           size INTEGER,
+                                           modified REAL)''')
+
+    def close(self):
+        self.connection.close()
+
+    ### upsert()
+    ###
+    ### Inserts aggregated rows (the output of aggregate_merged()) or updates the rows already stored with the max of the
+    ### old and new counts. New rows are unlabeled until label_duplicates() is run.
+
+    def upsert(self, data):
+        rows = data[['link', 'tweet'] + list(merged_aggregates)].itertuples(index=False, name=None)
+
+        with self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany('''
+                INSERT INTO tweets (link, tweet, replies_count, retweets_count, likes_count, link_present,
+                                    photo_present, retweet)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (link, tweet) DO UPDATE SET
+                    replies_count = MAX(replies_count, excluded.replies_count),
+                    retweets_count = MAX(retweets_count, excluded.retweets_count),
+                    likes_count = MAX(likes_count, excluded.likes_count),
+                    link_present = MAX(link_present, excluded.link_present),
+                    photo_present = MAX(photo_present, excluded.photo_present),
+                    retweet = MAX(retweet, excluded.retweet)''', _python_rows(rows))
+            return self.connection.total_changes - before
+
+    ### ingest()
+    ###
+    ### Reads raw twint csv files (TweetData files or merged files) chunksize rows at a time, reduces each chunk with the
+    ### same groupby max as aggregate_merged() and upserts it. Files already ingested with the same size and modification
+    ### time are skipped. Afterwards new rows are labeled with label_duplicates(), the same way merged_to_filtered()
+    ### labels them with append_labels(). Returns the number of files read.
+
+    @instrumented('ingest')
+    def ingest(self, files, chunksize=250000):
+        ingested = 0
+        rows = 0
+
+        for file in files:
+            size, modified = os.path.getsize(file), os.path.getmtime(file)
+            previous = self.connection.execute('SELECT size, modified FROM ingested_files WHERE filename = ?',
+                                               (os.path.abspath(file),)).fetchone()
+            if previous == (size, modified):
+                continue
+
+            for chunk in pd.read_csv(file, usecols=merged_columns, dtype=merged_dtypes, chunksize=chunksize):
+                reduced = reduce_merged(chunk).reset_index()
+                self.upsert(reduced)
+                rows = rows + chunk.shape[0]
+
+            with self.connection:
+                self.connection.execute('INSERT OR REPLACE INTO ingested_files VALUES (?, ?, ?)',
+                                        (os.path.abspath(file), size, modified))
+            ingested = ingested + 1
+
+        if ingested:
+            self.label_duplicates()
+
+        current_stage().rows(rows_in=rows)
+        return ingested
+
+    ### import_filtered()
+    ###
+    ### Loads an existing filtered2.csv into the store, keeping its labels. Used once to move over to the store.
+
+    def import_filtered(self, filename='filtered2.csv', chunksize=250000):
+        for chunk in pd.read_csv(filename, chunksize=chunksize):
+            rows = chunk[['link', 'tweet'] + list(merged_aggregates) + ['injury_report']].dropna(subset=['link', 'tweet'])
+
+            with self.connection:
+                self.connection.executemany('''
+                    INSERT INTO tweets (link, tweet, replies_count, retweets_count, likes_count, link_present,
+                                        photo_present, retweet, injury_report)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (link, tweet) DO UPDATE SET
+                        replies_count = MAX(replies_count, excluded.replies_count),
+                        retweets_count = MAX(retweets_count, excluded.retweets_count),
+                        likes_count = MAX(likes_count, excluded.likes_count),
+                        link_present = MAX(link_present, excluded.link_present),
+                        photo_present = MAX(photo_present, excluded.photo_present),
+                        retweet = MAX(retweet, excluded.retweet),
+                        injury_report = excluded.injury_report''',
+                                            _python_rows(rows.itertuples(index=False, name=None)))
+
+    ### append_labels()
+    ###
+    ### Store version of cleaning_tools.append_labels(). Takes a labeled csv file (or a DataFrame with 'injury_report' and
+    ### 'tweet' columns) and sets the label of every stored row with the same tweet text using the index on tweet,
+    ### instead of merging the labels onto the whole of filtered2.csv. Returns the number of rows changed.
+
+    def append_labels(self, file):
+        labeled = file if isinstance(file, pd.DataFrame) else pd.read_csv(file)
+        labeled = labeled[['injury_report', 'tweet']]
+        labeled = labeled[labeled['injury_report'] != 'x']
+        labeled = labeled.drop_duplicates()
+        labeled = labeled.dropna()
+
+        with self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany('UPDATE tweets SET injury_report = ? WHERE tweet = ? AND injury_report != ?',
+                                        ((_label(label), tweet, _label(label))
+                                         for label, tweet in labeled.itertuples(index=False, name=None)))
+            return self.connection.total_changes - before
+
+    ### label_duplicates()
+    ###
+    ### Store version of label_filtered_duplicates(). Gives unlabeled rows the label of a labeled row with the same tweet
+    ### text, one indexed update per labeled tweet. Returns the number of rows changed.
+
+    def label_duplicates(self):
+        labeled = self.connection.execute("""SELECT MIN(injury_report), tweet FROM tweets WHERE injury_report != 'x'
+                                             GROUP BY tweet""").fetchall()
+
+        with self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany("UPDATE tweets SET injury_report = ? WHERE tweet = ? AND injury_report = 'x'",
+                                        labeled)
+            return self.connection.total_changes - before
+
+    ### read()
+    ###
+    ### Returns the given columns of the stored tweets as a DataFrame. labeled=True gives only the labeled rows,
+    ### labeled=False only the unlabeled ones and labeled=None everything. With chunksize an iterator of DataFrames is
+    ### returned instead.
+
+    def read(self, columns=None, labeled=None, chunksize=None):
+        columns = filtered_columns if columns is None else columns
+        query = 'SELECT ' + ', '.join(columns) + ' FROM tweets'
+
+        if labeled is True:
+            query = query + " WHERE injury_report != 'x'"
+        elif labeled is False:
+            query = query + " WHERE injury_report = 'x'"
+
+        return pd.read_sql_query(query, self.connection, chunksize=chunksize)
+
+    ### export_filtered()
+    ###
+    ### Writes the store out in the format of filtered2.csv, a chunk at a time.
+
+    def export_filtered(self, filename='filtered2.csv', chunksize=250000):
+        header = True
+
+        for chunk in self.read(chunksize=chunksize):
+            chunk.to_csv(filename, mode='w' if header else 'a', header=header, index=False)
+            header = False
+
+        if header:
+            pd.DataFrame(columns=filtered_columns).to_csv(filename, index=False)
+
+    ### export_clean()
+    ###
+    ### Builds clean.csv from the labeled rows of the store with filtered_to_clean(), without going through
+    ### filtered2.csv.
+
+    def export_clean(self):
+        filtered_to_clean(self.read(['injury_report', 'tweet'], labeled=True))
+
+### HELPER FUNCTIONS
+
+### _python_rows()
+###
+### sqlite3 cannot bind numpy integers, so rows coming from pandas are converted to plain python values.
+
+def _python_rows(rows):
+    for row in rows:
+        yield tuple(value.item() if hasattr(value, 'item') else value for value in row)
+
+### PIPELINE FUNCTIONS
+###
+### Store versions of merged_to_filtered(), label_new_data() and label_filtered_duplicates().
+
+### scrape_to_store()
+###
+### Upserts every new or changed file in the TweetData folder (and any merged files given) into the store.
+
+def scrape_to_store(database='tweets.db', files=None):
+    if files is None:
+        files = [os.path.join('TweetData', filename) for filename in os.listdir('TweetData')
+                 if os.path.isfile(os.path.join('TweetData', filename))]
+
+    store = TweetStore(database)
+    try:
+        return store.ingest(files)
+    finally:
+        store.close()
+
+### label_store()
+###
+### Applies the sampled.csv and positive_samples.csv labels from get_data_to_label() to the store.
+
+def label_store(database='tweets.db', files=('sampled.csv', 'positive_samples.csv')):
+    store = TweetStore(database)
+    try:
+        return {file: store.append_labels(file) for file in files}
+    finally:
+        store.close()
@@ -0,0 +1,215 @@
+"""
+Synthetic Tools
+
+Generates made up tweets and twint-shaped scrape files for the benchmark suite, so cleaning_tools and scraping_tools can
+be timed at any size (10 thousand to 10 million rows) without the real TweetData folder. Tweets are built from
+templates with the things the cleaning functions handle: handles, hyperlinks, emojis, phone numbers, dates, years,
+times, contractions, hashtags, ampersands and player names. Scrape files repeat tweets across scrape days with growing
+counts, the same way rescraping an account does.
+
+Everything is generated from a seed, so the same seed and size always give the same files.
+"""
+
+import os
+import random
+import string
+import pandas as pd
+
+### twint_columns
+###
+### The columns of a csv file written by twint's Store_csv.
+
+twint_columns = ['id', 'conversation_id', 'created_at', 'date', 'time', 'timezone', 'user_id', 'username', 'name',
+                 'place', 'tweet', 'language', 'mentions', 'urls', 'photos', 'replies_count', 'retweets_count',
+                 'likes_count', 'hashtags', 'cashtags', 'link', 'retweet', 'quote_url', 'video', 'thumbnail', 'near',
+                 'geo', 'source', 'user_rt_id', 'user_rt', 'retweet_id', 'reply_to', 'retweet_date', 'translate',
+                 'trans_src', 'trans_dest']
+
+### player_names, teams, handles
+###
+### Names used to fill the templates. player_names are lowercase, as get_player_names() gives them, so they can be
+### passed straight to build_player_name_replacer() without downloading the pybaseball lists.
+
+player_names = ['mike trout', 'aaron judge', 'mookie betts', 'shohei ohtani', 'fernando tatis', 'jacob degrom',
+                'gerrit cole', 'clayton kershaw', 'bryce harper', 'juan soto', 'ronald acuna', 'max scherzer',
+                'freddie freeman', 'nolan arenado', 'christian yelich', 'cody bellinger', 'jose altuve',
+                'justin verlander', 'chris sale', 'giancarlo stanton', 'luis severino', 'carlos correa',
+                'francisco lindor', 'pete alonso', 'walker buehler', 'corey seager', 'trevor story', 'tim anderson',
+                'byron buxton', 'stephen strasburg']
+
+teams = ['Yankees', 'RedSox', 'Dodgers', 'Mets', 'Cubs', 'Astros', 'Braves', 'Padres', 'Giants', 'Phillies', 'Rays',
+         'BlueJays', 'Twins', 'WhiteSox', 'Brewers', 'Cardinals']
+
+handles = ['MLB', 'espn', 'JeffPassan', 'Ken_Rosenthal', 'BNightengale', 'MLBNetwork', 'TheAthletic', 'InsideInjuries',
+           'FanGraphs', 'rotoworld_bb', 'JonHeyman', 'Buster_ESPN']
+
+injuries = ['a hamstring strain', 'right elbow inflammation', 'a sprained ankle', 'left shoulder soreness',
+            'a fractured wrist', 'a calf strain', 'lower back tightness', 'a concussion', 'an oblique strain',
+            'tommy john surgery']
+
+emojis = ['\U0001F602', '\U0001F525', '\U0001F62D', '⚾', '\U0001F64F', '\U0001F44F', '\U0001F6A8', '❤️',
+          '\U0001F4AA', '\U0001F3C6']
+
+contractions = ["can't", "won't", "he's", "isn't", "didn't", "it's", "that's", "we're", "they'll", "doesn't"]
+
+injury_templates = ['{player} has been placed on the 10-day IL with {injury}.',
+                    "{player} left tonight's game with {injury} and {contraction} expected back soon.",
+                    '{player} is day-to-day with {injury}, per {handle}.',
+                    '{Player} will undergo an MRI on {injury} {date} - {team} manager says it {contraction} good.',
+                    '{team} transfer {player} to the 60-day IL ({injury}).',
+                    '{Player} exits in the {inning} inning w/ {injury}.']
+
+other_templates = ['{player} hits a {runs}-run homer for the {team}!',
+                   '{Player} strikes out {runs} over {inning} innings &amp; the {team} win {score}.',
+                   "Tonight's lineup for the {team}: {player} leads off, first pitch at {clock}.",
+                   '{player} has reached base in {runs} straight games. {contraction} ridiculous.',
+                   'Tickets for {team} vs {other} on {date} are on sale now, call {phone}.',
+                   'Final: {team} {score} {other}. {player} goes {runs}-for-4.',
+                   'Throwback to {player} in {year}, still the best season {contraction} seen.']
+
+### HELPER FUNCTIONS
+
+def _link(state):
+    return 'https://t.co/' + ''.join(state.choice(string.ascii_letters + string.digits) for _ in range(10))
+
+def _phone(state):
+    digits = [str(state.randrange(10)) for _ in range(10)]
+    pattern = state.choice(['{0}{1}{2}-{3}{4}{5}-{6}{7}{8}{9}', '({0}{1}{2}){3}{4}{5}-{6}{7}{8}{9}',
+                            '{0}{1}{2}.{3}{4}{5}.{6}{7}{8}{9}'])
+    return pattern.format(*digits)
+
+### synthetic_tweet()
+###
+### One made up tweet and its label (1 for an injury report, 0 otherwise). About one in six tweets is an injury report,
+### and handles, hashtags, emojis and hyperlinks are added at random around the template.
+
+def synthetic_tweet(state):
+    injury = state.random() < 1 / 6
+    template = state.choice(injury_templates if injury else other_templates)
+    player = state.choice(player_names)
+    team, other = state.sample(teams, 2)
+
+    text = template.format(player=player, Player=player.title(), injury=state.choice(injuries),
+                           handle='@' + state.choice(handles), team=team, other=other,
+                           contraction=state.choice(contractions), inning=state.choice(['3rd', '5th', '7th', '9th']),
+                           runs=state.randrange(2, 12), score='%d-%d' % (state.randrange(10), state.randrange(10)),
+                           clock='%d:%02d%s' % (state.randrange(1, 12), state.choice([5, 10, 35, 40]),
+                                                state.choice(['pm', 'am', ''])),
+                           date=' %d/%d/%d ' % (state.randrange(1, 13), state.randrange(1, 29),
+                                                state.choice([21, 2021])),
+                           phone=_phone(state), year=' %d ' % state.randrange(2000, 2022))
+
+    if state.random() < 0.3:
+        text = '@' + state.choice(handles) + ' ' + text
+    if state.random() < 0.3:
+        text = text + ' #' + team
+    if state.random() < 0.25:
+        text = text + ' ' + state.choice(emojis) * state.randrange(1, 4)
+    if state.random() < 0.4:
+        text = text + '  ' + _link(state)
+
+    return text, int(injury)
+
+### synthetic_tweets()
+###
+### count made up tweets and their labels.
+
+def synthetic_tweets(count, seed=0):
+    state = random.Random(seed)
+    tweets = [synthetic_tweet(state) for _ in range(count)]
+    return [tweet for tweet, label in tweets], [label for tweet, label in tweets]
+
+### synthetic_labeled()
+###
+### A labeled dataset in the format of filtered2.csv's injury_report and tweet columns, with unlabeled rows marked 'x'
+### and a share of tweets repeated, since filtered2 holds the same text under several links.
+
+def synthetic_labeled(count, labeled_fraction=0.3, repeat_fraction=0.1, seed=0):
+    state = random.Random(seed)
+    tweets, labels = synthetic_tweets(count, seed)
+
+    for i in range(int(count * repeat_fraction)):
+        j = state.randrange(count)
+        tweets[i], labels[i] = tweets[j], labels[j]
+
+    injury_report = [str(label) if state.random() < labeled_fraction else 'x' for label in labels]
+    return pd.DataFrame({'injury_report': injury_report, 'tweet': tweets})
+
+### synthetic_scrape()
+###
+### A DataFrame of rows scraped tweets in twint's csv format, with ids from first_id upwards.
+
+def synthetic_scrape(rows, first_id=0, scrape_date='2021-08-01', seed=0):
+    state = random.Random(seed)
+    tweets, _ = synthetic_tweets(rows, seed)
+    ids = list(range(first_id, first_id + rows))
+    users = [state.choice(handles) for _ in range(rows)]
+    urls = [state.choice(['[]', '[]', '[]', "['" + _link(state) + "']"]) for _ in range(rows)]
+    photos = [state.choice(['[]', '[]', '[]', '[]', "['https://pbs.twimg.com/media/" + str(i) + ".jpg']"])
+              for i in ids]
+
+    data = pd.DataFrame({'id': ids, 'conversation_id': ids, 'created_at': scrape_date + ' 12:00:00 EDT',
+                         'date': scrape_date, 'time': '12:00:00', 'timezone': '-0400',
+                         'user_id': [handles.index(user) + 1000 for user in users],
+                         'username': [user.lower() for user in users],
+                         'name': users, 'place': '', 'tweet': tweets, 'language': 'en', 'mentions': '[]',
+                         'urls': urls, 'photos': photos,
+                         'replies_count': [state.randrange(50) for _ in range(rows)],
+                         'retweets_count': [state.randrange(200) for _ in range(rows)],
+                         'likes_count': [state.randrange(2000) for _ in range(rows)],
+                         'hashtags': '[]', 'cashtags': '[]',
+                         'link': ['https://twitter.com/' + user + '/status/' + str(i) for user, i in zip(users, ids)],
+                         'retweet': [state.random() < 0.2 for _ in range(rows)],
+                         'quote_url': '', 'video': 0, 'thumbnail': '', 'near': '', 'geo': '', 'source': '',
+                         'user_rt_id': '', 'user_rt': '', 'retweet_id': '', 'reply_to': '[]', 'retweet_date': '',
+                         'translate': '', 'trans_src': '', 'trans_dest': ''})
+    return data[twint_columns]
+
+### write_synthetic_scrapes()
+###
+### Writes rows scraped tweets as 'merged (file number) (date).csv' files in directory, spread over `days` scrape dates,
+### and returns their paths. Files are numbered from 1 within each scrape date, as scrape_to_merge() numbers them. After
+### the first file, a duplicate_fraction of every file is tweets seen before (same id, link and text) rescraped with
+### higher counts, so aggregate_merged() has the same kind of duplicates to reduce as the real scrapes. The rescraped
+### tweets are drawn from a sample of at most pool_size earlier rows, and files are written rows_per_file rows at a
+### time, so 10 million rows never have to fit in memory.
+
+def write_synthetic_scrapes(directory, rows, days=3, duplicate_fraction=0.3, rows_per_file=250000, pool_size=100000,
+                            seed=0):
+    os.makedirs(directory, exist_ok=True)
+    state = random.Random(seed)
+    files = []
+    pool = None
+    next_id = 0
+    per_day = rows // days
+
+    for day in range(days):
+        scrape_date = '2021-8-%d' % (day + 1)
+        remaining = per_day if day < days - 1 else rows - per_day * (days - 1)
+        part = 1
+
+        while remaining > 0:
+            size = min(rows_per_file, remaining)
+            repeats = min(int(size * duplicate_fraction), len(pool)) if pool is not None else 0
+            data = synthetic_scrape(size - repeats, next_id, scrape_date, state.randrange(2 ** 32))
+            next_id = next_id + size - repeats
+
+            if repeats:
+                rescraped = pool.sample(repeats, random_state=state.randrange(2 ** 32)).copy()
+                for column in ['replies_count', 'retweets_count', 'likes_count']:
+                    rescraped[column] = rescraped[column] + [state.randrange(20) for _ in range(repeats)]
+                rescraped['date'] = scrape_date
+                data = pd.concat([data, rescraped])
+
+            sample = data.sample(min(len(data), pool_size), random_state=state.randrange(2 ** 32))
+            pool = sample if pool is None else pd.concat([pool, sample])
+            if len(pool) > pool_size:
+                pool = pool.sample(pool_size, random_state=state.randrange(2 ** 32))
+
+            filename = os.path.join(directory, 'merged %d %s.csv' % (part, scrape_date))
+            data.to_csv(filename, index=False)
+            files.append(filename)
+            part = part + 1
+            remaining = remaining - size
+
+    return files
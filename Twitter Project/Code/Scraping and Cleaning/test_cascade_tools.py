@@ -0,0 +1,24 @@
+"""
+Cascade Tools Tests
+
+Checks that band_sweep() sends the same tweets to the deep model as in_band(), which Cascade.score() uses, including
+probabilities on the edge of a band.
+"""
+
+import numpy as np
+import pytest
+
+cascade_tools = pytest.importorskip('cascade_tools')
+
+### TESTS
+
+def test_band_sweep_matches_in_band_on_edges():
+    probabilities = np.array([0.2, 0.8, 0.5, 0.19, 0.81, 0.45, 0.55, 0.4])
+    deep_margins = np.ones(len(probabilities))
+    labels = np.ones(len(probabilities), dtype=int)
+    widths = (0, 0.05, 0.1, 0.3)
+
+    sweep = cascade_tools.band_sweep(probabilities, deep_margins, labels, widths)
+
+    assert sweep['deep_fraction'].tolist() == [cascade_tools.in_band(probabilities, width).mean() for width in widths]
+    assert sweep['deep_fraction'].tolist()[-1] == 6 / 8
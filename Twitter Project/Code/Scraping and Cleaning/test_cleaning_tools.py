@@ -0,0 +1,113 @@
+"""
+Cleaning Tools Tests
+
+Checks that the optimized cleaning and aggregation functions give the same output as the versions they replaced
+(legacy_tools), on made up tweets and scrape files from synthetic_tools.
+"""
+
+import csv
+import os
+import pandas as pd
+import pytest
+
+cleaning_tools = pytest.importorskip('cleaning_tools')
+legacy_tools = pytest.importorskip('legacy_tools')
+
+import synthetic_tools
+
+tweets, _ = synthetic_tools.synthetic_tweets(500, seed=1)
+
+### HELPER FUNCTIONS
+
+def _replacer():
+    names = synthetic_tools.player_names
+    return cleaning_tools.build_player_name_replacer(names, [name.split()[-1] for name in names])
+
+def _sorted(data):
+    return data.sort_values(['link', 'tweet']).reset_index(drop=True)
+
+# Rows as twint writes them, with the values aggregate_merged() has to cope with: empty urls / photos, '[]' and '[]]',
+# retweet as True / False and as text, and counts left empty in some copies of a tweet.
+merged_header = ['id', 'date', 'link', 'tweet', 'replies_count', 'retweets_count', 'likes_count', 'urls', 'photos',
+                 'retweet']
+merged_rows = [['1', '2021-05-01', 'https://twitter.com/a/status/1', 'Trout (calf) out', '1', '2', '3', '[]', '[]',
+                'False'],
+               ['1', '2021-05-02', 'https://twitter.com/a/status/1', 'Trout (calf) out', '', '5', '4', '[]', '[]',
+                'False'],
+               ['2', '2021-05-01', 'https://twitter.com/b/status/2', 'Judge on the IL', '0', '1', '0', '',
+                "['https://pbs.twimg.com/a.jpg']", 'True'],
+               ['3', '2021-05-01', 'https://twitter.com/c/status/3', 'go team', '7', '0', '', '[]]', '', 'false'],
+               ['3', '2021-05-03', 'https://twitter.com/c/status/3', 'go team', '2', '9', '1',
+                "['https://t.co/x']", '[]]', '0'],
+               ['4', '2021-05-02', 'https://twitter.com/d/status/4', 'Kershaw back', '0', '0', '0', '', '', '']]
+
+def _write_merged(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(merged_header)
+        writer.writerows(rows)
+    return path
+
+### TESTS
+
+def test_tweet_normalizer_matches_legacy():
+    assert cleaning_tools.tweet_normalizer.normalize_many(tweets) == \
+        [legacy_tools.cleaning_function_part_1(tweet) for tweet in tweets]
+
+def test_text_cleaner_matches_legacy():
+    cleaner = cleaning_tools.TextCleaner()
+    normalized = cleaning_tools.tweet_normalizer.normalize_many(tweets)
+
+    assert cleaner.clean_many(tweets) == [legacy_tools.clean_text(tweet) for tweet in tweets]
+    assert cleaner.clean_part_2_many(normalized) == [legacy_tools.cleaning_function_part_2(x) for x in normalized]
+
+def test_parallel_cleaning_matches_one_worker():
+    replacer = _replacer()
+    for function, arguments in [(cleaning_tools._clean_text_batch, ()),
+                                (cleaning_tools._cleaning_total_batch, (replacer,))]:
+        assert cleaning_tools.map_in_batches(function, tweets, 2, 100, *arguments) == \
+            cleaning_tools.map_in_batches(function, tweets, 1, 100, *arguments)
+
+def test_cache_keeps_replacers_apart(tmp_path):
+    cache = cleaning_tools.open_cleaned_text_cache(str(tmp_path / 'clean_cache.db'))
+    replacer = _replacer()
+    names = synthetic_tools.player_names[:3]
+    other = cleaning_tools.build_player_name_replacer(names, [name.split()[-1] for name in names])
+
+    for entry in [replacer, other, replacer]:
+        assert cleaning_tools.clean_total_columns(tweets, cache, replacer=entry) == \
+            cleaning_tools.clean_total_columns(tweets, replacer=entry)
+    assert cache.hits['clean2_no_names'] == len(tweets)
+    cache.close()
+
+def test_aggregate_merged_matches_legacy(tmp_path):
+    files = [_write_merged(str(tmp_path / 'merged 1.csv'), merged_rows[:3]),
+             _write_merged(str(tmp_path / 'merged 2.csv'), merged_rows[3:] + merged_rows[:1])]
+
+    legacy = legacy_tools.aggregate_merged([legacy_tools.aggregate_merged(file, 1) for file in files], 0)
+    current = cleaning_tools.aggregate_merged([cleaning_tools.aggregate_merged(file, 1) for file in files], 0)
+
+    assert current.dtypes[['replies_count', 'link_present', 'retweet']].tolist() == ['int32', 'int8', 'int8']
+    assert current.astype(legacy.dtypes.to_dict()).equals(legacy)
+
+def test_aggregate_merged_missing_count(tmp_path):
+    row = ['5', '2021-05-04', 'https://twitter.com/e/status/5', 'no likes yet', '1', '2', '', '[]', '[]', 'False']
+    final = cleaning_tools.aggregate_merged(_write_merged(str(tmp_path / 'merged 1.csv'), [row]), 1)
+
+    assert final['likes_count'].tolist() == [0]
+
+@pytest.mark.parametrize('in_memory_rows', [0, 1500, 250000])
+def test_stream_aggregate_merged_matches_in_memory(tmp_path, in_memory_rows):
+    files = synthetic_tools.write_synthetic_scrapes(str(tmp_path / 'merged'), 3000, days=2, rows_per_file=1000)
+    in_memory = cleaning_tools.aggregate_merged([cleaning_tools.aggregate_merged(file, 1) for file in files], 0)
+    labels = pd.DataFrame({'tweet': in_memory['tweet'][::7], 'injury_report': ['1', '0'] * 100 +
+                           ['0'] * (len(in_memory['tweet'][::7]) - 200)})
+
+    output = str(tmp_path / 'filtered2.csv')
+    rows = cleaning_tools.stream_aggregate_merged(files, output, chunksize=700, partitions=4, labels=labels,
+                                                  in_memory_rows=in_memory_rows)
+    streamed = pd.read_csv(output, dtype=dict(cleaning_tools.filtered_dtypes, injury_report=str))
+    expected = cleaning_tools.append_labels(in_memory, labels)
+
+    assert rows == in_memory.shape[0]
+    assert _sorted(streamed).equals(_sorted(expected))
@@ -0,0 +1,68 @@
+"""
+Dedup Tools Tests
+
+Checks the NearDuplicateIndex on made up tweets with near-duplicates made up for some of them (a retweet prefix, a
+different hyperlink or an emoji added): copies well above threshold land in the cluster of their original,
+and an index built in two halves, saved and loaded in between, gives the same clusters as one built at once.
+"""
+
+import random
+import string
+import numpy as np
+import pytest
+
+dedup_tools = pytest.importorskip('dedup_tools')
+
+import synthetic_tools
+
+tweets = list(dict.fromkeys(synthetic_tools.synthetic_tweets(800, seed=4)[0]))
+
+### HELPER FUNCTIONS
+
+def _copies(seed, count=200):
+    state = random.Random(seed)
+    edits = [lambda x: 'RT @' + state.choice(['MLB', 'Yankees', 'Cubs', 'espn']) + ': ' + x,
+             lambda x: x + ' https://t.co/' + ''.join(state.choice(string.ascii_letters) for _ in range(10)),
+             lambda x: x + ' \U0001F602']
+    chosen = state.sample(range(len(tweets)), count)
+    return chosen, [state.choice(edits)(tweets[i]) for i in chosen]
+
+def _jaccard(first, second):
+    first, second = set(dedup_tools.tweet_shingles(first)), set(dedup_tools.tweet_shingles(second))
+    return len(first & second) / len(first | second)
+
+### TESTS
+
+def test_copies_join_their_original():
+    index = dedup_tools.NearDuplicateIndex(directory=None)
+    chosen, copies = _copies(0)
+    clusters = index.add(tweets + copies)
+
+    # MinHash only estimates the similarity, so copies close to threshold can be missed; the ones well above it cannot.
+    similar = np.array([_jaccard(tweets[i], copy) >= 0.9 for i, copy in zip(chosen, copies)])
+    found = clusters[len(tweets):] == clusters[chosen]
+
+    assert similar.sum() > 0
+    assert found[similar].all()
+    assert found.mean() >= 0.85
+
+def test_saved_index_gives_same_clusters(tmp_path):
+    everything = tweets + _copies(1)[1]
+    clusters = dedup_tools.NearDuplicateIndex(directory=None).add(everything)
+
+    half = len(everything) // 2
+    index = dedup_tools.NearDuplicateIndex(str(tmp_path))
+    index.add(everything[:half])
+    index.save()
+    index = dedup_tools.NearDuplicateIndex(str(tmp_path))
+    index.add(everything[half:])
+
+    assert np.array_equal(index.add(everything), clusters)
+
+def test_sample_keys_does_not_grow_index():
+    index = dedup_tools.NearDuplicateIndex(directory=None)
+    index.add(tweets[:100])
+    keys = index.sample_keys(tweets)
+
+    assert len(index) == len(set(index.keys)) <= 100
+    assert all(key.startswith('cluster ') for key in keys[:100])
@@ -0,0 +1,47 @@
+"""
+Evaluation Tools Tests
+
+Checks threshold_sweep() against working out the metrics one threshold at a time (legacy_tools.threshold_metrics()),
+and that evaluate_model_outputs() writes the '_fp_tweets' / '_fn_tweets' files already in the 'Model Outputs' folder
+byte for byte.
+"""
+
+import os
+import shutil
+import numpy as np
+import pytest
+
+evaluation_tools = pytest.importorskip('evaluation_tools')
+legacy_tools = pytest.importorskip('legacy_tools')
+
+here = os.path.dirname(os.path.abspath(__file__))
+model_outputs = os.path.join(here, '..', 'Model Outputs')
+test_file = os.path.join(here, '..', '..', 'Data', 'test 25-08.csv')
+
+### TESTS
+
+def test_threshold_sweep_matches_legacy():
+    _, _, logits = evaluation_tools.load_model_outputs(model_outputs)
+    labels, _ = evaluation_tools.load_test_labels(test_file)
+    margins = evaluation_tools.logit_margins(logits)
+
+    sweep = evaluation_tools.threshold_sweep(margins, labels, 41)
+    legacy = [[legacy_tools.threshold_metrics(row, labels, threshold) for threshold in sweep['thresholds']]
+              for row in margins]
+
+    for name in evaluation_tools.metric_names:
+        assert np.allclose([[entry[name] for entry in row] for row in legacy], sweep[name], equal_nan=True)
+
+def test_error_tweets_match_committed_files(tmp_path):
+    names, runs, _ = evaluation_tools.load_model_outputs(model_outputs)
+    for name, run in zip(names, runs):
+        os.makedirs(str(tmp_path / name))
+        shutil.copy(os.path.join(model_outputs, name, run + '_model_outputs.csv'), str(tmp_path / name))
+
+    evaluation_tools.evaluate_model_outputs(str(tmp_path), test_file, thresholds=41)
+
+    for name, run in zip(names, runs):
+        for kind in ['fp', 'fn']:
+            written = os.path.join(name, run + '_' + kind + '_tweets.csv')
+            with open(os.path.join(model_outputs, written), 'rb') as old, open(str(tmp_path / written), 'rb') as new:
+                assert old.read() == new.read()
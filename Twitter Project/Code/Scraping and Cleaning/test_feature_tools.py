@@ -0,0 +1,31 @@
+"""
+Feature Tools Tests
+
+Checks that every matrix a FeatureStore gives back (first built, updated for new texts, or memory-mapped once saved) is
+the same as transforming the texts with the vectorizer directly.
+"""
+
+import pytest
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+
+feature_tools = pytest.importorskip('feature_tools')
+
+import synthetic_tools
+
+### TESTS
+
+@pytest.mark.parametrize('vectorizer_type', [TfidfVectorizer, CountVectorizer])
+def test_feature_store_matches_transform(tmp_path, vectorizer_type):
+    texts, _ = synthetic_tools.synthetic_tweets(600, seed=3)
+    vectorizer = vectorizer_type().fit(texts)
+    store = feature_tools.FeatureStore(str(tmp_path))
+    expected = vectorizer.transform(texts)
+
+    built = store.matrix('test', 'features', texts[:550], vectorizer)
+    updated = store.matrix('test', 'features', texts, vectorizer)
+    loaded = store.matrix('test', 'features', texts, vectorizer)
+
+    assert (built != vectorizer.transform(texts[:550])).nnz == 0
+    assert (updated != expected).nnz == 0
+    assert (loaded != expected).nnz == 0
+    assert store.reused['features'] > 0
@@ -0,0 +1,44 @@
+"""
+Label Tools Tests
+
+Checks that propagate_labels() gives the same labels as the merges append_labels() used to do (legacy_tools), on a
+made up filtered2 from synthetic_tools.
+"""
+
+import random
+import pandas as pd
+import pytest
+
+legacy_tools = pytest.importorskip('legacy_tools')
+
+import dataset_tools
+import label_tools
+import synthetic_tools
+
+### HELPER FUNCTIONS
+
+def _label_file(tweets, count, state):
+    chosen = tweets.sample(count, random_state=state.randrange(2 ** 32))
+    return pd.DataFrame({'injury_report': [state.choice(['0', '1']) for _ in range(count)], 'tweet': chosen.values})
+
+### TESTS
+
+def test_propagate_labels_matches_legacy_merges():
+    data = synthetic_tools.synthetic_labeled(2000, seed=2)
+    tweets = data['tweet'].drop_duplicates()
+    state = random.Random(0)
+    sources = [('positive_samples.csv', _label_file(tweets, 300, state)),
+               ('sampled.csv', _label_file(tweets, 300, state))]
+
+    expected = legacy_tools.append_labels(legacy_tools.append_labels(data.copy(), sources[1][1]), sources[0][1])
+    labeled, changed = label_tools.propagate_labels(data.copy(), sources, normalize=None)
+
+    assert expected['injury_report'].map(dataset_tools._label).equals(labeled['injury_report'])
+    assert sum(changed.values()) > 0
+
+def test_fill_only_keeps_existing_labels():
+    data = pd.DataFrame({'injury_report': ['1', 'x', 'x', '0'], 'tweet': ['a', 'a', 'b', 'b']})
+    filled, changed = label_tools.propagate_labels(data.copy(), [('duplicates', data.copy())], fill_only=True)
+
+    assert filled['injury_report'].tolist() == ['1', '1', '0', '0']
+    assert changed['duplicates'] == 2
@@ -0,0 +1,37 @@
+"""
+Online Tools Tests
+
+Checks that a HashedVectorizer only has its fitted attributes after fit() / partial_fit(), and that
+update_online_models() on a filtered2 without rows trains nothing instead of failing.
+"""
+
+import pandas as pd
+import pytest
+from sklearn.base import clone
+from sklearn.exceptions import NotFittedError
+
+online_tools = pytest.importorskip('online_tools')
+
+from dataset_tools import ParquetStorage
+
+### TESTS
+
+def test_hashed_vectorizer_fitted_attributes():
+    vectorizer = online_tools.HashedVectorizer(2 ** 10, tfidf=True)
+
+    assert not hasattr(vectorizer, 'vocabulary_') and not hasattr(vectorizer, 'document_counts_')
+    with pytest.raises(NotFittedError):
+        vectorizer.transform(['trout placed on the il'])
+
+    vectorizer.partial_fit(['trout placed on the il']).partial_fit(['judge hits a home run'])
+    assert vectorizer.documents_ == 2 and vectorizer.vocabulary_ == {}
+    assert vectorizer.fit(['go team']).documents_ == 1
+    assert not hasattr(clone(vectorizer), 'documents_')
+
+def test_update_online_models_without_rows(tmp_path):
+    pytest.importorskip('pyarrow')
+    storage = ParquetStorage(str(tmp_path / 'datasets'))
+    storage.write_file(storage.path('filtered2'), pd.DataFrame({'tweet': pd.Series(dtype=object),
+                                                                'injury_report': pd.Series(dtype=object)}))
+
+    assert online_tools.update_online_models(str(tmp_path / 'Online Models'), storage) is None
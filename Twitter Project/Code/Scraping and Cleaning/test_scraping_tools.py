@@ -0,0 +1,112 @@
+"""
+Scraping Tools Tests
+
+Checks run_account_scrape() with a ScrapeState on a fake search backend, so no twint search is made, and the retries
+of TransferManager on a fake Drive.
+"""
+
+import asyncio
+import csv
+import os
+import pytest
+
+scraping_tools = pytest.importorskip('scraping_tools')
+
+### HELPER FUNCTIONS
+
+def _write_incoming(output, rows):
+    with open(output, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['id', 'date', 'tweet'])
+        writer.writerows(rows)
+
+def _search(results):
+    def search(username, since, output):
+        if username not in results:
+            raise ValueError('Cannot find twitter account')
+        _write_incoming(output, results[username])
+    return search
+
+def _scrape(directory, search, userids):
+    scrape_state = scraping_tools.ScrapeState(os.path.join(directory, 'scrape_state.json'))
+    state = asyncio.run(scraping_tools.run_account_scrape(userids, search, '2021-01-01',
+                                                          os.path.join(directory, 'checkpoint.json'), rate=1000,
+                                                          backoff=0, output_directory=directory,
+                                                          scrape_state=scrape_state))
+    return state, scrape_state
+
+### TESTS
+
+def test_bad_id_row_is_failed_not_broken(tmp_path):
+    directory = str(tmp_path)
+    search = _search({'healthy': [['2', '2021-01-02 10:00:00', 'b'], ['1', '2021-01-01 09:00:00', 'a']],
+                      'malformed': [['3', '2021-01-02 10:00:00', 'c'], ['not an id', '2021-01-01 09:00:00', 'd']]})
+
+    state, scrape_state = _scrape(directory, search, ['healthy', 'malformed', 'deleted'])
+
+    assert state['done'] == ['healthy']
+    assert state['broken'] == ['deleted']
+    assert state['failed'] == ['malformed']
+    assert scrape_state.marks['account:healthy'] == {'id': 2, 'date': '2021-01-02'}
+    assert 'account:malformed' not in scrape_state.marks
+    assert not os.path.exists(os.path.join(directory, 'malformed.csv'))
+
+def test_failed_account_is_retried(tmp_path):
+    directory = str(tmp_path)
+    _scrape(directory, _search({'account': [['x', '2021-01-01 09:00:00', 'a']]}), ['account'])
+
+    state, scrape_state = _scrape(directory, _search({'account': [['5', '2021-01-01 09:00:00', 'a']]}), ['account'])
+
+    assert state['done'] == ['account'] and state['failed'] == []
+    assert scrape_state.marks['account:account']['id'] == 5
+
+class _FakeDrive:
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.metadata = []
+
+    def CreateFile(self, metadata):
+        self.metadata.append(metadata)
+        drive = self
+
+        class File:
+            def SetContentFile(self, filename):
+                pass
+
+            def Upload(self, param=None):
+                if drive.failures:
+                    drive.failures = drive.failures - 1
+                    raise IOError('upload failed')
+
+        return File()
+
+class _FakeAuth:
+
+    def Get_Http_Object(self):
+        return None
+
+def test_transfers_back_off_between_retries(tmp_path, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(scraping_tools.time, 'sleep', sleeps.append)
+    manager = scraping_tools.TransferManager(1, scraping_tools.TransferManifest(str(tmp_path / 'manifest.json')),
+                                             retries=3, backoff=2.0)
+    failures = [2]
+
+    def fetch(file_id, part, received):
+        if failures[0]:
+            failures[0] = failures[0] - 1
+            raise scraping_tools.requests.ConnectionError('dropped')
+        with open(part, 'wb') as file:
+            file.write(b'data')
+        return False
+
+    monkeypatch.setattr(manager, '_fetch', fetch)
+    assert manager.download('file', str(tmp_path / 'file'))['status'] == 'downloaded'
+    assert sleeps == [2.0, 4.0]
+
+    sleeps.clear()
+    drive = _FakeDrive(failures=3)
+    assert manager.upload(_FakeAuth(), drive, 'parent', 'copy', str(tmp_path / 'file'))['status'] == 'uploaded'
+    assert sleeps == [2.0, 4.0, 8.0]
+    assert drive.metadata[-1] == {'parents': [{'id': 'parent'}], 'id': 'copy'}
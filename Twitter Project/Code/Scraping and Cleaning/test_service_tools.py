@@ -0,0 +1,58 @@
+"""
+Service Tools Tests
+
+Checks the answers of the scoring service to malformed and empty requests, with a made up scorer so no models are
+loaded.
+"""
+
+import json
+import threading
+import urllib.error
+import urllib.request
+import pytest
+
+service_tools = pytest.importorskip('service_tools')
+
+### HELPER FUNCTIONS
+
+@pytest.fixture
+def server():
+    batches = []
+
+    def score_batch(tweets):
+        batches.append(list(tweets))
+        return [{'length': len(tweet)} for tweet in tweets]
+
+    server = service_tools.make_server(port=0, score_batch=score_batch)
+    server.batches = batches
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def _post(server, payload):
+    request = urllib.request.Request('http://127.0.0.1:%d/score' % server.server_address[1], data=payload,
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read())
+
+### TESTS
+
+@pytest.mark.parametrize('payload', [b'[]', b'"tweets"', b'3', b'null', b'{}', b'{"tweets": "a"}',
+                                     b'{"tweets": [1]}', b'not json'])
+def test_malformed_body_is_400(server, payload):
+    status, body = _post(server, payload)
+
+    assert status == 400 and 'error' in body
+
+def test_no_tweets_skip_the_batcher(server):
+    assert _post(server, b'{"tweets": []}') == (200, {'results': []})
+    assert server.batches == []
+
+def test_tweets_are_scored(server):
+    assert _post(server, json.dumps({'tweets': ['ab', 'abc']}).encode('utf-8')) == \
+        (200, {'results': [{'length': 2}, {'length': 3}]})
@@ -0,0 +1,128 @@
+"""
+Transformer Tools Tests
+
+Checks the batching, padding and sharding helpers, that the int8 quantized logits of TransformerScorer keep the
+labels of the full precision ones, and that batching by length gives the same logits as padding every batch to
+max_length. The scoring checks need torch and transformers; the checks against the fine-tuned checkpoints also need
+their folders in TRANSFORMER_CHECKPOINTS ('Checkpoints' by default, named as in transformer_tools.checkpoint_runs).
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+try:
+    import torch
+    import transformers
+except ImportError:
+    torch = None
+    transformers = None
+
+import evaluation_tools
+import transformer_tools
+
+needs_torch = pytest.mark.skipif(torch is None, reason='needs torch and transformers')
+
+here = os.path.dirname(os.path.abspath(__file__))
+checkpoints = os.environ.get('TRANSFORMER_CHECKPOINTS', os.path.join(here, 'Checkpoints'))
+test_file = os.path.join(here, '..', '..', 'Data', 'test 25-08.csv')
+model_outputs = os.path.join(here, '..', 'Model Outputs')
+
+tweets = ['Kershaw placed on the 10-day IL with back inflammation', 'What a game tonight!',
+          'Trout (calf) out of the lineup again', 'Judge hits his 30th home run', 'go team']
+
+### HELPER FUNCTIONS
+
+def _tiny_checkpoint(path):
+    words = sorted(set(' '.join(tweets).lower().split()))
+    with open(os.path.join(path, 'vocab.txt'), 'w', encoding='utf-8') as file:
+        file.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + words) + '\n')
+
+    torch.manual_seed(0)
+    config = transformers.DistilBertConfig(vocab_size=len(words) + 5, dim=64, n_layers=2, n_heads=2, hidden_dim=128,
+                                           max_position_embeddings=128, num_labels=2)
+    transformers.DistilBertForSequenceClassification(config).save_pretrained(path)
+    transformers.DistilBertTokenizer(os.path.join(path, 'vocab.txt')).save_pretrained(path)
+    return str(path)
+
+def _labels(logits):
+    return logits[:, 1] > logits[:, 0]
+
+### TESTS
+
+def test_length_batches():
+    lengths = [3, 1, 5, 2, 4]
+    batches = transformer_tools.length_batches(lengths, batch_size=2)
+    assert [batch.tolist() for batch in batches] == [[2, 4], [0, 3], [1]]
+
+    batches = transformer_tools.length_batches(lengths, batch_size=4, max_tokens=8)
+    assert sorted(np.concatenate(batches).tolist()) == list(range(len(lengths)))
+    assert all(len(batch) * max(lengths[i] for i in batch) <= 8 for batch in batches)
+
+def test_pad_batch():
+    input_ids, attention_mask = transformer_tools.pad_batch([[5, 6, 7], [8]], 0)
+    assert input_ids.tolist() == [[5, 6, 7], [8, 0, 0]]
+    assert attention_mask.tolist() == [[1, 1, 1], [1, 0, 0]]
+
+    input_ids, attention_mask = transformer_tools.pad_batch([[5, 6, 7], [8]], 1, padding_side='left', width=4)
+    assert input_ids.tolist() == [[1, 5, 6, 7], [1, 1, 1, 8]]
+    assert attention_mask.tolist() == [[0, 1, 1, 1], [0, 0, 0, 1]]
+
+def test_shard_positions():
+    lengths = [5, 1, 4, 2, 3]
+    shards = transformer_tools.shard_positions(lengths, 2)
+
+    assert sorted(np.concatenate(shards).tolist()) == list(range(len(lengths)))
+    assert [sum(lengths[i] for i in shard) for shard in shards] == [8, 7]
+    assert [len(shard) for shard in transformer_tools.shard_positions([1], 3)] == [1, 0, 0]
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_no_texts_load_nothing(workers):
+    logits = transformer_tools.score_sharded('no checkpoint here', [], workers)
+
+    assert logits.shape == (0, 2)
+
+@needs_torch
+def test_bucketed_logits_match_max_length_padding(tmp_path):
+    scorer = transformer_tools.TransformerScorer(_tiny_checkpoint(tmp_path), quantize=False, max_length=32,
+                                                 batch_size=2)
+
+    assert np.allclose(scorer.logits(tweets, bucket=True), scorer.logits(tweets, bucket=False), atol=1e-4)
+
+@needs_torch
+def test_quantized_logits_close_to_full_precision(tmp_path):
+    checkpoint = _tiny_checkpoint(tmp_path)
+    full = transformer_tools.TransformerScorer(checkpoint, quantize=False, max_length=32).logits(tweets)
+    quantized = transformer_tools.TransformerScorer(checkpoint, quantize=True, max_length=32).logits(tweets)
+
+    assert np.abs(quantized - full).max() < 0.05
+
+@needs_torch
+@pytest.mark.parametrize('name', sorted(transformer_tools.checkpoint_runs))
+def test_checkpoint_quantized_against_full_precision(name):
+    checkpoint = os.path.join(checkpoints, transformer_tools.checkpoint_runs[name])
+    if not os.path.isdir(checkpoint):
+        pytest.skip('no checkpoint at ' + checkpoint)
+
+    _, tweets_of_file = evaluation_tools.load_test_labels(test_file)
+    names, _, stored = evaluation_tools.load_model_outputs(model_outputs)
+    texts, expected = [str(tweet) for tweet in tweets_of_file[:500]], stored[names.index(name)][:500]
+
+    full = transformer_tools.TransformerScorer(checkpoint, quantize=False).logits(texts)
+    quantized = transformer_tools.TransformerScorer(checkpoint, quantize=True).logits(texts)
+
+    assert np.allclose(full, expected, atol=1e-2)
+    assert (_labels(quantized) == _labels(full)).mean() >= 0.99
+
+@needs_torch
+def test_chunk_with_nothing_to_score(tmp_path):
+    filename = str(tmp_path / 'filtered2.csv')
+    pd.DataFrame({'tweet': tweets, 'injury_report': ['0', '1', 'x', '0', 'x']}).to_csv(filename, index=False)
+    output = str(tmp_path / 'outputs.csv')
+
+    written = transformer_tools.score_transformer(_tiny_checkpoint(tmp_path), filename, output, unlabeled=True,
+                                                  workers=2, threads=1, max_length=32, chunksize=2)
+
+    assert written == 2
+    assert pd.read_csv(output, index_col=0).index.tolist() == [2, 4]
@@ -0,0 +1,321 @@
+"""
+Transformer Tools
+
+Scores tweets with the fine-tuned RoBERTa, XLNet and DistilBERT checkpoints on a CPU, giving the same P0 / P1 logits
+as the '_model_outputs.csv' files of the 'Model Outputs' folder. The linear layers of a checkpoint are quantized to
+int8 on loading (torch dynamic quantization), tweets are sorted into batches of similar length so little time is spent
+on padding, token ids are kept in a cache so a tweet is only tokenized once, and large files can be split into shards
+scored by separate processes with a share of the cores each.
+
+torch and transformers are only needed to score; the rest of the pipeline runs without them.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from feature_tools import text_keys, _save_array
+from instrument_tools import instrumented, stage, current_stage
+
+try:
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+except ImportError:
+    torch = None
+    AutoModelForSequenceClassification = None
+    AutoTokenizer = None
+
+### checkpoint_runs
+###
+### The run name of every model of the 'Model Outputs' folder, which is also the name of its exported checkpoint
+### folder (as written by simpletransformers).
+
+checkpoint_runs = {'RoBERTa': 'roberta-base-5-epochs', 'XLNet': 'xlnet-base-cased-5-epochs',
+                   'DistilBERT': 'distilbert-base-uncased-5-epochs'}
+
+### HELPER FUNCTIONS
+
+def _require_torch():
+    if torch is None:
+        raise ImportError('Transformer scoring needs torch and transformers - pip install torch transformers')
+
+### length_batches()
+###
+### Splits the positions of sequences of the given lengths into batches of similar length: positions are sorted by
+### length and cut into batches of at most batch_size sequences and max_tokens padded tokens, so every batch is padded
+### to its own longest sequence rather than the longest of the file. Batches are returned longest first, so the
+### biggest allocation happens first.
+
+def length_batches(lengths, batch_size=32, max_tokens=None):
+    lengths = np.asarray(lengths)
+    order = np.argsort(-lengths, kind='stable')
+    batches = []
+    start = 0
+
+    while start < len(order):
+        size = min(batch_size, len(order) - start)
+        if max_tokens is not None:
+            size = max(1, min(size, max_tokens // max(int(lengths[order[start]]), 1)))
+        batches.append(order[start:start + size])
+        start = start + size
+
+    return batches
+
+### pad_batch()
+###
+### input_ids and attention_mask arrays of a batch of token id sequences, padded with pad_id to the longest of them (or
+### to width) on the tokenizer's padding side (XLNet pads on the left).
+
+def pad_batch(sequences, pad_id, padding_side='right', width=None):
+    width = max(len(sequence) for sequence in sequences) if width is None else width
+    input_ids = np.full((len(sequences), width), pad_id, dtype=np.int64)
+    attention_mask = np.zeros((len(sequences), width), dtype=np.int64)
+
+    for row, sequence in enumerate(sequences):
+        if padding_side == 'left':
+            input_ids[row, width - len(sequence):] = sequence
+            attention_mask[row, width - len(sequence):] = 1
+        else:
+            input_ids[row, :len(sequence)] = sequence
+            attention_mask[row, :len(sequence)] = 1
+
+    return input_ids, attention_mask
+
+### shard_positions()
+###
+### Splits positions of sequences into `shards` lists of about the same total length: positions are dealt out longest
+### first to whichever shard is shortest so far.
+
+def shard_positions(lengths, shards):
+    totals = np.zeros(shards, dtype=np.int64)
+    parts = [[] for _ in range(shards)]
+    for position in np.argsort(-np.asarray(lengths), kind='stable'):
+        shard = int(totals.argmin())
+        parts[shard].append(int(position))
+        totals[shard] += lengths[position]
+    return [np.array(sorted(part), dtype=np.int64) for part in parts]
+
+### TokenCache
+###
+### Token ids of every tweet tokenized so far, keyed by the text_keys() hash of the tweet. encode() only tokenizes the
+### tweets it has not seen, in one batch call to the tokenizer. With a path the cache is saved there as keys.npy,
+### lengths.npy and ids.npy (every sequence end to end), and loaded again as long as the tokenizer and max_length
+### recorded in name.txt are the same.
+###
+### self.hits and self.misses count the tweets found and tokenized.
+
+class TokenCache:
+
+    def __init__(self, tokenizer, max_length=128, path=None):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.path = path
+        self.name = '%s %d' % (getattr(tokenizer, 'name_or_path', type(tokenizer).__name__), max_length)
+        self.ids = {}
+        self.hits = 0
+        self.misses = 0
+
+        if path is not None and os.path.exists(os.path.join(path, 'name.txt')):
+            with open(os.path.join(path, 'name.txt')) as file:
+                saved_name = file.read()
+            if saved_name == self.name:
+                keys, lengths, ids = [np.load(os.path.join(path, name + '.npy')) for name in ['keys', 'lengths', 'ids']]
+                self.ids = dict(zip(keys.tolist(), np.split(ids, np.cumsum(lengths)[:-1]))) if len(keys) else {}
+
+    def encode(self, texts):
+        texts = [str(text) for text in texts]
+        keys = text_keys(texts).tolist()
+        missing = list(dict.fromkeys(i for i, key in enumerate(keys) if key not in self.ids))
+
+        # Copies of the same new tweet are only tokenized once.
+        unique = {}
+        for i in missing:
+            unique.setdefault(keys[i], texts[i])
+        if unique:
+            encoded = self.tokenizer(list(unique.values()), truncation=True, max_length=self.max_length)['input_ids']
+            for key, ids in zip(unique, encoded):
+                self.ids[key] = np.asarray(ids, dtype=np.int32)
+
+        self.misses = self.misses + len(unique)
+        self.hits = self.hits + len(texts) - len(unique)
+        return [self.ids[key] for key in keys]
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        if os.path.exists(os.path.join(self.path, 'name.txt')):
+            os.remove(os.path.join(self.path, 'name.txt'))
+
+        sequences = list(self.ids.values())
+        _save_array(self.path, 'keys', np.array(list(self.ids), dtype=np.uint64))
+        _save_array(self.path, 'lengths', np.array([len(ids) for ids in sequences], dtype=np.int64))
+        _save_array(self.path, 'ids', np.concatenate(sequences) if sequences else np.zeros(0, dtype=np.int32))
+        with open(os.path.join(self.path, 'name.txt'), 'w') as file:
+            file.write(self.name)
+
+### TransformerScorer
+###
+### Loads an exported checkpoint folder (config, weights and tokenizer) for scoring on the CPU. With quantize=True every
+### nn.Linear is replaced by an int8 dynamically quantized one, which keeps the logits close to the full precision
+### ones while running a few times faster. threads sets torch's intra-op threads (all cores by default).
+###
+### logits() gives the P0 / P1 logits of a list of tweets, in their order, batched by length_batches(). With
+### bucket=False the tweets are batched in their own order and every batch is padded to max_length, as
+### simpletransformers pads every tweet to max_seq_length; this is kept as the baseline to compare against.
+
+class TransformerScorer:
+
+    def __init__(self, checkpoint, quantize=True, max_length=128, batch_size=32, max_tokens=None, threads=None,
+                 cache=None):
+        _require_torch()
+        if threads is not None:
+            torch.set_num_threads(threads)
+
+        self.checkpoint = checkpoint
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.tokenizer = AutoTokenizer.from_pretrained(checkpoint)
+        self.cache = TokenCache(self.tokenizer, max_length) if cache is None else cache
+
+        model = AutoModelForSequenceClassification.from_pretrained(checkpoint)
+        model.eval()
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+
+    def logits(self, texts, bucket=True):
+        sequences = self.cache.encode(texts)
+        lengths = [len(sequence) for sequence in sequences]
+        batches = length_batches(lengths, self.batch_size, self.max_tokens) if bucket else \
+            [np.arange(i, min(i + self.batch_size, len(sequences))) for i in range(0, len(sequences), self.batch_size)]
+
+        # Without bucketing every batch is padded to max_length, like simpletransformers' max_seq_length.
+        width = None if bucket else self.max_length
+
+        logits = np.zeros((len(sequences), 2), dtype=np.float32)
+        with torch.inference_mode():
+            for batch in batches:
+                input_ids, attention_mask = pad_batch([sequences[i] for i in batch], self.tokenizer.pad_token_id,
+                                                      self.tokenizer.padding_side, width)
+                output = self.model(input_ids=torch.from_numpy(input_ids),
+                                    attention_mask=torch.from_numpy(attention_mask))
+                logits[batch] = output.logits.float().numpy()
+
+        return logits
+
+### SHARDED SCORING
+###
+### Each worker process loads its own TransformerScorer once, with threads cores, and scores whole shards. Workers
+### are started with 'spawn', since torch's thread pools do not survive a fork.
+
+_worker = {}
+
+def _init_transformer_worker(checkpoint, quantize, max_length, batch_size, max_tokens, threads):
+    _worker['scorer'] = TransformerScorer(checkpoint, quantize, max_length, batch_size, max_tokens, threads)
+
+def _score_shard(texts):
+    return _worker['scorer'].logits(texts)
+
+### transformer_pool()
+###
+### A pool of `workers` spawned processes which each load the checkpoint once, with threads cores (the cores split
+### evenly by default). score_transformer() keeps one pool for every chunk of a file, so the checkpoint is not loaded
+### and quantized again for each chunk.
+
+def transformer_pool(checkpoint, workers, threads=None, quantize=True, max_length=128, batch_size=32, max_tokens=None):
+    _require_torch()
+    threads = max(1, (os.cpu_count() or 1) // workers) if threads is None else threads
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_transformer_worker,
+                               initargs=(checkpoint, quantize, max_length, batch_size, max_tokens, threads))
+
+def _score_shards(executor, texts, workers):
+    shards = [shard for shard in shard_positions([len(text) for text in texts], workers) if len(shard)]
+    logits = np.zeros((len(texts), 2), dtype=np.float32)
+    for shard, shard_logits in zip(shards, executor.map(_score_shard, [[texts[i] for i in shard] for shard in shards])):
+        logits[shard] = shard_logits
+    return logits
+
+### score_sharded()
+###
+### The logits of texts from `workers` processes, each scoring one shard of about the same number of characters. The
+### shards go to executor if one is given (see transformer_pool()), otherwise to a pool started for this call. With
+### workers=1 the texts are scored in this process, by scorer if one is given. No texts give an empty (0, 2) array
+### without loading anything.
+
+def score_sharded(checkpoint, texts, workers=1, threads=None, quantize=True, max_length=128, batch_size=32,
+                  max_tokens=None, scorer=None, executor=None):
+    texts = [str(text) for text in texts]
+    if not texts:
+        return np.zeros((0, 2), dtype=np.float32)
+
+    if workers == 1:
+        scorer = TransformerScorer(checkpoint, quantize, max_length, batch_size, max_tokens, threads) \
+            if scorer is None else scorer
+        return scorer.logits(texts)
+
+    if executor is not None:
+        return _score_shards(executor, texts, workers)
+    with transformer_pool(checkpoint, workers, threads, quantize, max_length, batch_size, max_tokens) as executor:
+        return _score_shards(executor, texts, workers)
+
+### write_model_outputs()
+###
+### Writes logits in the format of the '_model_outputs.csv' files: an unnamed index column, then P0 and P1.
+
+def write_model_outputs(filename, logits):
+    pd.DataFrame(np.asarray(logits), columns=['P0', 'P1']).to_csv(filename)
+
+### PIPELINE FUNCTIONS
+
+### score_transformer()
+###
+### Scores the `column` of a csv file (the unlabeled pool of filtered2.csv, or the test file) with a checkpoint and
+### writes the logits to output in the '_model_outputs.csv' format, chunksize tweets at a time so the whole pool never
+### has to be held at once. With unlabeled=True only rows labeled 'x' are scored, and the index column holds their row
+### in the file. With one worker tokenized tweets are kept in a TokenCache at cache_path (if given) between runs; with
+### more, one transformer_pool() scores every chunk. Returns the number of tweets scored.
+
+@instrumented()
+def score_transformer(checkpoint, filename='filtered2.csv', output=None, column='tweet', unlabeled=False, workers=1,
+                      threads=None, quantize=True, max_length=128, batch_size=32, max_tokens=None, cache_path=None,
+                      chunksize=100000):
+    _require_torch()
+    output = os.path.basename(os.path.normpath(checkpoint)) + '_model_outputs.csv' if output is None else output
+    columns = [column, 'injury_report'] if unlabeled else [column]
+
+    scorer, executor = None, None
+    if workers == 1:
+        scorer = TransformerScorer(checkpoint, quantize, max_length, batch_size, max_tokens, threads)
+        scorer.cache = TokenCache(scorer.tokenizer, max_length, cache_path)
+    else:
+        executor = transformer_pool(checkpoint, workers, threads, quantize, max_length, batch_size, max_tokens)
+
+    written = 0
+    try:
+        with open(output + '.tmp', 'w', newline='') as file:
+            file.write(',P0,P1\n')
+            for chunk in pd.read_csv(filename, usecols=columns, chunksize=chunksize):
+                if unlabeled:
+                    chunk = chunk[chunk['injury_report'].astype(str) == 'x']
+                texts = chunk[column].fillna('').astype(str).tolist()
+
+                with stage('score chunk', rows_in=len(texts)):
+                    logits = score_sharded(checkpoint, texts, workers, threads, quantize, max_length, batch_size,
+                                           max_tokens, scorer, executor)
+                pd.DataFrame(logits, columns=['P0', 'P1'], index=chunk.index).to_csv(file, header=False)
+                written = written + len(texts)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    os.replace(output + '.tmp', output)
+    if scorer is not None:
+        scorer.cache.save()
+    current_stage().rows(rows_out=written)
+    print(written, 'tweets scored with', checkpoint, 'into', output)
+    return written